@@ -15,8 +15,14 @@ DOCUMENT_FILE_MANAGER_KEY = Key('document_file_manager')
 
 DOCUMENT_FILTER_EXPRESSION_BUILDER_KEY = Key('document_filter_expression_builder')
 EVENT_FILTER_EXPRESSION_BUILDER_KEY = Key('event_filter_expression_builder')
+SEARCH_BACKEND_KEY = Key('search_backend')
 
 CREATOR_PROVIDER_KEY = Key('creator_provider')
+ENTITY_CACHE_FACTORY_KEY = Key('entity_cache_factory')
+ID_ALLOCATORS_KEY = Key('id_allocators')
+ARCHIVE_STATISTICS_KEY = Key('archive_statistics')
+RELATION_INDEX_KEY = Key('relation_index')
+DAO_SERVICES_KEY = Key('dao_services')
 
 CREATOR_DAO_KEY = Key('erfasser_dao')
 REGISTRY_DAO_KEY = Key('registry_dao')
@@ -36,6 +42,7 @@ FILE_FORMAT_SERVICE = Key('file_format_service')
 CREATOR_SERVICE_KEY = Key('creator_service')
 DATABASE_UPGRADE_SERVICE_KEY = Key('database_upgrade_service')
 DOCUMENT_FILE_PROVIDER = Key('document_file_provider')
+BULK_IMPORT_SERVICE_KEY = Key('bulk_import_service')
 
 DOCUMENT_PDF_GENERATOR_KEY = Key('document_pdf_generator')
 PDF_HANDLERS_KEY = Key('pdf_handlers')
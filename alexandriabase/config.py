@@ -234,6 +234,27 @@ class Config:
                         lambda self, value: self._set_string_value('dbengine', value))
     dbname = property(lambda self: self._get_string_value('dbname'), 
                       lambda self, value: self._set_string_value('dbname', value))
+    dbpoolsize = property(lambda self: self._get_string_value('dbpoolsize'), 
+                          lambda self, value: self._set_string_value('dbpoolsize', value))
+    dbmaxoverflow = property(lambda self: self._get_string_value('dbmaxoverflow'), 
+                             lambda self, value: self._set_string_value('dbmaxoverflow', value))
+    dbpoolpreping = property(lambda self: self._get_string_value('dbpoolpreping'), 
+                             lambda self, value: self._set_string_value('dbpoolpreping', value))
+    dbpoolrecycle = property(lambda self: self._get_string_value('dbpoolrecycle'), 
+                             lambda self, value: self._set_string_value('dbpoolrecycle', value))
+    dbquerycachesize = property(lambda self: self._get_string_value('dbquerycachesize'), 
+                                lambda self, value: self._set_string_value('dbquerycachesize',
+                                                                           value))
+    idblocksize = property(lambda self: self._get_string_value('idblocksize'), 
+                           lambda self, value: self._set_string_value('idblocksize', value))
+    importtransactionsize = property(
+        lambda self: self._get_string_value('importtransactionsize'), 
+        lambda self, value: self._set_string_value('importtransactionsize', value))
+    importbatchsize = property(lambda self: self._get_string_value('importbatchsize'), 
+                               lambda self, value: self._set_string_value('importbatchsize',
+                                                                          value))
+    relationindex = property(lambda self: self._get_string_value('relationindex'), 
+                             lambda self, value: self._set_string_value('relationindex', value))
     filetypes = property(lambda self: self._get_list_value('filetypes'), 
                          lambda self, value: self._set_list_value('filetypes', value))
     storage_locations = property(lambda self: self._get_list_value('storagelocations'), 
@@ -242,6 +263,13 @@ class Config:
                                lambda self, value: self._set_map_value('filetypealiases', value))
     filetypeviewers = property(lambda self: self._get_map_value('filetypeviewers'), 
                                lambda self, value: self._set_map_value('filetypeviewers', value))
+    entitycaches = property(lambda self: self._get_map_value('entitycaches'), 
+                            lambda self, value: self._set_map_value('entitycaches', value))
+    searchbackend = property(lambda self: self._get_string_value('searchbackend'), 
+                             lambda self, value: self._set_string_value('searchbackend', value))
+    cachecheckinterval = property(lambda self: self._get_string_value('cachecheckinterval'), 
+                                  lambda self, value: self._set_string_value('cachecheckinterval',
+                                                                             value))
     logdir = property(lambda self: self._get_string_value('logdir'), 
                       lambda self, value: self._set_string_value('logdir', value))
     djangodb = property(lambda self: self._get_string_value('djangodb'), 
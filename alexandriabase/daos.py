@@ -3,10 +3,23 @@ Created on 07.02.2018
 
 @author: michael
 '''
-from threading import Lock
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from itertools import groupby
+import logging
+from threading import Lock, Thread
+import time
+import uuid
+from weakref import ref
 from sqlalchemy.sql.expression import or_, select, and_, delete, insert, update,\
-    join
+    join, union_all, text, table, column, literal_column, bindparam, case, null, literal,\
+    exists
 from sqlalchemy.sql.functions import func
+from sqlalchemy.dialects import postgresql
 from _functools import reduce
 
 from alexandriabase import _
@@ -20,8 +33,29 @@ from sqlalchemy.sql.schema import Column, Table, ForeignKey, MetaData
 from sqlalchemy.sql.sqltypes import Integer, String, Date
 from sqlalchemy.engine import create_engine
 from sqlalchemy.pool import StaticPool
-
-CURRENT_VERSION = '0.5'
+from sqlalchemy.exc import IntegrityError
+from alexandriabase.config import NoSuchConfigValue
+
+CURRENT_VERSION = '0.6'
+
+# Number of rows fetched per round trip when iterating over large tables
+DEFAULT_BATCH_SIZE = 500
+# Maximum number of filter expressions whose counts are remembered
+COUNT_CACHE_SIZE = 100
+# Maximum number of values in one IN list
+IN_LIST_CHUNK_SIZE = 500
+# Number of filter objects whose expressions are remembered by a builder
+FILTER_EXPRESSION_CACHE_SIZE = 128
+# Number of entities a record cursor holds around the current position
+DEFAULT_CURSOR_WINDOW_SIZE = 50
+# Number of ids an id allocator reserves at once on database servers
+DEFAULT_ID_BLOCK_SIZE = 50
+# Attempts to reserve an id block before giving up on concurrent reservations
+ID_BLOCK_RESERVATION_ATTEMPTS = 10
+# Seconds between two checks of the version stamp of a cache
+DEFAULT_CACHE_CHECK_INTERVAL = 5
+# Number of hops followed by default when collecting cross referenced events
+DEFAULT_CROSS_REFERENCE_DEPTH = 2
 
 ALEXANDRIA_METADATA = MetaData()
 
@@ -147,6 +181,14 @@ def get_joins_for_expression(expression, from_table):
         
     return joins
 
+def split_into_chunks(values, chunk_size=IN_LIST_CHUNK_SIZE):
+    '''
+    Splits a list of values into lists of at most chunk_size
+    values, for example to keep IN lists at a reasonable size.
+    '''
+    values = list(values)
+    return [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+
 def combine_expressions(expressions, method):
     '''
     Combines the different expressions with and.
@@ -158,6 +200,44 @@ def combine_expressions(expressions, method):
     else:
         return method(*expressions)
 
+# Maps database engines to the connection of the currently open
+# connection scope. Context variables keep the scopes of different
+# threads and asyncio tasks apart.
+_SCOPED_CONNECTIONS = ContextVar('scoped_connections', default=None)
+
+@contextmanager
+def connection_scope(db_engine):
+    '''
+    Context manager for a unit of work: all daos using the given
+    engine share one connection while the with block is executed.
+    The connection is returned to the pool when the block is left.
+    Nested scopes reuse the connection of the outermost scope.
+    '''
+    scoped_connections = _SCOPED_CONNECTIONS.get()
+    if scoped_connections is not None and db_engine in scoped_connections:
+        yield scoped_connections[db_engine]
+        return
+    
+    connection = db_engine.connect()
+    new_scoped_connections = dict(scoped_connections or {})
+    new_scoped_connections[db_engine] = connection
+    token = _SCOPED_CONNECTIONS.set(new_scoped_connections)
+    try:
+        yield connection
+    finally:
+        _SCOPED_CONNECTIONS.reset(token)
+        connection.close()
+
+def get_scoped_connection(db_engine):
+    '''
+    Returns the connection of the current connection scope for
+    the engine or None, if there is no open scope.
+    '''
+    scoped_connections = _SCOPED_CONNECTIONS.get()
+    if scoped_connections is None:
+        return None
+    return scoped_connections.get(db_engine)
+
 class NestedTransactionsException(Exception):
     '''
     Currently we do not allow nested transactions. When this is
@@ -165,40 +245,161 @@ class NestedTransactionsException(Exception):
     '''
     pass
 
+class RollbackOnlyTransactionException(Exception):
+    '''
+    Raised by the outermost transactional call, when a nested call
+    failed and the exception has been caught: the work of the
+    nested call can't be committed, so the transaction has been
+    rolled back instead.
+    '''
+    pass
+
+def get_like_pattern(searchterm):
+    '''
+    Returns the LIKE pattern that finds the search term anywhere in
+    a text. Wildcards in the search term are escaped with a backslash,
+    so they only match themselves.
+    '''
+    escaped = searchterm.replace('\\', '\\\\').\
+        replace('%', '\\%').replace('_', '\\_')
+    return '%%%s%%' % escaped
+
+class LikeSearchBackend:
+    '''
+    Default search backend: finds search terms with LIKE,
+    which works on every database but can't use indexes.
+    '''
+
+    def build_searchterm_expression(self, textcolumn, searchterm, case_sensitive):
+        '''
+        Returns the expression that finds the search term in the
+        text column.
+        '''
+        # pylint: disable=no-self-use
+        if case_sensitive:
+            return textcolumn.like(get_like_pattern(searchterm), escape='\\')
+        # We can't use pythons upper() function here because the
+        # database might have another implementation than python
+        # postgres: ß -> ß, Python: ß -> SS
+        return func.upper(textcolumn).like(func.upper(get_like_pattern(searchterm)),
+                                           escape='\\')
+
+class PostgresSearchBackend(LikeSearchBackend):
+    '''
+    Search backend for PostgreSQL. It compares the upper case text
+    like the like backend, which can use the trigram indexes on
+    upper(beschreibung) and upper(ereignis) created by the database
+    upgrade. Case sensitive searches check the matches against the
+    original text, so the results are the same as with the like
+    backend.
+    '''
+
+    def build_searchterm_expression(self, textcolumn, searchterm, case_sensitive):
+        expression = super().build_searchterm_expression(textcolumn, searchterm, False)
+        if case_sensitive:
+            expression = and_(expression, super().build_searchterm_expression(
+                textcolumn, searchterm, True))
+        return expression
+
+class SqliteFtsSearchBackend(LikeSearchBackend):
+    '''
+    Search backend for SQLite. The text columns are indexed in FTS5
+    shadow tables with trigram tokenizer, which the database upgrade
+    creates together with the triggers that keep them in sync with
+    the entity tables. Search terms become a lookup in the shadow
+    table. The trigram index can't find terms shorter than three
+    characters, these are still searched with LIKE.
+    '''
+
+    def build_searchterm_expression(self, textcolumn, searchterm, case_sensitive):
+        if len(searchterm) < 3:
+            return super().build_searchterm_expression(textcolumn, searchterm, case_sensitive)
+        entity_table = textcolumn.table
+        shadow_table_name = '%s_fts' % entity_table.name
+        shadow_table = table(shadow_table_name, column('rowid'))
+        primary_key = list(entity_table.primary_key.columns)[0]
+        match = '"%s"' % searchterm.replace('"', '""')
+        expression = primary_key.in_(
+            select([shadow_table.c.rowid]).where(
+                literal_column(shadow_table_name).op('MATCH')(match)))
+        if case_sensitive:
+            # The trigram index ignores case, so check the matches again
+            expression = and_(expression,
+                              textcolumn.like(get_like_pattern(searchterm), escape='\\'))
+        return expression
+
+SEARCH_BACKENDS = {'like': LikeSearchBackend,
+                   'postgres': PostgresSearchBackend,
+                   'sqlitefts': SqliteFtsSearchBackend}
+
+def _freeze_value(value):
+    '''
+    Converts a filter attribute into a hashable value that is equal
+    for equal attribute values.
+    '''
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze_value(element) for element in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze_value(element)) for key, element in value.items()))
+    if hasattr(value, '__dict__'):
+        return (type(value), _freeze_value(vars(value)))
+    return value
+
+class FilterKey:
+    '''
+    Hashable wrapper for filter objects. Two keys are equal, if the
+    filter objects are of the same class and have the same attribute
+    values at the time the keys were created.
+    '''
+    
+    def __init__(self, filter_object):
+        self.filter_object = filter_object
+        self.values = _freeze_value(filter_object)
+
+    def __eq__(self, other):
+        return isinstance(other, FilterKey) and self.values == other.values
+
+    def __hash__(self):
+        return hash(self.values)
+
 class GenericFilterExpressionBuilder:
     '''
     Has common functinality for filter expression builders for
-    documents and events
+    documents and events. The builders have no state besides the
+    memo of the last FILTER_EXPRESSION_CACHE_SIZE expressions, so
+    they may be used concurrently.
     '''
-    def __init__(self):
+    def __init__(self, search_backend=None):
         self.table = None
         self.textcolumn = None
-        self.expressions = []
-        self.lock = Lock()
+        if search_backend is None:
+            search_backend = LikeSearchBackend()
+        self.search_backend = search_backend
+        self._create_memoized_expression = lru_cache(maxsize=FILTER_EXPRESSION_CACHE_SIZE)(
+            self._create_expression_for_key)
 
     def create_filter_expression(self, filter_object):
         '''
         Creates the expression
         '''
-        with self.lock:
-            self.expressions = []
-            self._create_expressions(filter_object)
-            return combine_expressions(self.expressions, and_)
+        return self._create_memoized_expression(FilterKey(filter_object))
 
-    def _create_expressions(self, filter_object):
+    def _create_expression_for_key(self, filter_key):
         '''
-        Creates the different filter expressions that then will be combined
-        with and. Should be expanded in child classes.
+        Creates the expression for the filter object of the key.
         '''
-        self._append_expression(self._build_searchterm_expression(filter_object))
+        expressions = [expression for expression
+                       in self._create_expressions(filter_key.filter_object)
+                       if expression is not None]
+        return combine_expressions(expressions, and_)
 
-    def _append_expression(self, expression):
+    def _create_expressions(self, filter_object):
         '''
-        Adds an expression (if it is not None) to the list of expressions
-        that will be combined with 'and' in the end.
+        Returns the list of the different filter expressions that then will be
+        combined with and. None entries are ignored. Should be expanded in
+        child classes.
         '''
-        if not isinstance(expression, type(None)):
-            self.expressions.append(expression)
+        return [self._build_searchterm_expression(filter_object)]
 
     def _build_searchterm_expression(self, filter_object):
         '''
@@ -206,9 +407,8 @@ class GenericFilterExpressionBuilder:
         '''
         subexpression_list = self._build_searchterm_expressions(filter_object)
         if filter_object.combine_searchterms_by_or:
-            self._append_expression(combine_expressions(subexpression_list, or_))
-        else:
-            self._append_expression(combine_expressions(subexpression_list, and_))
+            return combine_expressions(subexpression_list, or_)
+        return combine_expressions(subexpression_list, and_)
 
     def _build_searchterm_expressions(self, filter_object):
         '''
@@ -217,87 +417,546 @@ class GenericFilterExpressionBuilder:
         searchterm_expressions = []
         for searchterm in filter_object.searchterms:
             if searchterm != None and searchterm != '':
-                if filter_object.case_sensitive:
-                    searchterm_expressions.append(
-                        self.textcolumn.contains(searchterm))
-                else:
-                    # We can't use pythons upper() function here because the
-                    # database might have another implementation than python
-                    # postgres: ß -> ß, Python: ß -> SS
-                    searchterm_expressions.append(
-                        func.upper(self.textcolumn).contains(func.upper(searchterm)))
+                searchterm_expressions.append(
+                    self.search_backend.build_searchterm_expression(
+                        self.textcolumn, searchterm, filter_object.case_sensitive))
         return searchterm_expressions
 
 
+# Maps the daos to the state of their running transaction. Context
+# variables keep the transactions of different threads and asyncio
+# tasks apart.
+_TRANSACTION_STATES = ContextVar('transaction_states', default=None)
+
+class TransactionState:
+    '''
+    The connection, the transaction and the nesting level of a
+    running transaction. rollback_only is set when a nested call
+    failed, so the transaction may not be committed any more.
+    '''
+    # pylint: disable=too-few-public-methods
+    
+    def __init__(self, connection):
+        self.connection = connection
+        self.transaction = connection.begin()
+        self.level = 1
+        self.rollback_only = False
+        self.after_commit = OrderedDict()
+
+class IdAllocator:
+    '''
+    Hands out the ids for new rows of a table. On database servers
+    it works as hi/lo allocator: blocks of block_size ids are reserved
+    in the registry table in a separate transaction, using a compare
+    and swap update, so concurrent processes get disjoint blocks and
+    most inserts need no query at all for their id. The reservation
+    never starts below max(id) + 1, so rows inserted without the
+    allocator are respected.
+
+    SQLite allows only one writer at a time, and a separate
+    transaction would block on the lock of the inserting transaction.
+    So there the registry row is written in the inserting transaction
+    (which takes the write lock), the ids start at max(id) + 1 and
+    are valid until the end of that transaction.
+    '''
+
+    def __init__(self, id_column, block_size=DEFAULT_ID_BLOCK_SIZE,
+                 separate_transaction=True):
+        self.id_column = id_column
+        self.key = 'idblock.%s' % id_column.table.name
+        self.block_size = block_size
+        self.separate_transaction = separate_transaction
+        self.next_id = None
+        self.block_end = None
+        self.block_transaction = None
+        self.lock = Lock()
+        self.registry_query = select([REGISTRY_TABLE.c.wert]).where(
+            REGISTRY_TABLE.c.schluessel == self.key)
+        self.max_id_query = select([func.max(id_column)])
+
+    def allocate(self, connection):
+        '''
+        Returns the next id. The connection is the one of the
+        inserting transaction.
+        '''
+        with self.lock:
+            if not self._is_block_valid(connection):
+                if self.separate_transaction:
+                    self.next_id, self.block_end = self._reserve_block(connection.engine)
+                else:
+                    self.next_id, self.block_end = self._reserve_in_transaction(connection)
+                    self.block_transaction = ref(connection.get_transaction())
+            entity_id = self.next_id
+            self.next_id += 1
+            return entity_id
+
+    def _is_block_valid(self, connection):
+        '''
+        Checks if there are ids left that may be used on the connection.
+        '''
+        if self.next_id is None:
+            return False
+        if self.separate_transaction:
+            return self.next_id < self.block_end
+        transaction = self.block_transaction and self.block_transaction()
+        return transaction is not None and transaction.is_active and \
+            transaction is connection.get_transaction()
+
+    def _get_start(self, connection, reserved):
+        '''
+        The first free id: behind the reserved ids and the existing rows.
+        '''
+        result = connection.execute(self.max_id_query)
+        max_id = result.fetchone()[0]
+        result.close()
+        return max(int(reserved or 0), (max_id or 0) + 1)
+
+    def _read_reserved(self, connection):
+        '''
+        Reads the end of the last reserved block from the registry.
+        '''
+        result = connection.execute(self.registry_query)
+        row = result.fetchone()
+        result.close()
+        return None if row is None else row[0]
+
+    def _write_reserved(self, connection, old_value, new_value):
+        '''
+        Writes the end of the new block, if nobody else did in the
+        meantime. Returns False if the value has been changed.
+        '''
+        if old_value is None:
+            connection.execute(insert(REGISTRY_TABLE).values(
+                schluessel=self.key, wert=new_value))
+            return True
+        result = connection.execute(update(REGISTRY_TABLE).values(wert=new_value).where(
+            and_(REGISTRY_TABLE.c.schluessel == self.key,
+                 REGISTRY_TABLE.c.wert == old_value)))
+        return result.rowcount == 1
+
+    def _reserve_block(self, db_engine):
+        '''
+        Reserves a block in a transaction of its own and returns the
+        first id and the end of the block.
+        '''
+        connection = db_engine.connect()
+        try:
+            for _attempt in range(ID_BLOCK_RESERVATION_ATTEMPTS):
+                transaction = connection.begin()
+                try:
+                    reserved = self._read_reserved(connection)
+                    start = self._get_start(connection, reserved)
+                    end = start + self.block_size
+                    if self._write_reserved(connection, reserved, str(end)):
+                        transaction.commit()
+                        return start, end
+                    transaction.rollback()
+                except IntegrityError:
+                    # Another process created the registry entry first
+                    transaction.rollback()
+                except:
+                    transaction.rollback()
+                    raise
+        finally:
+            connection.close()
+        raise DataError(_("Could not reserve ids for table %s.") % self.id_column.table.name)
+
+    def _reserve_in_transaction(self, connection):
+        '''
+        Writes the registry entry in the current transaction to
+        get the write lock and returns the first free id. The
+        block has no end, it is only valid for the transaction.
+        '''
+        reserved = self._read_reserved(connection)
+        self._write_reserved(connection, reserved, reserved or '0')
+        return self._get_start(connection, None), None
+
+class IdAllocators:
+    '''
+    The id allocators of the tables. They are shared by all daos
+    on the same engine, so daos writing to the same table (like the
+    document and the document file info dao) take their ids from the
+    same blocks. The block size is read from the "idblocksize"
+    configuration entry.
+    '''
+
+    @inject
+    def __init__(self,
+                 db_engine: baseinjectorkeys.DB_ENGINE_KEY,
+                 config: baseinjectorkeys.CONFIG_KEY=None):
+        self.db_engine = db_engine
+        self.block_size = DEFAULT_ID_BLOCK_SIZE
+        try:
+            if config is not None and config.idblocksize:
+                self.block_size = int(config.idblocksize)
+        except NoSuchConfigValue:
+            pass
+        self.lock = Lock()
+        self.allocators = {}
+
+    def get(self, id_column):
+        '''
+        Returns the id allocator for the table of the id column.
+        '''
+        with self.lock:
+            allocator = self.allocators.get(id_column.table.name)
+            if allocator is None:
+                allocator = IdAllocator(
+                    id_column, self.block_size,
+                    separate_transaction=self.db_engine.dialect.name != 'sqlite')
+                self.allocators[id_column.table.name] = allocator
+            return allocator
+
+class ArchiveStatistics:
+    '''
+    Snapshot of the numbers of documents, of document table rows by
+    file type and of events. It is computed in one pass over the
+    document and event tables on first use and then kept up to date
+    by the insert and delete paths of the daos, which report their
+    changes after the commit. Changes made by other processes are
+    picked up by recomputing the snapshot, when it is older than the
+    cache check interval. refresh() recomputes it at once.
+    '''
+
+    @inject
+    def __init__(self, cache_factory: baseinjectorkeys.ENTITY_CACHE_FACTORY_KEY=None):
+        self.lock = Lock()
+        self.loaded = False
+        self.max_age = cache_factory.get_check_interval() if cache_factory \
+            else DEFAULT_CACHE_CHECK_INTERVAL
+        self.clock = time.monotonic
+        self.loaded_at = None
+        self.number_of_documents = 0
+        self.number_of_events = 0
+        self.rows_by_file_type = Counter()
+        self.query = union_all(
+            self.get_document_counts_query(),
+            select([literal('event'), null(), func.count(), literal_column('0')]).\
+                select_from(EVENT_TABLE))
+
+    @staticmethod
+    def get_document_counts_query(condition=None):
+        '''
+        Counts the rows of the document table by file type, with the
+        number of document rows in the last column.
+        '''
+        query = select([literal('document'),
+                        DOCUMENT_TABLE.c.dateityp,
+                        func.count(),
+                        func.sum(case([(DOCUMENT_TABLE.c.hauptnr == DOCUMENT_TABLE.c.laufnr, 1)],
+                                      else_=0))])
+        if condition is not None:
+            query = query.where(condition)
+        return query.group_by(DOCUMENT_TABLE.c.dateityp)
+
+    def is_outdated(self):
+        '''
+        Tells if the snapshot has not been loaded yet or is older
+        than the maximum age.
+        '''
+        return not self.loaded or self.clock() >= self.loaded_at + self.max_age
+
+    def refresh(self, connection):
+        '''
+        Recomputes the snapshot from the database.
+        '''
+        loaded_at = self.clock()
+        result = connection.execute(self.query)
+        rows = result.fetchall()
+        result.close()
+        with self.lock:
+            self.number_of_documents = 0
+            self.number_of_events = 0
+            self.rows_by_file_type = Counter()
+            for source, file_type, row_count, document_count in rows:
+                if source == 'event':
+                    self.number_of_events = row_count
+                else:
+                    self.rows_by_file_type[file_type] = row_count
+                    self.number_of_documents += document_count or 0
+            self.loaded = True
+            self.loaded_at = loaded_at
+
+    def record(self, rows_by_file_type=None, documents=0, events=0):
+        '''
+        Applies the changes of a committed transaction. Changes before
+        the first load are already part of the loaded numbers.
+        '''
+        with self.lock:
+            if not self.loaded:
+                return
+            self.rows_by_file_type.update(rows_by_file_type or {})
+            self.number_of_documents += documents
+            self.number_of_events += events
+
+    def get_document_statistics(self, file_types):
+        '''
+        Returns the document statistics for the given file types.
+        '''
+        statistics = DocumentStatistics()
+        with self.lock:
+            statistics.number_of_documents = self.number_of_documents
+            statistics.number_of_files = sum(self.rows_by_file_type.values())
+            for file_type in file_types:
+                if self.rows_by_file_type[file_type] > 0:
+                    statistics.number_of_files_by_type[file_type] = \
+                        self.rows_by_file_type[file_type]
+        return statistics
+
+    def get_event_statistics(self):
+        '''
+        Returns the event statistics.
+        '''
+        statistics = EventStatistics()
+        statistics.number_of_events = self.number_of_events
+        return statistics
+
+class DaoServices:
+    '''
+    The state shared by all daos on the same engine: the id
+    allocators, the statistics snapshot, the relation index (None
+    if it is not enabled) and the data generation, the number of
+    changes written through the daos. Cached data derived from
+    several tables, like the filtered counts, compares the data
+    generation to see if it is outdated.
+    '''
+
+    @inject
+    def __init__(self,
+                 id_allocators: baseinjectorkeys.ID_ALLOCATORS_KEY,
+                 archive_statistics: baseinjectorkeys.ARCHIVE_STATISTICS_KEY,
+                 relation_index: baseinjectorkeys.RELATION_INDEX_KEY=None):
+        self.id_allocators = id_allocators
+        self.archive_statistics = archive_statistics
+        self.relation_index = relation_index
+        self.lock = Lock()
+        self.data_generation = 0
+
+    def advance_data_generation(self):
+        '''
+        Tells the cached data that the database has changed.
+        '''
+        with self.lock:
+            self.data_generation += 1
+
 class GenericDao:
     '''
     Common functionality for all daos
+    
+    The daos are singletons, so the state of a running transaction
+    is kept in a context variable: Each thread and each asyncio task
+    sees only its own transaction.
+
+    The state shared with the other daos comes with the dao
+    services. Daos created without them get services of their own.
     '''
 
-    def __init__(self, db_engine):
+    def __init__(self, db_engine, dao_services=None):
         self.db_engine = db_engine
-        self.transactional_connection = None
-        self.transaction_level = 0
-        self.transaction = None
+        if dao_services is None:
+            dao_services = DaoServices(IdAllocators(db_engine), ArchiveStatistics())
+        self.dao_services = dao_services
+        self.statements = {}
+
+    def _get_statement(self, key, factory):
+        '''
+        Returns the statement for the key, creating it with the factory
+        on first use. The hot queries are built once this way with bound
+        parameters, so neither the statement construction nor the
+        statement compilation (which the engine caches by statement
+        structure) has to be repeated on every call.
+        '''
+        statement = self.statements.get(key)
+        if statement is None:
+            statement = factory()
+            self.statements[key] = statement
+        return statement
         
+    def _get_transaction_state_value(self, attribute, default):
+        '''
+        Returns an attribute of the transaction state of the current
+        context or the default, if there is no running transaction.
+        '''
+        state = self._get_transaction_state()
+        if state is None:
+            return default
+        return getattr(state, attribute)
+
+    def _get_transaction_state(self):
+        '''
+        Returns the state of the running transaction of the dao in
+        the current context or None.
+        '''
+        transaction_states = _TRANSACTION_STATES.get()
+        if transaction_states is None:
+            return None
+        return transaction_states.get(self)
+
+    def _set_transaction_state(self, state):
+        '''
+        Sets the transaction state of the dao in the current context
+        and returns the token to reset it.
+        '''
+        transaction_states = dict(_TRANSACTION_STATES.get() or {})
+        transaction_states[self] = state
+        return _TRANSACTION_STATES.set(transaction_states)
+
+    transactional_connection = property(
+        lambda self: self._get_transaction_state_value('connection', None))
+    transaction = property(
+        lambda self: self._get_transaction_state_value('transaction', None))
+    transaction_level = property(
+        lambda self: self._get_transaction_state_value('level', 0))
+
     def _get_connection(self):
         '''
-        Returns a new connection, if no transaction is running,
-        else returns the transactional connection.
+        Returns the transactional connection, if a transaction is
+        running, else the connection of the current connection scope.
+        Statements outside of both have to open a connection scope
+        for their connection, see connection_scope().
         '''
         if self.transactional_connection != None:
             return self.transactional_connection
-        return self.db_engine.connect()
+        scoped_connection = get_scoped_connection(self.db_engine)
+        if scoped_connection is not None:
+            return scoped_connection
+        raise DataError(_("No connection: Neither a transaction nor a connection scope is open."))
+
+    def connection_scope(self):
+        '''
+        Returns a context manager that shares one connection for all
+        daos on the same engine. See connection_scope().
+        '''
+        return connection_scope(self.db_engine)
+
+    @contextmanager
+    def _use_connection(self):
+        '''
+        Context manager providing the connection for statements: the
+        transactional connection, the connection of the current
+        connection scope or else a new connection, that goes back to
+        the pool when the with block is left. So results have to be
+        read inside the with block.
+        '''
+        connection = self.transactional_connection
+        if connection is None:
+            connection = get_scoped_connection(self.db_engine)
+        if connection is not None:
+            yield connection
+            return
+        with self.db_engine.connect() as connection:
+            yield connection
 
     def transactional(self, function, *args, **kwargs):
         '''
         Method to run a method transactional.
-        '''
-        if self.transactional_connection is None:
-            self.transactional_connection = self.db_engine.connect()
-            self.transaction = self.transactional_connection.begin()
-            self.transaction_level = 1
-        else:
-            self.transaction_level += 1
-            
+
+        Nested calls join the running transaction. If a nested call
+        fails, the transaction is marked as rollback only and rolled
+        back by the outermost call. When the outermost call catches
+        the exception and returns normally, it raises a
+        RollbackOnlyTransactionException instead of committing.
+        '''
+        state = self._get_transaction_state()
+        if state is not None:
+            state.level += 1
+            try:
+                return function(*args, **kwargs)
+            except:
+                state.rollback_only = True
+                raise
+            finally:
+                state.level -= 1
+
+        state = TransactionState(self.db_engine.connect())
+        token = self._set_transaction_state(state)
         try:
             return_value = function(*args, **kwargs)
-            if self.transaction_level == 1:
-                self.transaction.commit()
-                self.transactional_connection = None
-                self.transaction_level = 0
-            else:
-                self.transaction_level -= 1
-            return return_value
+            if state.rollback_only:
+                raise RollbackOnlyTransactionException(
+                    _("A nested transactional call failed, the transaction has been rolled back."))
+            state.transaction.commit()
         except:
-            self.transaction.rollback()
-            self.transactional_connection = None
-            self.transaction_level = 0
+            if state.transaction.is_active:
+                state.transaction.rollback()
             raise
+        finally:
+            state.connection.close()
+            _TRANSACTION_STATES.reset(token)
+        for callback in state.after_commit.values():
+            callback()
+        return return_value
+
+    def _after_commit(self, callback, key=None):
+        '''
+        Registers a callback that runs when the running transaction
+        has been committed. It is dropped on rollback. Without
+        transaction the callback runs at once. Of the callbacks
+        registered with the same key only the first one runs.
+        '''
+        state = self._get_transaction_state()
+        if state is None:
+            callback()
+        else:
+            state.after_commit.setdefault(key or object(), callback)
 
-    def _get_exactly_one_row(self, query):
+    def _data_changed(self):
+        '''
+        Outdates the data cached for the engine, once for the
+        running transaction and again when it is committed.
+        '''
+        self.dao_services.advance_data_generation()
+        self._after_commit(self.dao_services.advance_data_generation)
+
+    def _update_relation_index(self, update_index):
+        '''
+        Applies a change of the document event references to the
+        relation index when the transaction is committed. After the
+        commit the new version of the index is written once per
+        transaction, to tell the other processes to reload their
+        index. Does nothing if the relation index is not enabled.
+        '''
+        relation_index = self.dao_services.relation_index
+        if relation_index is None:
+            return
+        self._after_commit(lambda: update_index(relation_index))
+        self._after_commit(lambda: self._bump_relation_index(relation_index),
+                           'bump_relation_index')
+
+    def _bump_relation_index(self, relation_index):
+        '''
+        Writes the new version of the relation index in a transaction
+        of its own, so the registry row is not locked by the
+        transactions changing the references.
+        '''
+        self.transactional(lambda: relation_index.version_stamp.bump(self.connection))
+
+    def _get_exactly_one_row(self, query, parameters=None):
         '''
         Helper method that expects a query to return
         exactly one row.
         '''
 
-        result = self.connection.execute(query)
-        row = result.fetchone()
-        result.close()
+        with self._use_connection() as connection:
+            result = connection.execute(query, parameters or {})
+            row = result.fetchone()
+            result.close()
 
         if not row:
-            raise NoSuchEntityException("Did not find entity for query '%s'" % query)
+            raise NoSuchEntityException("Did not find entity for query '%s' (parameters %s)" %
+                                        (query, parameters))
 
         return row
 
-    def _get_one_row_or_none(self, query):
+    def _get_one_row_or_none(self, query, parameters=None):
         '''
         Helper method to get not more than one row from query
         '''
 
-        result = self.connection.execute(query)
-        row = result.fetchone()
-        result.close()
+        with self._use_connection() as connection:
+            result = connection.execute(query, parameters or {})
+            row = result.fetchone()
+            result.close()
 
         if not row:
             return None
@@ -311,8 +970,8 @@ class EntityDao(GenericDao):
     Common functionality for all daos
     '''
 
-    def __init__(self, db_engine, table):
-        super().__init__(db_engine)
+    def __init__(self, db_engine, table, dao_services=None):
+        super().__init__(db_engine, dao_services)
         self.table = table
         primary_keys = table.primary_key.columns
         if len(primary_keys) != 1:
@@ -322,38 +981,52 @@ class EntityDao(GenericDao):
         self.primary_key = primary_keys[key_key]
         self.select_column = self.primary_key
         self.foreign_keys = get_foreign_keys(self.primary_key)
+        # Totals of find_with_count by filter expression, valid for
+        # one data generation and at most count_cache_ttl seconds,
+        # because other processes can't invalidate them
+        self.count_cache = {}
+        self.count_cache_ttl = DEFAULT_CACHE_CHECK_INTERVAL
+        self.clock = time.monotonic
+        # Incremented on every change, so derived data like cursor
+        # windows know when they are outdated
+        self.modification_count = 0
+        # Tables of related entities that are joined into the
+        # entity queries as tuples of table and join condition
+        self.eager_joins = []
+        self.eager_loading = False
     
-    def _get_exactly_one(self, query):
+    def _get_exactly_one(self, query, parameters=None):
         '''
         Gets exactly one entity from the database, throws exception
         when no result is found.
         '''
 
-        row = self._get_exactly_one_row(query)
+        row = self._get_exactly_one_row(query, parameters)
 
         return self._row_to_entity(row)
 
-    def _get_one_or_none(self, query):
+    def _get_one_or_none(self, query, parameters=None):
         '''
         Get one entity from the database, the result may also be
         empty.
         '''
 
-        row = self._get_one_row_or_none(query)
+        row = self._get_one_row_or_none(query, parameters)
 
         if row is None:
             return None
 
         return self._row_to_entity(row)
 
-    def _get_list(self, query):
+    def _get_list(self, query, parameters=None):
         '''
         Execute a query that returns a list.
         '''
 
-        result = self.connection.execute(query)
-        rows = result.fetchall()
-        result.close()
+        with self._use_connection() as connection:
+            result = connection.execute(query, parameters or {})
+            rows = result.fetchall()
+            result.close()
 
         return self._rows_to_entities(rows)
 
@@ -374,11 +1047,70 @@ class EntityDao(GenericDao):
             entities.append(self._row_to_entity(row))
         return entities
 
+    def _get_related_entity(self, dao, row, entity_id):
+        '''
+        Gets a related entity from its (caching) dao. When loading
+        eagerly, the entity is mapped from the joined columns of the
+        row, if it is not already cached.
+        '''
+        if self.eager_loading:
+            return dao.get_from_row(row, entity_id)
+        return dao.get_by_id(entity_id)
+
+    def _get_select(self, joins=(), additional_columns=()):
+        '''
+        Returns a select for the entity rows. The joins needed by a
+        filter expression may be given as parameter. In eager loading
+        mode the tables in eager_joins are also joined, so the related
+        entities may be mapped from the same row.
+        '''
+        columns = [self.table]
+        from_clause = self.table
+        for join_clause in joins:
+            from_clause = from_clause.join(join_clause.right,
+                                           join_clause.onclause,
+                                           isouter=join_clause.isouter)
+        if self.eager_loading:
+            for table, onclause in self.eager_joins:
+                from_clause = from_clause.outerjoin(table, onclause)
+                columns.append(table)
+        columns.extend(additional_columns)
+        return select(columns).select_from(from_clause)
+
     def get_by_id(self, entity_id):
         ''' Get an entity by id. Throws exception when the entity does not exist.'''
-        query = select([self.table])\
-            .where(self.primary_key == entity_id)
-        return self._get_exactly_one(query)
+        query = self._get_statement(
+            ('get_by_id', self.eager_loading),
+            lambda: self._get_select().where(self.primary_key == bindparam('entity_id')))
+        return self._get_exactly_one(query, {'entity_id': entity_id})
+
+    def get_by_ids(self, entity_ids):
+        '''
+        Gets the entities for a list of ids with one query per
+        IN_LIST_CHUNK_SIZE ids. The entities are returned in the order
+        of the ids. Throws exception when one of the entities does
+        not exist.
+        '''
+        entities = self._load_by_ids(set(entity_ids))
+        try:
+            return [entities[entity_id] for entity_id in entity_ids]
+        except KeyError as error:
+            raise NoSuchEntityException("Did not find entity for id %s" % error.args[0])
+
+    def _load_by_ids(self, entity_ids):
+        '''
+        Returns a dictionary of the entities for the given ids
+        that exist.
+        '''
+        entities = {}
+        query = self._get_statement(
+            ('get_by_ids', self.eager_loading),
+            lambda: self._get_select().where(
+                self.primary_key.in_(bindparam('entity_ids', expanding=True))))
+        for chunk in split_into_chunks(entity_ids):
+            for entity in self._get_list(query, {'entity_ids': chunk}):
+                entities[entity.id] = entity
+        return entities
 
     def get_first(self, filter_expression=None):
         ''' Get the first entity or None if no entity exists or is allowed by filter.'''
@@ -394,7 +1126,7 @@ class EntityDao(GenericDao):
             subquery = subquery.select_from(join)    
         if filter_expression is not None:
             subquery = subquery.where(filter_expression)
-        query = select([self.table])\
+        query = self._get_select()\
             .where(self.primary_key == subquery.scalar_subquery())  # @UndefinedVariable
             
         return self._get_one_or_none(query)
@@ -422,7 +1154,7 @@ class EntityDao(GenericDao):
             condition = and_(condition, filter_expression)
         subquery = subquery.where(condition)
 
-        query = select([self.table])\
+        query = self._get_select()\
             .where(self.primary_key == subquery.scalar_subquery())  # @UndefinedVariable
         entity = self._get_one_or_none(query)
         
@@ -430,22 +1162,151 @@ class EntityDao(GenericDao):
             return alternative(filter_expression)
         return entity
 
+    def create_cursor(self, filter_expression=None,
+                      window_size=DEFAULT_CURSOR_WINDOW_SIZE, background=False):
+        '''
+        Returns a RecordCursor for browsing the entities allowed
+        by the filter expression.
+        '''
+        return RecordCursor(self, filter_expression, window_size, background)
+
+    def create_filter_snapshot(self, filter_expression=None):
+        '''
+        Returns a FilterSnapshot that evaluates the filter expression
+        once and answers navigation and counts from the result.
+        '''
+        return FilterSnapshot(self, filter_expression)
+
+    def _get_filtered_ids(self, filter_expression):
+        '''
+        Returns the sorted ids of all entities allowed by the filter
+        expression as compact array.
+        '''
+        query = select([self.select_column]).distinct()
+        for join_clause in get_joins_for_expression(filter_expression, self.table):
+            query = query.select_from(join_clause)
+        if filter_expression is not None:
+            query = query.where(filter_expression)
+        query = query.order_by(self.select_column)
+        with self._use_connection() as connection:
+            result = connection.execute(query)
+            ids = array('q', (row[0] for row in result))
+            result.close()
+        return ids
+
+    def _get_window(self, key, filter_expression, before, after):
+        '''
+        Fetches up to "before" entities with a select column value
+        below the key and up to "after" entities with a value from the
+        key on in one query, ordered by id. A key of None fetches the
+        first entities, if before is 0, or the last, if after is 0.
+        '''
+        joins = get_joins_for_expression(filter_expression, self.table)
+        id_selects = []
+        for size, operator, order in ((before, '<', self.select_column.desc()),
+                                      (after, '>=', self.select_column)):
+            if size == 0:
+                continue
+            expressions = []
+            if filter_expression is not None:
+                expressions.append(filter_expression)
+            if key is not None:
+                expressions.append(self.select_column.op(operator)(key))
+            subquery = select([self.select_column]).distinct()
+            for join_clause in joins:
+                subquery = subquery.select_from(join_clause)
+            where_clause = combine_expressions(expressions, and_)
+            if where_clause is not None:
+                subquery = subquery.where(where_clause)
+            subquery = subquery.order_by(order).limit(size).subquery()
+            id_selects.append(select(list(subquery.c)))
+        query = self._get_select()\
+            .where(self.primary_key.in_(union_all(*id_selects)))\
+            .order_by(self.primary_key)
+        return self._get_list(query)
+
     def save(self, entity):
         '''
         Decides on the existence of the entity.id, if an update
         or an insert is necessary and executes the appropriate
         method in a transaction.
         '''
+        self._entities_changed()
         if entity.id:
-            return self.transactional(self._update, entity)
-        return self.transactional(self._insert, entity)
+            entity = self.transactional(self._update, entity)
+        else:
+            entity = self.transactional(self._insert, entity)
+        return entity
+
+    def insert_all(self, entities):
+        '''
+        Inserts a batch of new entities in one transaction and returns
+        them with their new ids in the order given. Daos for tables
+        with a lot of rows write the batch with executemany.
+        '''
+        entities = list(entities)
+        for entity in entities:
+            if entity.id:
+                raise DataError(_("Entity %s has already been saved.") % entity.id)
+        self._entities_changed()
+        return self.transactional(self._insert_all, entities)
+
+    def _entities_changed(self):
+        '''
+        Drops the cached counts and marks derived data as outdated.
+        '''
+        self.count_cache.clear()
+        self.modification_count += 1
+        self._data_changed()
+
+    def _insert_all(self, entities):
+        '''
+        Inserts the entities one by one. Override this for real
+        batch inserts.
+        '''
+        return [self._insert(entity) for entity in entities]
 
     def delete(self, entity_id):
         '''
         Public wrapper method to perform deletion of entity transactional.
         '''
 
+        self._entities_changed()
         self.transactional(self._delete, entity_id)
+
+    def delete_many(self, entity_ids):
+        '''
+        Deletes the entities with the given ids and their references
+        with IN list deletes in one transaction. Returns the number
+        of deleted entities.
+        '''
+        entity_ids = list(entity_ids)
+        self._entities_changed()
+        return self.transactional(self._delete_many, entity_ids)
+
+    def _delete_many(self, entity_ids):
+        '''
+        Deletes the references and the rows chunk by chunk.
+        '''
+        query = self._get_statement(
+            'delete_many', lambda: delete(self.table).where(
+                self.primary_key.in_(bindparam('entity_ids', expanding=True))))
+        deleted = 0
+        for chunk in split_into_chunks(entity_ids):
+            self._delete_references_many(chunk)
+            deleted += self.connection.execute(query, {'entity_ids': chunk}).rowcount
+        return deleted
+
+    def _delete_references_many(self, entity_ids):
+        '''
+        Deletes the references to the entities with the given ids.
+        '''
+        for foreign_key in self.foreign_keys:
+            query = self._get_statement(
+                ('delete_references', foreign_key.table.name, foreign_key.name),
+                lambda foreign_key=foreign_key: delete(foreign_key.table).where(
+                    foreign_key.in_(bindparam('entity_ids', expanding=True))))
+            self.connection.execute(query, {'entity_ids': entity_ids})
         
     def _update(self, entity):
         '''
@@ -480,16 +1341,40 @@ class EntityDao(GenericDao):
         self._delete_references(entity_id)
         query = delete(self.table)\
             .where(self.primary_key == entity_id)
-        self.connection.execute(query)
+        return self.connection.execute(query).rowcount
+
+    def _get_archive_statistics(self):
+        '''
+        Returns the statistics snapshot, loading it on first use
+        and when it is outdated.
+        '''
+        statistics = self.dao_services.archive_statistics
+        if statistics.is_outdated():
+            with self._use_connection() as connection:
+                statistics.refresh(connection)
+        return statistics
+
+    def refresh_statistics(self):
+        '''
+        Recomputes the statistics snapshot from the database.
+        '''
+        with self._use_connection() as connection:
+            self.dao_services.archive_statistics.refresh(connection)
+
+    def _record_statistics(self, rows_by_file_type=None, documents=0, events=0):
+        '''
+        Reports changes of the running transaction to the statistics
+        snapshot, to be applied when the transaction is committed.
+        '''
+        statistics = self.dao_services.archive_statistics
+        self._after_commit(lambda: statistics.record(rows_by_file_type, documents, events))
 
     def _get_next_id(self):
         '''
-        As long as we do not have sequences, load the id
-        this way.
+        Gets the id for a new entity from the id allocator of
+        the table.
         '''
-        function = func.max(self.primary_key)
-        result = self.connection.execute(select([function]))
-        return result.fetchone()[0] + 1
+        return self.dao_services.id_allocators.get(self.primary_key).allocate(self.connection)
 
     def get_count(self, where_expression=None):
         '''
@@ -508,14 +1393,694 @@ class EntityDao(GenericDao):
         returned
         '''
             
-        query = select([self.table]).\
+        return self._get_list(self._build_find_query(condition, page, page_size))
+
+    def find_with_count(self, condition=None, page=1, page_size=1):
+        '''
+        Returns a tuple of the entities on the requested page and the
+        total number of entities matching the condition. The total is
+        computed by a window function in the same query that fetches
+        the page and is cached for the condition until data is written
+        through any dao of the engine or count_cache_ttl has passed, so
+        paging through a result costs one query per page.
+        '''
+        cache_key = self._get_expression_key(condition)
+        generation = self.dao_services.data_generation
+        cached = self.count_cache.get(cache_key)
+        if cached is not None:
+            total, cached_generation, expiry_time = cached
+            if cached_generation == generation and self.clock() < expiry_time:
+                query = self._build_find_query(condition, page, page_size)
+                return self._get_list(query), total
+
+        query = self._build_find_query(condition, page, page_size,
+                                       (func.count().over().label('total_count'),))
+        with self._use_connection() as connection:
+            result = connection.execute(query)
+            rows = result.fetchall()
+            result.close()
+        if rows:
+            total = rows[0]['total_count']
+        else:
+            # Page is out of range (or there are no entities at all),
+            # so the window function had nothing to count
+            total = self.get_count(condition)
+        if cache_key is not None:
+            if len(self.count_cache) >= COUNT_CACHE_SIZE:
+                self.count_cache.clear()
+            self.count_cache[cache_key] = (total, generation,
+                                           self.clock() + self.count_cache_ttl)
+        return self._rows_to_entities(rows), total
+
+    def _build_find_query(self, condition, page, page_size, additional_columns=()):
+        '''
+        Builds the ordered and paginated query for the find methods.
+        '''
+        query = self._get_select(get_joins_for_expression(condition, self.table),
+                                 additional_columns).\
             order_by(self.primary_key)
         if not page is None:
             offset = (page - 1) * page_size
             query = query.offset(offset).limit(page_size) 
         if not condition is None:
             query = query.where(condition)
-        return self._get_list(query)
+        return query
+
+    def _get_expression_key(self, expression):
+        '''
+        Returns the sql string of the expression with all parameters
+        rendered inline, so it may be used as dictionary key. Returns
+        None if the expression can't be rendered this way. The key is
+        kept on the expression, because the filter expression builders
+        hand out the same memoized expression for the same filter.
+        '''
+        # pylint: disable=protected-access
+        if expression is None:
+            return ''
+        dialect = self.db_engine.dialect
+        cached = getattr(expression, '_alexandria_expression_key', None)
+        if cached is not None and cached[0] is dialect:
+            return cached[1]
+        try:
+            key = str(expression.compile(dialect=dialect,
+                                         compile_kwargs={'literal_binds': True}))
+        except Exception: # pylint: disable=broad-except
+            key = None
+        expression._alexandria_expression_key = (dialect, key)
+        return key
+
+    def iter_find(self, condition=None, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Generator that yields all entities matching the condition
+        ordered by primary key. The rows are fetched in batches
+        using keyset pagination (primary key greater than the last
+        key seen) instead of offsets, so each batch costs the same
+        however deep we are in the table, and only one batch is
+        held in memory at a time.
+        '''
+        last_key = None
+        while True:
+            expressions = []
+            if condition is not None:
+                expressions.append(condition)
+            if last_key is not None:
+                expressions.append(self.primary_key > last_key)
+            query = self._get_select(get_joins_for_expression(condition, self.table))
+            where_clause = combine_expressions(expressions, and_)
+            if where_clause is not None:
+                query = query.where(where_clause)
+            query = query.order_by(self.primary_key).\
+                limit(batch_size).\
+                execution_options(stream_results=True)
+            
+            number_of_rows = 0
+            with self._use_connection() as connection:
+                result = connection.execute(query)
+                try:
+                    for row in result:
+                        number_of_rows += 1
+                        last_key = row[self.primary_key]
+                        yield self._row_to_entity(row)
+                finally:
+                    result.close()
+            if number_of_rows < batch_size:
+                return
+
+class RecordCursor:
+    '''
+    Cursor for browsing the entities of a dao that are allowed by
+    a filter expression. It has the same navigation methods as the
+    dao, but holds a window of neighbouring entities fetched in one
+    query and serves the navigation from it. When the position comes
+    close to the edge of the window, the window is refilled around the
+    current position, optionally in a background thread. The background
+    thread needs a connection of its own, so it should not be used with
+    an engine that shares one connection like in-memory SQLite. Changes
+    made through the dao invalidate the window.
+    '''
+
+    def __init__(self, dao, filter_expression=None,
+                 window_size=DEFAULT_CURSOR_WINDOW_SIZE, background=False):
+        self.dao = dao
+        self.filter_expression = filter_expression
+        # A window centered on an id needs room for both neighbours
+        self.window_size = max(window_size, 3)
+        self.prefetch_margin = self.window_size // 5
+        self.background = background
+        self.refill_thread = None
+        self.refill_error = None
+        self.lock = Lock()
+        self.window = None
+        self.logger = logging.getLogger("alexandriabase.daos.recordcursor.RecordCursor")
+
+    def get_first(self):
+        ''' Get the first entity or None if no entity is allowed by the filter.'''
+        window = self._get_valid_window()
+        if window is None or not window.at_start:
+            window = self._load_window(None, 0, self.window_size)
+        return self._serve(window, 0)
+
+    def get_last(self):
+        ''' Get the last entity or None if no entity is allowed by the filter.'''
+        window = self._get_valid_window()
+        if window is None or not window.at_end:
+            window = self._load_window(None, self.window_size, 0)
+        return self._serve(window, len(window.ids) - 1)
+
+    def get_next(self, entity):
+        ''' Get the next entity or the first, if it is the last'''
+        window = self._get_window_for(entity.id)
+        index = bisect_right(window.ids, entity.id)
+        if index == len(window.ids) and not window.at_end:
+            window = self._load_window(entity.id, 0, self.window_size)
+            index = bisect_right(window.ids, entity.id)
+        if index < len(window.ids):
+            return self._serve(window, index)
+        return self.get_first()
+
+    def get_previous(self, entity):
+        ''' Get the previous entity or the last, if it is the first'''
+        window = self._get_window_for(entity.id)
+        index = bisect_left(window.ids, entity.id) - 1
+        if index < 0 and not window.at_start:
+            window = self._load_window(entity.id, self.window_size, 0)
+            index = bisect_left(window.ids, entity.id) - 1
+        if index >= 0:
+            return self._serve(window, index)
+        return self.get_last()
+
+    def get_nearest(self, entity_id):
+        ''' Get the entity matching the id, or, if not existing,
+        the next entity after this id. If this does not provide
+        an entity, get the last entity.'''
+        window = self._get_window_for(entity_id)
+        index = bisect_left(window.ids, entity_id)
+        if index == len(window.ids) and not window.at_end:
+            window = self._load_window(entity_id, 0, self.window_size)
+            index = bisect_left(window.ids, entity_id)
+        if index < len(window.ids):
+            return self._serve(window, index)
+        return self.get_last()
+
+    def wait(self):
+        '''
+        Waits for a running background refill. Raises the exception
+        of a failed refill.
+        '''
+        thread = self.refill_thread
+        if thread is not None:
+            thread.join()
+        error, self.refill_error = self.refill_error, None
+        if error is not None:
+            raise error
+
+    def _get_valid_window(self):
+        '''
+        Returns the current window, if it is still valid.
+        '''
+        with self.lock:
+            window = self.window
+        if window is None or window.modification_count != self.dao.modification_count:
+            return None
+        return window
+
+    def _get_window_for(self, entity_id):
+        '''
+        Returns a window that knows the neighbours of the id, loading
+        a new one centered on the id if necessary.
+        '''
+        window = self._get_valid_window()
+        if window is None or not window.covers(entity_id):
+            half = self.window_size // 2
+            window = self._load_window(entity_id, half, self.window_size - half)
+        return window
+
+    def _load_window(self, key, before, after):
+        '''
+        Fetches a new window and makes it the current window.
+        '''
+        # pylint: disable=protected-access
+        modification_count = self.dao.modification_count
+        entities = self.dao._get_window(key, self.filter_expression, before, after)
+        window = CursorWindow(entities, modification_count)
+        if key is None:
+            window.at_start = after > 0 or len(entities) < before
+            window.at_end = before > 0 or len(entities) < after
+        else:
+            number_before = bisect_left(window.ids, key)
+            window.at_start = number_before < before
+            window.at_end = len(entities) - number_before < after
+        with self.lock:
+            self.window = window
+        return window
+
+    def _serve(self, window, index):
+        '''
+        Returns the entity at the index of the window and starts a
+        refill, if the index is close to an edge of the window that
+        is not the edge of the filtered table.
+        '''
+        if not window.ids:
+            return None
+        entity = window.entities[index]
+        close_to_start = index < self.prefetch_margin and not window.at_start
+        close_to_end = len(window.ids) - index <= self.prefetch_margin and \
+            not window.at_end
+        if close_to_start or close_to_end:
+            self._refill(entity.id)
+        return entity
+
+    def _refill(self, entity_id):
+        '''
+        Reloads the window around the id, in the background if the
+        cursor has been created that way.
+        '''
+        half = self.window_size // 2
+        if not self.background:
+            self._load_window(entity_id, half, self.window_size - half)
+            return
+        if self.refill_thread is not None and self.refill_thread.is_alive():
+            return
+        self.refill_thread = Thread(target=self._refill_in_background,
+                                    args=(entity_id, half, self.window_size - half),
+                                    daemon=True)
+        self.refill_thread.start()
+
+    def _refill_in_background(self, entity_id, before, after):
+        '''
+        Thread target for the refill. A failed refill keeps the old
+        window, the error is logged and raised again by wait().
+        '''
+        try:
+            self._load_window(entity_id, before, after)
+        except Exception as error: # pylint: disable=broad-except
+            self.logger.exception("Refilling the cursor window failed")
+            self.refill_error = error
+
+class FilterSnapshot:
+    '''
+    The sorted ids of the entities allowed by a filter expression,
+    evaluated once into an integer array. Navigation, nearest id and
+    counts are answered by binary search on the array, only the
+    entity itself is loaded from the dao. Every change written
+    through the daos on the engine, including changes of joined
+    tables, advances the data generation, so the snapshot is
+    evaluated again on next use.
+    '''
+
+    def __init__(self, dao, filter_expression=None):
+        self.dao = dao
+        self.filter_expression = filter_expression
+        self.lock = Lock()
+        self.ids = None
+        self.generation = None
+
+    def invalidate(self):
+        '''
+        Forces the evaluation of the filter on next use.
+        '''
+        with self.lock:
+            self.ids = None
+
+    def get_count(self):
+        ''' Returns the number of entities allowed by the filter.'''
+        return len(self._get_ids())
+
+    def get_first(self):
+        ''' Get the first entity or None if no entity is allowed by the filter.'''
+        ids = self._get_ids()
+        if not ids:
+            return None
+        return self.dao.get_by_id(ids[0])
+
+    def get_last(self):
+        ''' Get the last entity or None if no entity is allowed by the filter.'''
+        ids = self._get_ids()
+        if not ids:
+            return None
+        return self.dao.get_by_id(ids[-1])
+
+    def get_next(self, entity):
+        ''' Get the next entity or the first, if it is the last'''
+        ids = self._get_ids()
+        index = bisect_right(ids, entity.id)
+        if index < len(ids):
+            return self.dao.get_by_id(ids[index])
+        return self.get_first()
+
+    def get_previous(self, entity):
+        ''' Get the previous entity or the last, if it is the first'''
+        ids = self._get_ids()
+        index = bisect_left(ids, entity.id) - 1
+        if index >= 0:
+            return self.dao.get_by_id(ids[index])
+        return self.get_last()
+
+    def get_nearest(self, entity_id):
+        ''' Get the entity matching the id, or, if not existing,
+        the next entity after this id. If this does not provide
+        an entity, get the last entity.'''
+        ids = self._get_ids()
+        index = bisect_left(ids, entity_id)
+        if index < len(ids):
+            return self.dao.get_by_id(ids[index])
+        return self.get_last()
+
+    def _get_ids(self):
+        '''
+        Returns the id array, evaluating the filter if necessary.
+        '''
+        with self.lock:
+            generation = self.dao.dao_services.data_generation
+            if self.ids is None or self.generation != generation:
+                # pylint: disable=protected-access
+                self.ids = self.dao._get_filtered_ids(self.filter_expression)
+                self.generation = generation
+            return self.ids
+
+class CursorWindow:
+    '''
+    The entities a record cursor currently holds, ordered by id.
+    The flags tell if the window reaches the start or the end of
+    the filtered entities.
+    '''
+
+    def __init__(self, entities, modification_count):
+        self.entities = entities
+        self.ids = [entity.id for entity in entities]
+        self.modification_count = modification_count
+        self.at_start = False
+        self.at_end = False
+
+    def covers(self, entity_id):
+        '''
+        Tells if the neighbours of the id are known to the window.
+        '''
+        if not self.ids:
+            return self.at_start and self.at_end
+        if entity_id < self.ids[0]:
+            return self.at_start
+        if entity_id > self.ids[-1]:
+            return self.at_end
+        # We need the neighbours on both sides inside the window
+        return self.ids[0] < entity_id < self.ids[-1] or \
+            (entity_id == self.ids[0] and self.at_start) or \
+            (entity_id == self.ids[-1] and self.at_end)
+
+class EntityCache:
+    '''
+    Unbounded cache for entities. Behaves like a dictionary
+    and counts hits and misses on lookups via get() and
+    evictions of entries that had to make room for new ones.
+    '''
+    
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        '''
+        Looks up the key and records the hit or the miss.
+        '''
+        with self.lock:
+            if self._is_valid(key):
+                self.hits += 1
+                self._touch(key)
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def pop(self, key, default=None):
+        '''
+        Removes the key from the cache without complaining when
+        it is not cached.
+        '''
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def clear(self):
+        '''
+        Removes all entries. The statistics are kept.
+        '''
+        with self.lock:
+            self.entries.clear()
+
+    def statistics(self):
+        '''
+        Returns the counters as dictionary, for logging or tuning
+        the cache sizes.
+        '''
+        return {'size': len(self),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _is_valid(self, key):
+        '''
+        Hook for caches with expiring entries.
+        '''
+        return key in self.entries
+
+    def _touch(self, key):
+        '''
+        Hook for caches that track the usage of entries.
+        '''
+
+    def _make_room(self):
+        '''
+        Hook for bounded caches to evict entries before a new
+        entry is added.
+        '''
+
+    def _stored(self, key):
+        '''
+        Hook called after an entry has been stored.
+        '''
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._is_valid(key)
+
+    def __getitem__(self, key):
+        with self.lock:
+            if not self._is_valid(key):
+                raise KeyError(key)
+            self._touch(key)
+            return self.entries[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+            else:
+                self._make_room()
+            self.entries[key] = value
+            self._stored(key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def values(self):
+        '''
+        Returns a list of the cached values.
+        '''
+        with self.lock:
+            return list(self.entries.values())
+
+class LruEntityCache(EntityCache):
+    '''
+    Entity cache that holds at most max_size entries and evicts
+    the least recently used entry when full.
+    '''
+
+    def __init__(self, max_size):
+        super().__init__()
+        if max_size < 1:
+            raise DataError(_("Cache size must be positive."))
+        self.max_size = max_size
+
+    def _touch(self, key):
+        self.entries.move_to_end(key)
+
+    def _make_room(self):
+        while len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+class TtlEntityCache(LruEntityCache):
+    '''
+    Bounded least recently used cache whose entries expire
+    time_to_live seconds after they have been stored.
+    '''
+
+    def __init__(self, max_size, time_to_live, clock=time.monotonic):
+        super().__init__(max_size)
+        self.time_to_live = time_to_live
+        self.clock = clock
+        self.expiry_times = {}
+
+    def _is_valid(self, key):
+        if key not in self.entries:
+            return False
+        if self.expiry_times[key] > self.clock():
+            return True
+        del self.entries[key]
+        del self.expiry_times[key]
+        self.evictions += 1
+        return False
+
+    def _make_room(self):
+        while len(self.entries) >= self.max_size:
+            key, _value = self.entries.popitem(last=False)
+            del self.expiry_times[key]
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self.expiry_times.pop(key, None)
+            return self.entries.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.expiry_times.clear()
+
+    def _stored(self, key):
+        self.expiry_times[key] = self.clock() + self.time_to_live
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+            del self.expiry_times[key]
+
+class CacheVersionStamp:
+    '''
+    Version stamp for a cache that is shared by all processes
+    working on the database. The stamp is a random token in the
+    registry table that is replaced whenever a process changes
+    the cached data. Other processes compare the token at most
+    every check_interval seconds with the token they last saw
+    and drop their cache when it differs.
+    '''
+
+    def __init__(self, name, check_interval=DEFAULT_CACHE_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.key = 'cacheversion.%s' % name
+        self.check_interval = check_interval
+        self.clock = clock
+        self.version = None
+        self.next_check = None
+
+    def is_due(self):
+        '''
+        Tells if the check interval has passed, so the next call of
+        is_outdated will read the token.
+        '''
+        return self.next_check is None or self.clock() >= self.next_check
+
+    def is_outdated(self, connection):
+        '''
+        Reads the token from the database, if the check interval
+        has passed, and returns True if another process has changed
+        the data since the last check. The first check only records
+        the token.
+        '''
+        now = self.clock()
+        if self.next_check is not None and now < self.next_check:
+            return False
+        self.next_check = now + self.check_interval
+        result = connection.execute(select([REGISTRY_TABLE.c.wert]).where(
+            REGISTRY_TABLE.c.schluessel == self.key))
+        row = result.fetchone()
+        result.close()
+        version = row[REGISTRY_TABLE.c.wert] if row else ''
+        outdated = self.version is not None and version != self.version
+        self.version = version
+        return outdated
+
+    def bump(self, connection):
+        '''
+        Writes a new token. Should be called on the connection of
+        the transaction that changes the cached data or right after
+        its commit.
+        '''
+        version = uuid.uuid4().hex
+        result = connection.execute(update(REGISTRY_TABLE).values(wert=version).where(
+            REGISTRY_TABLE.c.schluessel == self.key))
+        if result.rowcount == 0:
+            connection.execute(insert(REGISTRY_TABLE).values(
+                schluessel=self.key, wert=version))
+        self.version = version
+
+class EntityCacheFactory:
+    '''
+    Creates the caches for the caching daos from the
+    "entitycaches" configuration map. The map is keyed by
+    the cache name of the dao, the values have the form
+    "unbounded", "lru:<max size>" or "ttl:<max size>:<seconds>".
+    Daos without configuration get an unbounded cache.
+    '''
+
+    @inject
+    def __init__(self, config: baseinjectorkeys.CONFIG_KEY):
+        self.config = config
+
+    def create_cache(self, cache_name):
+        '''
+        Creates the configured cache for the given name.
+        '''
+        try:
+            specification = self.config.entitycaches.get(cache_name, '')
+        except NoSuchConfigValue:
+            specification = ''
+        return create_entity_cache(specification)
+
+    def create_version_stamp(self, cache_name):
+        '''
+        Creates the version stamp that synchronizes the cache with
+        the given name across processes. The check interval in
+        seconds is read from the "cachecheckinterval" configuration
+        entry.
+        '''
+        return CacheVersionStamp(cache_name, self.get_check_interval())
+
+    def get_check_interval(self):
+        '''
+        Returns the interval in seconds at which cached data is
+        checked for changes of other processes, read from the
+        "cachecheckinterval" configuration entry.
+        '''
+        try:
+            return float(self.config.cachecheckinterval or DEFAULT_CACHE_CHECK_INTERVAL)
+        except NoSuchConfigValue:
+            return DEFAULT_CACHE_CHECK_INTERVAL
+
+def create_entity_cache(specification):
+    '''
+    Creates an entity cache from a specification string
+    as described for the EntityCacheFactory.
+    '''
+    parts = specification.strip().lower().split(':') if specification else ['unbounded']
+    try:
+        if parts[0] == 'unbounded' and len(parts) == 1:
+            return EntityCache()
+        if parts[0] == 'lru' and len(parts) == 2:
+            return LruEntityCache(int(parts[1]))
+        if parts[0] == 'ttl' and len(parts) == 3:
+            return TtlEntityCache(int(parts[1]), float(parts[2]))
+    except ValueError:
+        pass
+    raise DataError(_("Invalid cache specification: %s") % specification)
 
 class CachingDao(EntityDao):
     '''
@@ -523,44 +2088,140 @@ class CachingDao(EntityDao):
     '''
     # pylint: disable=no-member
     
-    def __init__(self, db_engine, table):
-        super().__init__(db_engine, table)
-        self.cache = {}
+    def __init__(self, db_engine, table, cache=None, version_stamp=None, dao_services=None):
+        # pylint: disable=too-many-arguments
+        super().__init__(db_engine, table, dao_services)
+        if cache is None:
+            cache = EntityCache()
+        self.cache = cache
+        self.version_stamp = version_stamp
     
     def clear_cache(self):
         '''
         Clears the cache
         '''
-        # pylint: disable=attribute-defined-outside-init
-        self.cache = {}
+        self.cache.clear()
+
+    def _check_cache_version(self):
+        '''
+        Clears the cache when another process has changed the
+        data of this dao.
+        '''
+        if self.version_stamp is not None and self.version_stamp.is_due():
+            with self._use_connection() as connection:
+                outdated = self.version_stamp.is_outdated(connection)
+            if outdated:
+                self.clear_cache()
 
     def find(self, condition=None, page=None, page_size=1):
+        self._check_cache_version()
         entity_list = super().find(condition, page, page_size)
         return self._cache_list(entity_list)
     
     def get_by_id(self, entity_id):
         
-        if entity_id in self.cache:
-            return self.cache[entity_id]
+        self._check_cache_version()
+        entity = self.cache.get(entity_id)
+        if entity is not None:
+            return entity
         entity = super().get_by_id(entity_id)
-        self.cache[entity_id] = entity
+        self._cache_entity(entity)
         return entity
     
     def delete(self, entity_id):
-        del self.cache[entity_id]
-        super().delete(entity_id)
+        self.cache.pop(entity_id, None)
+        self.transactional(self._delete_and_bump_version, entity_id)
+
+    def delete_many(self, entity_ids):
+        entity_ids = list(entity_ids)
+        for entity_id in entity_ids:
+            self.cache.pop(entity_id, None)
+        return self.transactional(self._delete_many_and_bump_version, entity_ids)
+
+    def _delete_many_and_bump_version(self, entity_ids):
+        '''
+        Deletes the entities and tells other processes in the same
+        transaction that their caches are outdated.
+        '''
+        deleted = super().delete_many(entity_ids)
+        self._bump_cache_version()
+        return deleted
         
+    def _delete_and_bump_version(self, entity_id):
+        '''
+        Deletes the entity and tells other processes in the same
+        transaction that their caches are outdated.
+        '''
+        super().delete(entity_id)
+        self._bump_cache_version()
+
     def save(self, entity):
+        entity = self.transactional(self._save_and_bump_version, entity)
+        self._cache_entity(entity)
+        return entity
+
+    def _save_and_bump_version(self, entity):
+        '''
+        Saves the entity and tells other processes in the same
+        transaction that their caches are outdated.
+        '''
         entity = super().save(entity)
-        self.cache[entity.id] = entity
+        self._bump_cache_version()
         return entity
+
+    def _bump_cache_version(self):
+        '''
+        Writes a new version stamp, if the dao has one.
+        '''
+        if self.version_stamp is not None:
+            self.version_stamp.bump(self.connection)
         
+    def _load_by_ids(self, entity_ids):
+        self._check_cache_version()
+        entities = {}
+        missing_ids = []
+        for entity_id in entity_ids:
+            entity = self.cache.get(entity_id)
+            if entity is not None:
+                entities[entity_id] = entity
+            else:
+                missing_ids.append(entity_id)
+        if missing_ids:
+            loaded_entities = super()._load_by_ids(missing_ids)
+            self._cache_list(loaded_entities.values())
+            entities.update(loaded_entities)
+        return entities
+
+    def get_from_row(self, row, entity_id):
+        '''
+        Returns the entity with the given id for a row of another
+        table that has been joined with the table of this dao. The
+        cached entity is preferred, if there is none, the entity is
+        mapped from the joined columns. If the join did not find the
+        entity, it is loaded (which raises the usual exception).
+        '''
+        self._check_cache_version()
+        entity = self.cache.get(entity_id)
+        if entity is not None:
+            return entity
+        if row[self.primary_key] is None:
+            return self.get_by_id(entity_id)
+        entity = self._row_to_entity(row)
+        self._cache_entity(entity)
+        return entity
+
+    def _cache_entity(self, entity):
+        '''
+        Puts a single entity into the cache.
+        '''
+        self.cache[entity.id] = entity
+
     def _cache_list(self, entity_list):
         '''
         Puts the elements in the list into the cache
         '''
         for entity in entity_list:
-            self.cache[entity.id] = entity
+            self._cache_entity(entity)
         return entity_list
 
 class BasicCreatorProvider(object):
@@ -574,15 +2235,26 @@ class BasicCreatorProvider(object):
     @inject
     def __init__(self, creator_dao: baseinjectorkeys.CREATOR_DAO_KEY):
         self.creator_dao = creator_dao
+        self._creator = None
+
+    def refresh(self):
+        '''
+        Forgets the memoized creator, so it is looked up again
+        on next access.
+        '''
+        self._creator = None
 
     def _get_creator(self):
         ''' Private getter to use in property.'''
+        if self._creator is not None:
+            return self._creator
         creator = self.creator_dao.find_by_name("Admin")
         if creator is None:
             creator = Creator()
             creator.name = "Admin"
             creator.visible = False
             creator = self.creator_dao.save(creator)
+        self._creator = creator
         return creator
 
     creator = property(_get_creator)
@@ -593,35 +2265,53 @@ class CreatorDao(CachingDao):
     '''
 
     @inject
-    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY):
-        super().__init__(db_engine, CREATOR_TABLE)
-        self.cache = {}
+    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY,
+                 cache_factory: baseinjectorkeys.ENTITY_CACHE_FACTORY_KEY=None,
+                 dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
+        cache = cache_factory.create_cache('creator') if cache_factory else None
+        version_stamp = cache_factory.create_version_stamp('creator') \
+            if cache_factory else None
+        super().__init__(db_engine, CREATOR_TABLE, cache, version_stamp, dao_services)
+        # Maps the names of the cached creators to their ids
+        self.name_index = {}
 
+    def clear_cache(self):
+        super().clear_cache()
+        self.name_index.clear()
 
+    def _cache_entity(self, entity):
+        super()._cache_entity(entity)
+        self.name_index[entity.name] = entity.id
 
     # pylint: disable=arguments-differ
     def get_by_id(self, creator_id):
 
-        if creator_id in self.cache:
-            return self.cache[creator_id]
+        self._check_cache_version()
+        creator = self.cache.get(creator_id)
+        if creator is not None:
+            return creator
 
-        query = select([self.table])\
-            .where(self.primary_key == creator_id)  # @UndefinedVariable
-        creator = self._get_exactly_one(query)
-        self.cache[creator.id] = creator
+        query = self._get_statement(
+            'get_creator', lambda: select([self.table]).where(
+                self.primary_key == bindparam('creator_id')))
+        creator = self._get_exactly_one(query, {'creator_id': creator_id})
+        self._cache_entity(creator)
         return creator
 
     def find_by_name(self, name):
         '''
         Surprisingly finds the creator by name.
         '''
-        for creator_id in self.cache:
-            if name == self.cache[creator_id].name:
-                return self.cache[creator_id]
+        self._check_cache_version()
+        if name in self.name_index:
+            creator = self.cache.get(self.name_index[name])
+            # The creator may have been evicted or renamed in the meantime
+            if creator is not None and creator.name == name:
+                return creator
         query = select([self.table]).where(self.table.c.name == name)
         creator = self._get_one_or_none(query)
         if creator != None:
-            self.cache[creator.id] = creator
+            self._cache_entity(creator)
         return creator
 
     def find_all_visible(self):
@@ -661,18 +2351,20 @@ class DocumentFilterExpressionBuilder(GenericFilterExpressionBuilder):
     Creates a document filter expression for sql alchemy from a
     document filter object.
     '''
-    def __init__(self):
-        super().__init__()
+    @inject
+    def __init__(self, search_backend: baseinjectorkeys.SEARCH_BACKEND_KEY=None):
+        super().__init__(search_backend)
         self.table = DOCUMENT_TABLE
         self.textcolumn = self.table.c.beschreibung
 
     # pylint: disable=arguments-differ
     def _create_expressions(self, document_filter):
-        super()._create_expressions(document_filter)
-        self._append_expression(self._build_signature_expression(document_filter))
-        self._append_expression(self._build_filetype_expression(document_filter))
-        self._append_expression(self._build_document_type_expression(document_filter))
-        self._append_expression(self._build_missing_event_link_expression(document_filter))
+        expressions = super()._create_expressions(document_filter)
+        expressions.append(self._build_signature_expression(document_filter))
+        expressions.append(self._build_filetype_expression(document_filter))
+        expressions.append(self._build_document_type_expression(document_filter))
+        expressions.append(self._build_missing_event_link_expression(document_filter))
+        return expressions
         
     def _build_missing_event_link_expression(self, document_filter):
         
@@ -735,19 +2427,24 @@ class DocumentDao(EntityDao):
                  config: baseinjectorkeys.CONFIG_KEY,
                  creator_dao: baseinjectorkeys.CREATOR_DAO_KEY,
                  document_type_dao: baseinjectorkeys.DOCUMENT_TYPE_DAO_KEY,
-                 creator_provider: baseinjectorkeys.CREATOR_PROVIDER_KEY):
+                 creator_provider: baseinjectorkeys.CREATOR_PROVIDER_KEY,
+                 dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
         # pylint: disable=too-many-arguments
-        super().__init__(db_engine, DOCUMENT_TABLE)
+        super().__init__(db_engine, DOCUMENT_TABLE, dao_services)
         self.select_column = DOCUMENT_TABLE.c.hauptnr
         self.config = config
         self.creator_dao = creator_dao
         self.document_type_dao = document_type_dao
         self.creator_provider = creator_provider
+        self.eager_joins = [
+            (CREATOR_TABLE, CREATOR_TABLE.c.id == self.table.c.erfasser_id),
+            (DOCUMENT_TYPE_TABLE, DOCUMENT_TYPE_TABLE.c.id == self.table.c.doktyp)]
+        self.eager_loading = True
 
         
     def _generate_query_from_subquery(self, subquery):
         where_clause = self.primary_key == subquery
-        return select([self.table]).where(where_clause)
+        return self._get_select().where(where_clause)
 
     def _get_one_or_last(self, subquery, filter_expression):
         query = self._generate_query_from_subquery(subquery)
@@ -766,8 +2463,55 @@ class DocumentDao(EntityDao):
         using the document file info dao.
         '''
         self._delete_references(document_id)
+        counts_query = self._get_statement(
+            'document_counts', lambda: ArchiveStatistics.get_document_counts_query(
+                self.table.c.hauptnr == bindparam('document_id')))
+        result = self.connection.execute(counts_query, {'document_id': document_id})
+        counts = result.fetchall()
+        result.close()
         delete_statement = delete(self.table).where(self.table.c.hauptnr == document_id)
         self.connection.execute(delete_statement)
+        self._record_deleted_rows(counts)
+        self._update_relation_index(lambda index: index.remove_documents([document_id]))
+
+    def _delete_many(self, document_ids):
+        '''
+        Deletes all rows of the documents and the references to
+        them, chunk by chunk.
+        '''
+        references_query = self._get_statement(
+            'delete_many_references', lambda: delete(DOCUMENT_EVENT_REFERENCE_TABLE).where(
+                DOCUMENT_EVENT_REFERENCE_TABLE.c.laufnr.in_(
+                    select([self.table.c.laufnr]).where(
+                        self.table.c.hauptnr.in_(bindparam('document_ids', expanding=True))))))
+        counts_query = self._get_statement(
+            'documents_counts', lambda: ArchiveStatistics.get_document_counts_query(
+                self.table.c.hauptnr.in_(bindparam('document_ids', expanding=True))))
+        delete_statement = self._get_statement(
+            'delete_many', lambda: delete(self.table).where(
+                self.table.c.hauptnr.in_(bindparam('document_ids', expanding=True))))
+        deleted = 0
+        for chunk in split_into_chunks(document_ids):
+            parameters = {'document_ids': chunk}
+            self.connection.execute(references_query, parameters)
+            result = self.connection.execute(counts_query, parameters)
+            counts = result.fetchall()
+            result.close()
+            self.connection.execute(delete_statement, parameters)
+            deleted += self._record_deleted_rows(counts)
+        self._update_relation_index(lambda index: index.remove_documents(document_ids))
+        return deleted
+
+    def _record_deleted_rows(self, counts):
+        '''
+        Reports deleted rows, given as document counts query result,
+        to the statistics. Returns the number of deleted documents.
+        '''
+        documents = sum(documents or 0 for _source, _file_type, _rows, documents in counts)
+        self._record_statistics(
+            {file_type: -row_count for _source, file_type, row_count, _documents in counts},
+            documents=-documents)
+        return documents
 
     def _row_to_entity(self, row):
 
@@ -782,9 +2526,10 @@ class DocumentDao(EntityDao):
             dokument.aufbewahrung = row[self.table.c.aufbewahrung]
         else:
             dokument.aufbewahrung = ""
-        erfasser_id = row[self.table.c.erfasser_id]
-        dokument.erfasser = self.creator_dao.get_by_id(erfasser_id)
-        dokument.document_type = self.document_type_dao.get_by_id(row[self.table.c.doktyp])
+        dokument.erfasser = self._get_related_entity(
+            self.creator_dao, row, row[self.table.c.erfasser_id])
+        dokument.document_type = self._get_related_entity(
+            self.document_type_dao, row, row[self.table.c.doktyp])
         return dokument
 
     # pylint: disable=arguments-differ
@@ -810,45 +2555,88 @@ class DocumentDao(EntityDao):
         # pylint: disable=protected-access
         document._id = self._get_next_id()
         document.erfasser = self.creator_provider.creator
-        aufbewahrung = ""
-        if document.aufbewahrung is not None and document.aufbewahrung.strip() != "":
-            aufbewahrung = document.aufbewahrung
         insert_statement = insert(DOCUMENT_TABLE).\
-            values(hauptnr=document.id,
-                   laufnr=document.id,
-                   beschreibung=document.description,
-                   zustand=document.condition,
-                   keywords=document.keywords,
-                   erfasser_id=document.erfasser.id,
-                   doktyp=document.document_type.id,
-                   doppel=document.doppel,
-                   aufbewahrung=aufbewahrung,
-                   aufnahme=func.now(),
-                   aenderung=func.now())
+            values(aufnahme=func.now(),
+                   aenderung=func.now(),
+                   **self._get_insert_values(document))
         self.connection.execute(insert_statement)
+        self._record_statistics({None: 1}, documents=1)
         return document
 
+    def _insert_all(self, documents):
+        '''
+        Inserts the documents with one executemany statement.
+        '''
+        # pylint: disable=protected-access
+        creator = self.creator_provider.creator
+        rows = []
+        for document in documents:
+            document._id = self._get_next_id()
+            document.erfasser = creator
+            rows.append(self._get_insert_values(document))
+        if rows:
+            insert_statement = self._get_statement(
+                'insert_all', lambda: insert(DOCUMENT_TABLE).values(
+                    aufnahme=func.now(), aenderung=func.now()))
+            self.connection.execute(insert_statement, rows)
+        self._record_statistics({None: len(rows)}, documents=len(rows))
+        return documents
+
+    def _get_insert_values(self, document):
+        '''
+        Maps a new document to the column values of its row.
+        '''
+        # pylint: disable=no-self-use
+        aufbewahrung = ""
+        if document.aufbewahrung is not None and document.aufbewahrung.strip() != "":
+            aufbewahrung = document.aufbewahrung
+        return {'hauptnr': document.id,
+                'laufnr': document.id,
+                'beschreibung': document.description,
+                'zustand': document.condition,
+                'keywords': document.keywords,
+                'erfasser_id': document.erfasser.id,
+                'doktyp': document.document_type.id,
+                'doppel': document.doppel,
+                'aufbewahrung': aufbewahrung}
+
     def get_statistics(self):
         '''
         Returns statistical information on the documents in the database
         '''
         
-        statistics = DocumentStatistics()
-        statistics.number_of_files = self.get_count()
-        statistics.number_of_documents = self.get_count(self.table.c.hauptnr == self.table.c.laufnr)
-        for file_type in self.config.filetypes:
-            count = self.get_count(self.table.c.dateityp == file_type)
-            if count > 0:
-                statistics.number_of_files_by_type[file_type] = count
-        return statistics
+        return self._get_archive_statistics().get_document_statistics(self.config.filetypes)
     
     def find(self, condition=None, page=None, page_size=1):
         
-        extended_expression = self.table.c.hauptnr == self.table.c.laufnr
-        if not condition is None:
-            extended_expression = and_(extended_expression, condition)
+        return super().find(self._restrict_to_documents(condition), page, page_size) 
+
+    def iter_find(self, condition=None, batch_size=DEFAULT_BATCH_SIZE):
         
-        return super().find(extended_expression, page, page_size) 
+        return super().iter_find(self._restrict_to_documents(condition), batch_size)
+
+    def find_with_count(self, condition=None, page=1, page_size=1):
+        
+        return super().find_with_count(self._restrict_to_documents(condition), page, page_size)
+
+    def _restrict_to_documents(self, condition):
+        '''
+        The document table also contains the rows for the additional
+        document files. This extends the condition to just select the
+        document rows. The extended expression is kept on the condition,
+        so a memoized filter expression always gets the same extension
+        (and find_with_count may reuse its key).
+        '''
+        # pylint: disable=protected-access
+        document_rows = self._get_statement(
+            'document_rows', lambda: self.table.c.hauptnr == self.table.c.laufnr)
+        if condition is None:
+            return document_rows
+        extended_expression = getattr(condition, '_alexandria_document_restriction', None)
+        if extended_expression is None:
+            extended_expression = and_(document_rows, condition)
+            condition._alexandria_document_restriction = extended_expression
+        return extended_expression
 
 class DocumentFileInfoDao(EntityDao):
     '''
@@ -861,27 +2649,55 @@ class DocumentFileInfoDao(EntityDao):
     @inject
     def __init__(self,
                  db_engine: baseinjectorkeys.DB_ENGINE_KEY,
-                 creator_provider: baseinjectorkeys.CREATOR_PROVIDER_KEY):
-        super().__init__(db_engine, DOCUMENT_TABLE)
+                 creator_provider: baseinjectorkeys.CREATOR_PROVIDER_KEY,
+                 dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
+        super().__init__(db_engine, DOCUMENT_TABLE, dao_services)
         self.creator_provider = creator_provider
         self.table = DOCUMENT_TABLE
 
     # pylint: disable=arguments-differ
     def get_by_id(self, document_file_id):
-        query = select([self.table])\
-            .where(and_(self.table.c.laufnr == document_file_id,  
-                        self.table.c.seite != None))  
-        return self._get_exactly_one(query)
+        query = self._get_statement(
+            'get_file_info', lambda: select([self.table]).where(
+                and_(self.table.c.laufnr == bindparam('file_id'),
+                     self.table.c.seite != None)))
+        return self._get_exactly_one(query, {'file_id': document_file_id})
+
+    def _load_by_ids(self, entity_ids):
+        entities = {}
+        query = self._get_statement(
+            'get_file_infos', lambda: select([self.table]).where(
+                and_(self.primary_key.in_(bindparam('file_ids', expanding=True)),
+                     self.table.c.seite != None)))
+        for chunk in split_into_chunks(entity_ids):
+            for entity in self._get_list(query, {'file_ids': chunk}):
+                entities[entity.id] = entity
+        return entities
 
     def get_file_infos_for_document(self, document_id):
         '''
         Gets a list of all the document files for a certain document.
         '''
-        query = select([self.table]).where(
-            and_(self.table.c.hauptnr == document_id,  
-                 self.table.c.seite != None)).\
-                 order_by(self.table.c.seite)  
-        return self._get_list(query)
+        query = self._get_statement(
+            'file_infos_for_document', lambda: select([self.table]).where(
+                and_(self.table.c.hauptnr == bindparam('document_id'),
+                     self.table.c.seite != None)).order_by(self.table.c.seite))
+        return self._get_list(query, {'document_id': document_id})
+
+    def get_file_infos_for_documents(self, document_ids):
+        '''
+        Gets the document files for a list of documents, ordered
+        by document and page.
+        '''
+        query = self._get_statement(
+            'file_infos_for_documents', lambda: select([self.table]).where(
+                and_(self.table.c.hauptnr.in_(bindparam('document_ids', expanding=True)),
+                     self.table.c.seite != None)).order_by(self.table.c.hauptnr,
+                                                           self.table.c.seite))
+        file_infos = []
+        for chunk in split_into_chunks(sorted(set(document_ids))):
+            file_infos += self._get_list(query, {'document_ids': chunk})
+        return file_infos
 
     def create_new_file_info(self, document_id, filetype=None, resolution=None):
         '''
@@ -910,22 +2726,14 @@ class DocumentFileInfoDao(EntityDao):
         '''
         Searches for the bigges page number and adds 1.
         '''
-        function = func.max(self.table.c.seite)  
-        query = select([function])\
-        .where(self.table.c.hauptnr == document_id)  
-        row = self._get_exactly_one_row(query)
+        query = self._get_statement(
+            'next_page', lambda: select([func.max(self.table.c.seite)]).where(
+                self.table.c.hauptnr == bindparam('document_id')))
+        row = self._get_exactly_one_row(query, {'document_id': document_id})
         if row[0] is None:
             return 1
         return row[0] + 1  
 
-    def _get_next_id(self):
-        '''
-        Searches for the maximum id and adds 1.
-        '''
-        query = select([func.max(self.table.c.laufnr)])  
-        row = self._get_exactly_one_row(query)
-        return row[0] + 1  
-
     # pylint: disable=arguments-differ
     def _insert(self, file_info):
         # pylint: disable=protected-access
@@ -940,10 +2748,100 @@ class DocumentFileInfoDao(EntityDao):
             aufnahme=func.now(),
             aenderung=func.now())
         self.connection.execute(insert_statement)
+        self._record_statistics({file_info.filetype: 1})
         return file_info
 
+    def _insert_all(self, file_infos):
+        '''
+        Writes a batch of file infos with executemany. File infos
+        without page get the next free pages of their document, all
+        looked up with one query. The first page is stored in the row
+        of the document itself, so these file infos become updates.
+        '''
+        # pylint: disable=protected-access
+        next_pages = self._get_next_pages(
+            set(file_info.document_id for file_info in file_infos if file_info.page is None))
+        creator_id = self.creator_provider.creator.id
+        insert_rows = []
+        update_rows = []
+        changed_rows = Counter()
+        for file_info in file_infos:
+            if file_info.page is None:
+                file_info.page = next_pages[file_info.document_id]
+                next_pages[file_info.document_id] += 1
+            if file_info.page == 1:
+                file_info._id = file_info.document_id
+                update_rows.append({'file_id': file_info.id,
+                                    'new_creator_id': creator_id,
+                                    'new_page': file_info.page,
+                                    'new_resolution': file_info.resolution,
+                                    'new_filetype': file_info.filetype})
+            else:
+                file_info._id = self._get_next_id()
+                insert_rows.append({'hauptnr': file_info.document_id,
+                                    'laufnr': file_info.id,
+                                    'erfasser_id': creator_id,
+                                    'seite': file_info.page,
+                                    'res': file_info.resolution,
+                                    'dateityp': file_info.filetype})
+        for row in insert_rows:
+            changed_rows[row['dateityp']] += 1
+        if update_rows:
+            changed_rows.subtract(self._get_file_types(
+                [row['file_id'] for row in update_rows]).values())
+            for row in update_rows:
+                changed_rows[row['new_filetype']] += 1
+            update_statement = self._get_statement(
+                'update_all', lambda: update(self.table).where(
+                    self.table.c.laufnr == bindparam('file_id')).values(
+                        erfasser_id=bindparam('new_creator_id'),
+                        seite=bindparam('new_page'),
+                        res=bindparam('new_resolution'),
+                        dateityp=bindparam('new_filetype'),
+                        aenderung=func.now()))
+            self.connection.execute(update_statement, update_rows)
+        if insert_rows:
+            insert_statement = self._get_statement(
+                'insert_all', lambda: insert(self.table).values(
+                    aufnahme=func.now(), aenderung=func.now()))
+            self.connection.execute(insert_statement, insert_rows)
+        self._record_statistics(changed_rows)
+        return file_infos
+
+    def _get_file_types(self, file_ids):
+        '''
+        Returns the file types currently stored for the file ids.
+        '''
+        query = self._get_statement(
+            'file_types', lambda: select([self.table.c.laufnr, self.table.c.dateityp]).where(
+                self.table.c.laufnr.in_(bindparam('file_ids', expanding=True))))
+        file_types = {}
+        for chunk in split_into_chunks(file_ids):
+            result = self.connection.execute(query, {'file_ids': chunk})
+            file_types.update(result.fetchall())
+            result.close()
+        return file_types
+
+    def _get_next_pages(self, document_ids):
+        '''
+        Looks up the next free page for each of the documents.
+        '''
+        next_pages = dict.fromkeys(document_ids, 1)
+        query = self._get_statement(
+            'next_pages', lambda: select([self.table.c.hauptnr, func.max(self.table.c.seite)]).\
+                where(self.table.c.hauptnr.in_(bindparam('document_ids', expanding=True))).\
+                group_by(self.table.c.hauptnr))
+        for chunk in split_into_chunks(document_ids):
+            result = self.connection.execute(query, {'document_ids': chunk})
+            for document_id, max_page in result.fetchall():
+                if max_page is not None:
+                    next_pages[document_id] = max_page + 1
+            result.close()
+        return next_pages
+
     # pylint: disable=arguments-differ
     def _update(self, file_info):
+        old_file_types = self._get_file_types([file_info.id])
         update_statement = update(self.table).\
             where(self.table.c.laufnr == file_info.id).\
             values(hauptnr=file_info.document_id,
@@ -953,6 +2851,10 @@ class DocumentFileInfoDao(EntityDao):
                    dateityp=file_info.filetype,
                    aenderung=func.now())
         self.connection.execute(update_statement)
+        if file_info.id in old_file_types:
+            changed_rows = Counter({file_info.filetype: 1})
+            changed_rows[old_file_types[file_info.id]] -= 1
+            self._record_statistics(changed_rows)
         return file_info
 
     # pylint: disable=arguments-differ
@@ -978,6 +2880,35 @@ class DocumentFileInfoDao(EntityDao):
                 self.table.c.laufnr == info.id  
             )
             self.connection.execute(delete_statement)
+            self._record_statistics({info.filetype: -1})
+
+    def _delete_many(self, file_ids):
+        '''
+        Bulk variant of _delete: file infos that are stored in the
+        master document record only get their page cleared, the
+        others are deleted. Returns the number of removed file infos.
+        '''
+        is_master = self.table.c.laufnr == self.table.c.hauptnr
+        in_file_ids = self.table.c.laufnr.in_(bindparam('file_ids', expanding=True))
+        clear_statement = self._get_statement(
+            'clear_master_pages', lambda: update(self.table).where(
+                and_(in_file_ids, is_master)).values(seite=None))
+        counts_query = self._get_statement(
+            'file_type_counts', lambda: select([self.table.c.dateityp, func.count()]).where(
+                and_(in_file_ids, ~is_master)).group_by(self.table.c.dateityp))
+        delete_statement = self._get_statement(
+            'delete_many', lambda: delete(self.table).where(and_(in_file_ids, ~is_master)))
+        deleted = 0
+        for chunk in split_into_chunks(file_ids):
+            parameters = {'file_ids': chunk}
+            deleted += self.connection.execute(clear_statement, parameters).rowcount
+            result = self.connection.execute(counts_query, parameters)
+            counts = result.fetchall()
+            result.close()
+            deleted += self.connection.execute(delete_statement, parameters).rowcount
+            if counts:
+                self._record_statistics({file_type: -count for file_type, count in counts})
+        return deleted
 
     def _row_to_entity(self, row):
         info = DocumentFileInfo(row[self.table.c.laufnr])  
@@ -993,8 +2924,13 @@ class DocumentTypeDao(CachingDao):
     '''
 
     @inject
-    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY):
-        super().__init__(db_engine, DOCUMENT_TYPE_TABLE)
+    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY,
+                 cache_factory: baseinjectorkeys.ENTITY_CACHE_FACTORY_KEY=None,
+                 dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
+        cache = cache_factory.create_cache('documenttype') if cache_factory else None
+        version_stamp = cache_factory.create_version_stamp('documenttype') \
+            if cache_factory else None
+        super().__init__(db_engine, DOCUMENT_TYPE_TABLE, cache, version_stamp, dao_services)
 
     def _row_to_entity(self, row):
         entity = DocumentType(row[self.table.c.id])
@@ -1008,27 +2944,125 @@ class DocumentTypeDao(CachingDao):
         '''
         return self.find()
 
+class CrossReferenceGraph:
+    '''
+    The events around a start event that can be reached by following
+    cross references. depths maps the event ids to the number of hops
+    needed to reach them, cross_references maps the event ids to the
+    sorted ids of their cross referenced events. Events at the
+    maximum depth are only known as targets, so they have no
+    entry in cross_references.
+    '''
+
+    def __init__(self, event_id, max_depth):
+        self.event_id = event_id
+        self.max_depth = max_depth
+        self.depths = {}
+        self.cross_references = {}
+
+    def _get_event_ids(self):
+        '''
+        Returns the ids of all events in the graph, ordered by
+        distance from the start event and by id.
+        '''
+        return sorted(self.depths, key=lambda event_id: (self.depths[event_id], event_id))
+
+    event_ids = property(_get_event_ids)
+
 class EventCrossreferencesDao(GenericDao):
     '''
     Handles the crossreferences between events.
     '''
     
     @inject
-    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY):
-        super().__init__(db_engine)
+    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY,
+             dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
+        super().__init__(db_engine, dao_services)
         self.table = EVENT_CROSS_REFERENCES_TABLE
 
     def get_cross_references(self, event_id):
         '''
         Gets the event ids crossreferenced by the event given by the event_id parameter
         '''
-        query = select([self.table.c.id2]).\
-            where(self.table.c.id1 == event_id)
-        result = self._get_connection().execute(query)
-        event_ids = []
-        for row in result.fetchall():
-            event_ids.append(row[self.table.c.id2])
+        query = self._get_statement(
+            'cross_references', lambda: select([self.table.c.id2]).where(
+                self.table.c.id1 == bindparam('event_id')))
+        with self._use_connection() as connection:
+            result = connection.execute(query, {'event_id': event_id})
+            event_ids = []
+            for row in result.fetchall():
+                event_ids.append(row[self.table.c.id2])
         return event_ids
+
+    def get_cross_references_for_ids(self, event_ids):
+        '''
+        Gets the cross referenced event ids for a list of events with
+        one query per IN_LIST_CHUNK_SIZE ids. Returns a dictionary
+        with the given event ids as keys and sorted lists of the cross
+        referenced ids as values.
+        '''
+        event_ids = list(event_ids)
+        cross_references = {event_id: [] for event_id in event_ids}
+        query = self._get_statement(
+            'cross_references_for_ids', lambda: select([self.table.c.id1, self.table.c.id2]).\
+            where(self.table.c.id1.in_(bindparam('event_ids', expanding=True))).\
+            order_by(self.table.c.id1, self.table.c.id2))
+        for chunk in split_into_chunks(event_ids):
+            with self._use_connection() as connection:
+                result = connection.execute(query, {'event_ids': chunk})
+                for row in result.fetchall():
+                    cross_references[row[self.table.c.id1]].append(row[self.table.c.id2])
+                result.close()
+        return cross_references
+
+    def get_cross_reference_graph(self, event_id, max_depth=DEFAULT_CROSS_REFERENCE_DEPTH):
+        '''
+        Collects the events reachable from the given event by following
+        at most max_depth cross references, together with their cross
+        references, in one query. See CrossReferenceGraph.
+        '''
+        if max_depth < 1:
+            raise DataError(_("The depth of a cross reference graph must be at least 1"))
+        graph = CrossReferenceGraph(event_id, max_depth)
+        with self._use_connection() as connection:
+            result = connection.execute(
+                self._get_statement('cross_reference_graph', self._create_graph_query),
+                {'event_id': event_id, 'max_depth': max_depth})
+            for row in result.fetchall():
+                graph.depths[row.event_id] = row.depth
+                if row.depth < max_depth:
+                    references = graph.cross_references.setdefault(row.event_id, [])
+                    if row.id2 is not None:
+                        references.append(row.id2)
+            result.close()
+        return graph
+
+    def _create_graph_query(self):
+        '''
+        Builds the recursive query for the cross reference graph. It
+        yields the reachable event ids with their distance and, for
+        the events closer than max_depth, their cross references.
+        Every step of the recursion is limited by max_depth, and the
+        union drops rows that have already been produced, so cycles
+        add at most one row per event and depth.
+        '''
+        neighbourhood = select([bindparam('event_id', type_=Integer).label('event_id'),
+                                literal(0, Integer).label('depth')]).\
+            cte('neighbourhood', recursive=True)
+        neighbourhood = neighbourhood.union(
+            select([self.table.c.id2, neighbourhood.c.depth + 1]).select_from(
+                join(neighbourhood, self.table,
+                     self.table.c.id1 == neighbourhood.c.event_id)).where(
+                         neighbourhood.c.depth < bindparam('max_depth', type_=Integer)))
+        distances = select([neighbourhood.c.event_id,
+                            func.min(neighbourhood.c.depth).label('depth')]).\
+            group_by(neighbourhood.c.event_id).subquery('distances')
+        return select([distances.c.event_id, distances.c.depth, self.table.c.id2]).\
+            select_from(distances.outerjoin(
+                self.table,
+                and_(self.table.c.id1 == distances.c.event_id,
+                     distances.c.depth < bindparam('max_depth', type_=Integer)))).\
+            order_by(distances.c.depth, distances.c.event_id, self.table.c.id2)
     
     def add_cross_reference(self, event_id1, event_id2):
         '''
@@ -1075,17 +3109,19 @@ class EventFilterExpressionBuilder(GenericFilterExpressionBuilder):
     for queries.
     '''
 
-    def __init__(self):
-        super().__init__()
+    @inject
+    def __init__(self, search_backend: baseinjectorkeys.SEARCH_BACKEND_KEY=None):
+        super().__init__(search_backend)
         self.table = EVENT_TABLE
         self.textcolumn = self.table.c.ereignis
         
     def _create_expressions(self, filter_object):
-        super()._create_expressions(filter_object)
-        self._append_expression(self._build_earliest_date_expression(filter_object))
-        self._append_expression(self._build_latest_date_expression(filter_object))
-        self._append_expression(self._build_local_only_expression(filter_object))
-        self._append_expression(self._build_unverified_expression(filter_object))
+        expressions = super()._create_expressions(filter_object)
+        expressions.append(self._build_earliest_date_expression(filter_object))
+        expressions.append(self._build_latest_date_expression(filter_object))
+        expressions.append(self._build_local_only_expression(filter_object))
+        expressions.append(self._build_unverified_expression(filter_object))
+        return expressions
 
     def _build_earliest_date_expression(self, filter_object):
         '''
@@ -1131,16 +3167,20 @@ class EventDao(EntityDao):
                  creator_dao: baseinjectorkeys.CREATOR_DAO_KEY,
                  references_dao: baseinjectorkeys.RELATIONS_DAO_KEY,
                  eventtype_dao: baseinjectorkeys.EVENT_TYPE_DAO_KEY,
-                 creator_provider: baseinjectorkeys.CREATOR_PROVIDER_KEY):
+                 creator_provider: baseinjectorkeys.CREATOR_PROVIDER_KEY,
+                 dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
         '''
         Constructor with a lot of dependency injection.
         '''
         # pylint: disable=too-many-arguments
-        super().__init__(db_engine, EVENT_TABLE)
+        super().__init__(db_engine, EVENT_TABLE, dao_services)
         self.creator_dao = creator_dao
         self.references_dao = references_dao
         self.eventtype_dao = eventtype_dao
         self.creator_provider = creator_provider
+        self.eager_joins = [
+            (CREATOR_TABLE, CREATOR_TABLE.c.id == self.table.c.erfasser_id)]
+        self.eager_loading = True
 
     # pylint: disable=arguments-differ
     def _update(self, event):
@@ -1184,9 +3224,58 @@ class EventDao(EntityDao):
                    erfasser_id=ereignis.erfasser.id,
                    aufnahme=func.now(),
                    aenderung=func.now())
-        self._get_connection().execute(insert_statement)
+        self.connection.execute(insert_statement)
+        self._record_statistics(events=1)
         return ereignis
 
+    def _insert_all(self, events):
+        '''
+        The events are grouped by their start date, the sequence
+        numbers for a date are allocated with one query and the rows
+        are written with one executemany statement.
+        '''
+        # pylint: disable=protected-access
+        events_by_date = OrderedDict()
+        for event in events:
+            start_date = event.daterange.start_date
+            events_by_date.setdefault(start_date.as_key(0), (start_date, []))[1].append(event)
+        creator = self.creator_provider.creator
+        rows = []
+        for start_date, date_events in events_by_date.values():
+            sequence_no = self._get_next_free_sequence_id(start_date)
+            if sequence_no + len(date_events) - 1 > 99:
+                raise DataError(_("Too many events for date %s.") % start_date)
+            for event in date_events:
+                event._id = start_date.as_key(sequence_no)
+                sequence_no += 1
+                event.erfasser = creator
+                end_date = event.daterange.end_date
+                rows.append({'ereignis_id': event.id,
+                             'ereignis': event.description,
+                             'ende': end_date.as_key(0) if end_date else None,
+                             'status_id': event.status_id,
+                             'ort_id': event.location_id,
+                             'erfasser_id': creator.id})
+        if rows:
+            insert_statement = self._get_statement(
+                'insert_all', lambda: insert(self.table).values(
+                    aufnahme=func.now(), aenderung=func.now()))
+            self.connection.execute(insert_statement, rows)
+        self._record_statistics(events=len(rows))
+        return events
+
+    def _delete(self, event_id):
+        deleted = super()._delete(event_id)
+        self._record_statistics(events=-deleted)
+        self._update_relation_index(lambda index: index.remove_events([event_id]))
+        return deleted
+
+    def _delete_many(self, event_ids):
+        deleted = super()._delete_many(event_ids)
+        self._record_statistics(events=-deleted)
+        self._update_relation_index(lambda index: index.remove_events(event_ids))
+        return deleted
+
     def _run_date_change(self, event, new_date):
         '''
         Evil method to change the id of the event, because
@@ -1204,6 +3293,8 @@ class EventDao(EntityDao):
         update_statement = update(self.table).values(ereignis_id=new_id).\
         where(self.table.c.ereignis_id == event.id)  
         self.connection.execute(update_statement)
+        old_id = event.id
+        self._update_relation_index(lambda index: index.rename_event(old_id, new_id))
         return new_id
 
     def _get_next_free_sequence_id(self, alex_date):
@@ -1213,13 +3304,12 @@ class EventDao(EntityDao):
         just may have up to 99 events for a date.
         '''
         min_key = alex_date.as_key(0)
-        max_key = min_key + 99
-        function = func.max(self.table.c.ereignis_id)  
-        max_existing_query = select([function]).where(
-            and_(self.table.c.ereignis_id > min_key,  
-                 self.table.c.ereignis_id <= max_key))  
-        result = self.connection.execute(max_existing_query)
-        row = result.fetchone()
+        max_existing_query = self._get_statement(
+            'max_sequence_id', lambda: select([func.max(self.table.c.ereignis_id)]).where(
+                and_(self.table.c.ereignis_id > bindparam('min_key'),
+                     self.table.c.ereignis_id <= bindparam('max_key'))))
+        row = self._get_exactly_one_row(max_existing_query,
+                                        {'min_key': min_key, 'max_key': min_key + 99})
         if not row[0]:
             return 1
         max_existing_date = AlexDateRange(row[0], None)
@@ -1246,7 +3336,8 @@ class EventDao(EntityDao):
         event.daterange = AlexDateRange(row[self.table.c.ereignis_id],  
                                         row[self.table.c.ende])  
         event.status_id = row[self.table.c.status_id]  
-        event.erfasser = self.creator_dao.get_by_id(row[self.table.c.erfasser_id])  
+        event.erfasser = self._get_related_entity(
+            self.creator_dao, row, row[self.table.c.erfasser_id])
         event.creation_date = row[self.table.c.aufnahme]  
         event.change_date = row[self.table.c.aenderung]  
         event.location_id = row[self.table.c.ort_id]  
@@ -1259,13 +3350,14 @@ class EventDao(EntityDao):
         '''
         min_id = alex_date.as_key(0)
         max_id = alex_date.as_key(99)
-        query = select([self.table]).where(
+        query = self._get_select().where(
             and_(self.table.c.ereignis_id > min_id,  
                  self.table.c.ereignis_id < max_id))  
-        result = self._get_connection().execute(query)
-        events = []
-        for row in result:
-            events.append(self._row_to_entity(row))
+        with self._use_connection() as connection:
+            result = connection.execute(query)
+            events = []
+            for row in result:
+                events.append(self._row_to_entity(row))
         return events
     
     def get_statistics(self):
@@ -1273,44 +3365,85 @@ class EventDao(EntityDao):
         Returns statistical information on the documents in the database
         '''
         
-        statistics = EventStatistics()
-        statistics.number_of_events = self.get_count()
-        return statistics
+        return self._get_archive_statistics().get_event_statistics()
 
 
 class EventTypeDao(GenericDao):
     '''
     Dao for event types.
+
+    The event type table is small and rarely changes, so it is held
+    in memory as a catalogue keyed by the event type identifier. Event
+    types are not written through this package, so the catalogue is
+    only invalidated by clear_cache(). Identifiers that are missing
+    from the catalogue trigger one reload, in case another process
+    added them.
     '''
 
     @inject
-    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY):
-        super().__init__(db_engine)
+    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY,
+                 dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
+        super().__init__(db_engine, dao_services)
         self.table = EVENTTYPE_TABLE
         self.ref_table = EVENT_EVENTTYPE_REFERENCE_TABLE
-        
+        self.catalogue = None
+        self.missing_ids = set()
+
+    def clear_cache(self):
+        '''
+        Drops the catalogue, so it is read again on next access.
+        '''
+        self.catalogue = None
+
+    def _get_catalogue(self):
+        '''
+        Returns the event types as dictionary keyed by their
+        identifiers. Loads the catalogue, if it was not filled.
+        '''
+        catalogue = self.catalogue
+        if catalogue is None:
+            with self._use_connection() as connection:
+                result = connection.execute(select([self.table]))
+                catalogue = OrderedDict()
+                for row in result.fetchall():
+                    entity = self._row_to_entity(row)
+                    catalogue[entity.id] = entity
+                result.close()
+            self.missing_ids = set()
+            self.catalogue = catalogue
+        return catalogue
+
+    def _get_from_catalogue(self, catalogue, event_type_id):
+        '''
+        Looks up an event type in the catalogue. Unknown types may
+        have been added by another process, so the catalogue is read
+        again before giving up. Identifiers still missing after that
+        are remembered until the next reload.
+        '''
+        event_type = catalogue.get(event_type_id)
+        if event_type is not None:
+            return event_type
+        if catalogue is self.catalogue and event_type_id not in self.missing_ids:
+            self.clear_cache()
+            event_type = self._get_catalogue().get(event_type_id)
+            if event_type is None:
+                self.missing_ids.add(event_type_id)
+        if event_type is None:
+            raise NoSuchEntityException("Did not find event type %s" % event_type_id)
+        return event_type
+
     def get_by_id(self, event_type_id):
         '''
-        Gets the event type from the cache. Loads the cache, if it
-        was not filled.
+        Gets the event type from the catalogue. Loads the catalogue,
+        if it was not filled.
         '''
-        query = select([self.table]).where(
-            and_(self.table.c.haupt == event_type_id.hauptid,
-                 self.table.c.unter == event_type_id.unterid))
-        row = self._get_exactly_one_row(query)
-        return self._row_to_entity(row)
+        return self._get_from_catalogue(self._get_catalogue(), event_type_id)
         
     def find_all(self):
         '''
         Fetches all event types.
         '''
-        query = select([self.table])
-        result = self._get_connection().execute(query)
-        types = []
-        for row in result.fetchall():
-            types.append(self._row_to_entity(row))
-        result.close()
-        return types
+        return list(self._get_catalogue().values())
     
     def get_event_type_tree(self):
         '''
@@ -1324,32 +3457,76 @@ class EventTypeDao(GenericDao):
         '''
         Fetches the event types for a certain event
         '''
-        query = select([self.ref_table]).\
-            where(
-                self.ref_table.c.ereignis_id == ereignis_id
-            ).order_by(
-                self.ref_table.c.hauptid,
-                self.ref_table.c.unterid
-            )
-        result = self._get_connection().execute(query)
-        typelist = []
-        for row in result.fetchall():
-            typelist.append(
-                self.get_by_id(
-                    EventTypeIdentifier(
-                        row[self.ref_table.c.hauptid],
-                        row[self.ref_table.c.unterid])
-                )
-            )
-        result.close()
-        return typelist
+        query = self._get_statement(
+            'event_types_for_event_id', lambda: select(
+                [self.ref_table.c.hauptid, self.ref_table.c.unterid]).where(
+                    self.ref_table.c.ereignis_id == bindparam('event_id')).order_by(
+                        self.ref_table.c.hauptid,
+                        self.ref_table.c.unterid))
+        with self._use_connection() as connection:
+            result = connection.execute(query, {'event_id': ereignis_id})
+            rows = result.fetchall()
+            result.close()
+        catalogue = self._get_catalogue()
+        return [self._get_from_catalogue(
+            catalogue,
+            EventTypeIdentifier(row[self.ref_table.c.hauptid], row[self.ref_table.c.unterid]))
+                for row in rows]
+
+    def get_event_types_for_event_ids(self, event_ids):
+        '''
+        Fetches the event types for a list of events with one query
+        per IN_LIST_CHUNK_SIZE ids. The types are resolved from the
+        catalogue like in get_event_types_for_event_id. Returns a
+        dictionary with the event ids as keys and the ordered lists of
+        event types as values. Events without event types are mapped
+        to empty lists.
+        '''
+        event_ids = list(event_ids)
+        event_types = {event_id: [] for event_id in event_ids}
+        if not event_ids:
+            return event_types
+        query = self._get_statement(
+            'event_types_for_event_ids', lambda: select(
+                [self.ref_table.c.ereignis_id, self.ref_table.c.hauptid,
+                 self.ref_table.c.unterid]).where(
+                     self.ref_table.c.ereignis_id.in_(
+                         bindparam('event_ids', expanding=True))).order_by(
+                             self.ref_table.c.ereignis_id,
+                             self.ref_table.c.hauptid,
+                             self.ref_table.c.unterid))
+        rows = []
+        for chunk in split_into_chunks(event_ids):
+            with self._use_connection() as connection:
+                result = connection.execute(query, {'event_ids': chunk})
+                rows.extend(result.fetchall())
+                result.close()
+        for row in rows:
+            event_types[row[self.ref_table.c.ereignis_id]].append(self._get_from_catalogue(
+                self._get_catalogue(),
+                EventTypeIdentifier(row[self.ref_table.c.hauptid],
+                                    row[self.ref_table.c.unterid])))
+        return event_types
 
     def join_event_type_to_event_id(self, event_id, event_type):
         '''
         Adds an event type to the given event.
         '''
-        already_joined = self.get_event_types_for_event_id(event_id)
-        if event_type in already_joined:
+        self.transactional(self._join_event_type_to_event_id, event_id, event_type)
+
+    def _join_event_type_to_event_id(self, event_id, event_type):
+        '''
+        Inserts the reference, if it does not exist yet.
+        '''
+        parameters = {'event_id': event_id,
+                      'hauptid': event_type.id.hauptid,
+                      'unterid': event_type.id.unterid}
+        query = self._get_statement(
+            'event_type_linked', lambda: select([func.count()]).where(
+                and_(self.ref_table.c.ereignis_id == bindparam('event_id'),
+                     self.ref_table.c.hauptid == bindparam('hauptid'),
+                     self.ref_table.c.unterid == bindparam('unterid'))))
+        if self._get_exactly_one_row(query, parameters)[0] > 0:
             return
         query = insert(self.ref_table).values(ereignis_id=event_id,
                                               hauptid=event_type.id.hauptid,
@@ -1364,7 +3541,8 @@ class EventTypeDao(GenericDao):
             and_(self.ref_table.c.ereignis_id == event_id,
                  self.ref_table.c.hauptid == event_type.id.hauptid,
                  self.ref_table.c.unterid == event_type.id.unterid))
-        self.connection.execute(query)
+        with self._use_connection() as connection:
+            connection.execute(query)
 
     def _row_to_entity(self, row):
         event_type_id = EventTypeIdentifier(row[self.table.c.haupt], row[self.table.c.unter])
@@ -1376,8 +3554,9 @@ class RegistryDao(GenericDao):
     '''
 
     @inject
-    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY):
-        super().__init__(db_engine)
+    def __init__(self, db_engine: baseinjectorkeys.DB_ENGINE_KEY,
+             dao_services: baseinjectorkeys.DAO_SERVICES_KEY=None):
+        super().__init__(db_engine, dao_services)
         self.table = REGISTRY_TABLE
 
     def get(self, key):
@@ -1386,9 +3565,10 @@ class RegistryDao(GenericDao):
         not exist the method returns None
         '''
 
-        query = select([self.table])\
-            .where(self.table.c.schluessel == key)
-        row = self._get_one_row_or_none(query)
+        query = self._get_statement(
+            'get', lambda: select([self.table]).where(
+                self.table.c.schluessel == bindparam('key')))
+        row = self._get_one_row_or_none(query, {'key': key})
         if row is None:
             return row
         return row[self.table.c.wert]
@@ -1407,13 +3587,201 @@ class RegistryDao(GenericDao):
         query = update(self.table)\
             .values(wert=value)\
             .where(self.table.c.schluessel == key)
-        self.connection.execute(query)
+        with self._use_connection() as connection:
+            connection.execute(query)
 
     def _insert(self, key, value):
         query = insert(self.table).values(
             schluessel=key,
             wert=value)
-        self.connection.execute(query)
+        with self._use_connection() as connection:
+            connection.execute(query)
+
+class CompactReferences:
+    '''
+    Document event references in compressed sparse row form: three
+    integer arrays instead of a dictionary of lists. document_ids
+    is sorted, the event ids of the document at index i are
+    event_ids[offsets[i]:offsets[i + 1]].
+    '''
+
+    def __init__(self):
+        self.document_ids = array('q')
+        self.offsets = array('q', [0])
+        self.event_ids = array('q')
+
+    def append(self, document_id, event_ids):
+        '''
+        Appends a document. The documents must be appended in
+        ascending order.
+        '''
+        self.document_ids.append(document_id)
+        self.event_ids.extend(event_ids)
+        self.offsets.append(len(self.event_ids))
+
+    def get_event_ids(self, document_id):
+        '''
+        Returns the event ids referenced by the document. Raises
+        a KeyError if the document is not contained.
+        '''
+        index = bisect_left(self.document_ids, document_id)
+        if index == len(self.document_ids) or self.document_ids[index] != document_id:
+            raise KeyError(document_id)
+        return self.event_ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def __len__(self):
+        return len(self.document_ids)
+
+    def __contains__(self, document_id):
+        index = bisect_left(self.document_ids, document_id)
+        return index < len(self.document_ids) and self.document_ids[index] == document_id
+
+    def __iter__(self):
+        for index, document_id in enumerate(self.document_ids):
+            yield document_id, self.event_ids[self.offsets[index]:self.offsets[index + 1]]
+
+class RelationIndex:
+    '''
+    In-memory index of the document event references in both
+    directions. The references of dverweis are resolved to the
+    document ids (hauptnr) and held as sorted integer arrays per
+    document and per event, so the lookups of the relations dao
+    need no database access. The daos changing references update
+    the index after their commit, changes of other processes are
+    noticed through the version stamp and lead to a reload.
+    '''
+
+    def __init__(self, version_stamp):
+        self.version_stamp = version_stamp
+        self.lock = Lock()
+        self.loaded = False
+        self.events_by_document = {}
+        self.documents_by_event = {}
+        document_id = DOCUMENT_TABLE.c.hauptnr
+        event_id = DOCUMENT_EVENT_REFERENCE_TABLE.c.ereignis_id
+        self.query = select([document_id, event_id]).\
+            select_from(join(DOCUMENT_EVENT_REFERENCE_TABLE, DOCUMENT_TABLE,
+                             DOCUMENT_TABLE.c.laufnr == DOCUMENT_EVENT_REFERENCE_TABLE.c.laufnr)).\
+            distinct().order_by(document_id, event_id)
+
+    def is_due(self):
+        '''
+        Tells if the index must be loaded or checked for changes of
+        other processes.
+        '''
+        return not self.loaded or self.version_stamp.is_due()
+
+    def refresh_if_outdated(self, connection):
+        '''
+        Loads the index, if it has not been loaded yet or if
+        another process has changed the references.
+        '''
+        if self.version_stamp.is_outdated(connection) or not self.loaded:
+            self.load(connection)
+
+    def load(self, connection):
+        '''
+        Reads all references into the index.
+        '''
+        events_by_document = {}
+        documents_by_event = {}
+        result = connection.execute(self.query)
+        for document_id, event_id in result:
+            events_by_document.setdefault(document_id, array('q')).append(event_id)
+            documents_by_event.setdefault(event_id, array('q')).append(document_id)
+        result.close()
+        with self.lock:
+            self.events_by_document = events_by_document
+            self.documents_by_event = documents_by_event
+            self.loaded = True
+
+    def get_event_ids(self, document_id):
+        '''
+        Returns the sorted ids of the events referenced by the document.
+        '''
+        with self.lock:
+            return list(self.events_by_document.get(document_id, ()))
+
+    def get_document_ids(self, event_id):
+        '''
+        Returns the sorted ids of the documents referencing the event.
+        '''
+        with self.lock:
+            return list(self.documents_by_event.get(event_id, ()))
+
+    def add(self, document_id, event_id):
+        '''
+        Adds a reference.
+        '''
+        with self.lock:
+            self._add(self.events_by_document, document_id, event_id)
+            self._add(self.documents_by_event, event_id, document_id)
+
+    def remove(self, document_id, event_id):
+        '''
+        Removes a reference.
+        '''
+        with self.lock:
+            self._remove(self.events_by_document, document_id, event_id)
+            self._remove(self.documents_by_event, event_id, document_id)
+
+    def remove_documents(self, document_ids):
+        '''
+        Removes all references of deleted documents.
+        '''
+        with self.lock:
+            self._remove_keys(self.events_by_document, self.documents_by_event, document_ids)
+
+    def remove_events(self, event_ids):
+        '''
+        Removes all references of deleted events.
+        '''
+        with self.lock:
+            self._remove_keys(self.documents_by_event, self.events_by_document, event_ids)
+
+    def rename_event(self, old_event_id, new_event_id):
+        '''
+        Moves the references of an event to its new id.
+        '''
+        with self.lock:
+            document_ids = self.documents_by_event.get(old_event_id, ())
+            self._remove_keys(self.documents_by_event, self.events_by_document, [old_event_id])
+            for document_id in document_ids:
+                self._add(self.events_by_document, document_id, new_event_id)
+                self._add(self.documents_by_event, new_event_id, document_id)
+
+    @staticmethod
+    def _add(adjacency, key, value):
+        '''
+        Inserts the value into the sorted array of the key.
+        '''
+        values = adjacency.setdefault(key, array('q'))
+        index = bisect_left(values, value)
+        if index == len(values) or values[index] != value:
+            values.insert(index, value)
+
+    @staticmethod
+    def _remove(adjacency, key, value):
+        '''
+        Removes the value from the sorted array of the key.
+        '''
+        values = adjacency.get(key)
+        if values is None:
+            return
+        index = bisect_left(values, value)
+        if index < len(values) and values[index] == value:
+            del values[index]
+        if not values:
+            del adjacency[key]
+
+    def _remove_keys(self, adjacency, reverse_adjacency, keys):
+        '''
+        Removes the keys from one direction and their values from
+        the other.
+        '''
+        for key in keys:
+            for value in adjacency.pop(key, ()):
+                self._remove(reverse_adjacency, value, key)
 
 class DocumentEventRelationsDao(GenericDao):
     '''
@@ -1427,14 +3795,27 @@ class DocumentEventRelationsDao(GenericDao):
                  document_filter_expression_builder:
                  baseinjectorkeys.DOCUMENT_FILTER_EXPRESSION_BUILDER_KEY,
                  event_filter_expression_builder:
-                 baseinjectorkeys.EVENT_FILTER_EXPRESSION_BUILDER_KEY):
-        super().__init__(db_engine)
+                 baseinjectorkeys.EVENT_FILTER_EXPRESSION_BUILDER_KEY,
+                 dao_services:
+                 baseinjectorkeys.DAO_SERVICES_KEY=None):
+        super().__init__(db_engine, dao_services)
         self.deref_table = DOCUMENT_EVENT_REFERENCE_TABLE
         self.doc_table = DOCUMENT_TABLE
         self.event_table = EVENT_TABLE
         self.doc_filter_expression_builder = document_filter_expression_builder
         self.event_filter_expression_builder = event_filter_expression_builder
         
+    def _get_relation_index(self):
+        '''
+        Returns the relation index, if it is enabled, after loading
+        it or checking it for changes of other processes when due.
+        '''
+        relation_index = self.dao_services.relation_index
+        if relation_index is not None and relation_index.is_due():
+            with self._use_connection() as connection:
+                relation_index.refresh_if_outdated(connection)
+        return relation_index
+
     # TODO: clean up the references and use pages instead of file ids
     def fetch_doc_file_ids_for_event_id(self, event_id):
         '''
@@ -1445,11 +3826,12 @@ class DocumentEventRelationsDao(GenericDao):
         '''
         query = select([self.deref_table.c.laufnr]).where(
             self.deref_table.c.ereignis_id == event_id)  
-        result = self._get_connection().execute(query)
-        file_ids = []
-        for row in result.fetchall():
-            file_ids.append(row[self.deref_table.c.laufnr])  
-        result.close()
+        with self._use_connection() as connection:
+            result = connection.execute(query)
+            file_ids = []
+            for row in result.fetchall():
+                file_ids.append(row[self.deref_table.c.laufnr])  
+            result.close()
         return file_ids
     
     def fetch_document_ids_for_event_id(self, ereignis_id):
@@ -1458,40 +3840,123 @@ class DocumentEventRelationsDao(GenericDao):
         does not link document ids but document file ids the query is
         complicated.
         '''
-        subquery = select([self.deref_table.c.laufnr]).where(
-            self.deref_table.c.ereignis_id == ereignis_id)  
-        query = select([self.doc_table.c.hauptnr]).where(
-            self.doc_table.c.laufnr.in_(subquery)).distinct().order_by(
-                self.doc_table.c.hauptnr)  
-        result = self._get_connection().execute(query)
-        dokument_ids = []
-        for row in result.fetchall():
-            dokument_ids.append(row[self.doc_table.c.hauptnr])  
-        result.close()
+        relation_index = self._get_relation_index()
+        if relation_index is not None:
+            return relation_index.get_document_ids(ereignis_id)
+        query = self._get_statement(
+            'document_ids_for_event_id', lambda: select([self.doc_table.c.hauptnr]).where(
+                self.doc_table.c.laufnr.in_(
+                    select([self.deref_table.c.laufnr]).where(
+                        self.deref_table.c.ereignis_id == bindparam('event_id')))).\
+            distinct().order_by(self.doc_table.c.hauptnr))
+        with self._use_connection() as connection:
+            result = connection.execute(query, {'event_id': ereignis_id})
+            dokument_ids = []
+            for row in result.fetchall():
+                dokument_ids.append(row[self.doc_table.c.hauptnr])  
+            result.close()
         return dokument_ids
     
     def join_document_id_with_event_id(self, document_id, event_id):
         '''
-        Adds the document and event ids into the join table
+        Adds the document and event ids into the join table. Existing
+        links are left alone.
         '''
-        if document_id in self.fetch_document_ids_for_event_id(event_id):
-            # already joined
-            return 
-        insert_statement = insert(self.deref_table).\
-            values(ereignis_id=event_id,
-                   laufnr=document_id)
-        self._get_connection().execute(insert_statement)
-        
-    # TODO: This method does not work correctly, when a document file
-    #       is linked that is not the first document file for the document.
+        self.transactional(self._link, [(document_id, event_id)])
+
+    def link_documents_to_event(self, event_id, document_ids):
+        '''
+        Links all the documents to the event in one statement.
+        Existing links are left alone.
+        '''
+        self.transactional(self._link,
+                           [(document_id, event_id) for document_id in document_ids])
+
+    def link_events_to_document(self, document_id, event_ids):
+        '''
+        Links all the events to the document in one statement.
+        Existing links are left alone.
+        '''
+        self.transactional(self._link,
+                           [(document_id, event_id) for event_id in event_ids])
+
+    def _link(self, links):
+        '''
+        Inserts the (document id, event id) tuples into the join table,
+        skipping those that already exist.
+        '''
+        links = list(dict.fromkeys(links))
+        if not links:
+            return
+        self._data_changed()
+        self.connection.execute(
+            self._get_statement('link', self._create_link_statement),
+            [{'ereignis_id': event_id, 'laufnr': document_id}
+             for document_id, event_id in links])
+        self._update_relation_index(lambda index: self._add_links(index, links))
+
+    @staticmethod
+    def _add_links(relation_index, links):
+        '''
+        Adds the new links to the relation index.
+        '''
+        for document_id, event_id in links:
+            relation_index.add(document_id, event_id)
+
+    def _create_link_statement(self):
+        '''
+        Builds an insert from a select for the join table that skips
+        documents already linked to the event by one of their files,
+        so no check for an existing link is needed up front. Links
+        inserted concurrently collide on the unique index on laufnr
+        and ereignis_id, postgres and sqlite ignore these rows.
+        '''
+        event_id = bindparam('ereignis_id', type_=Integer)
+        document_id = bindparam('laufnr', type_=Integer)
+        dialect = self.db_engine.dialect.name
+        statement = postgresql.insert(self.deref_table) if dialect == 'postgresql' \
+            else insert(self.deref_table)
+        statement = statement.from_select(
+            ['ereignis_id', 'laufnr'],
+            select([event_id, document_id]).where(~exists().where(
+                and_(self.deref_table.c.ereignis_id == event_id,
+                     self._get_document_link_condition(document_id)))))
+        if dialect == 'postgresql':
+            return statement.on_conflict_do_nothing()
+        if dialect == 'sqlite':
+            return statement.prefix_with('OR IGNORE')
+        return statement
+
     def delete_document_event_relation(self, document_id, event_id):
         '''
-        Unlinks a document from an event.
+        Unlinks a document from an event. The links of all files of
+        the document are removed.
+        '''
+        self.transactional(self._unlink, document_id, event_id)
+
+    def _unlink(self, document_id, event_id):
+        '''
+        Deletes the links of the document files to the event.
+        '''
+        self._data_changed()
+        delete_statement = self._get_statement(
+            'unlink', lambda: delete(self.deref_table).where(
+                and_(self.deref_table.c.ereignis_id == bindparam('event_id'),
+                     self._get_document_link_condition(bindparam('document_id')))))
+        self.connection.execute(delete_statement,
+                                {'document_id': document_id, 'event_id': event_id})
+        self._update_relation_index(lambda index: index.remove(document_id, event_id))
+
+    def _get_document_link_condition(self, document_id):
+        '''
+        Matches the join table rows of the files of a document. A
+        file id given instead of the document id matches the rows
+        of the file.
         '''
-        delete_statement = delete(self.deref_table).where(
-            and_(self.deref_table.c.ereignis_id == event_id,  
-                 self.deref_table.c.laufnr == document_id))  
-        self._get_connection().execute(delete_statement)
+        return or_(self.deref_table.c.laufnr == document_id,
+                   self.deref_table.c.laufnr.in_(
+                       select([self.doc_table.c.laufnr]).where(
+                           self.doc_table.c.hauptnr == document_id)))
     
     def fetch_doc_event_references(self, document_event_reference_filter):
         '''
@@ -1502,7 +3967,43 @@ class DocumentEventRelationsDao(GenericDao):
         The filter is a combination of a document and an event filter. The
         document and the event criteria are joined with `and`.
         '''
-        
+        return dict(self.iter_doc_event_references(document_event_reference_filter))
+
+    def fetch_doc_event_references_compact(self, document_event_reference_filter):
+        '''
+        Same as fetch_doc_event_references, but returns the references
+        as CompactReferences, which need a fraction of the memory of
+        the dictionary for large results.
+        '''
+        references = CompactReferences()
+        for document_id, event_ids in \
+                self.iter_doc_event_references(document_event_reference_filter):
+            references.append(document_id, event_ids)
+        return references
+
+    def iter_doc_event_references(self, document_event_reference_filter):
+        '''
+        Generator variant of fetch_doc_event_references: yields tuples
+        of a document id and the list of its event ids, ordered by
+        document id. The rows are streamed from the database, so only
+        the references of one document are held in memory.
+        '''
+        query = self._get_doc_event_references_query(document_event_reference_filter).\
+            order_by(self.doc_table.c.hauptnr, self.deref_table.c.ereignis_id).\
+            execution_options(stream_results=True)
+        with self._use_connection() as connection:
+            result = connection.execute(query)
+            try:
+                for document_id, rows in groupby(result, lambda row: row[0]):
+                    yield document_id, [row[1] for row in rows if row[1] is not None]
+            finally:
+                result.close()
+
+    def _get_doc_event_references_query(self, document_event_reference_filter):
+        '''
+        Builds the query for document ids and event ids of the
+        references allowed by the filter.
+        '''
         join = self.doc_table.outerjoin(
             self.deref_table,
             self.deref_table.c.laufnr == self.doc_table.c.hauptnr).outerjoin(
@@ -1523,33 +4024,27 @@ class DocumentEventRelationsDao(GenericDao):
         
         if where_clauses:
             query = query.where(combine_expressions(where_clauses, and_))
-
-        references = {}
-        for row in self._get_connection().execute(query):
-            document_id = row[self.doc_table.c.hauptnr]
-            event_id = row[self.deref_table.c.ereignis_id]
-            if not document_id in references:
-                references[document_id] = []
-            if event_id is not None:
-                references[document_id].append(event_id)
-            
-        return references
+        return query
 
     def fetch_ereignis_ids_for_dokument_id(self, dokument_id):
         '''
         Does what the method name says.
         '''
-        subquery = select([self.doc_table.c.laufnr]).\
-            where(self.doc_table.c.hauptnr == dokument_id)  
-        query = select([self.deref_table.c.ereignis_id]).\
-            where(self.deref_table.c.laufnr.in_(subquery)).\
-            distinct().\
-            order_by(self.deref_table.c.ereignis_id)  
-        result = self._get_connection().execute(query)
-        ereignis_ids = []
-        for row in result.fetchall():
-            ereignis_ids.append(row[self.deref_table.c.ereignis_id])  
-        result.close()
+        relation_index = self._get_relation_index()
+        if relation_index is not None:
+            return relation_index.get_event_ids(dokument_id)
+        query = self._get_statement(
+            'event_ids_for_document_id', lambda: select([self.deref_table.c.ereignis_id]).where(
+                self.deref_table.c.laufnr.in_(
+                    select([self.doc_table.c.laufnr]).where(
+                        self.doc_table.c.hauptnr == bindparam('document_id')))).\
+            distinct().order_by(self.deref_table.c.ereignis_id))
+        with self._use_connection() as connection:
+            result = connection.execute(query, {'document_id': dokument_id})
+            ereignis_ids = []
+            for row in result.fetchall():
+                ereignis_ids.append(row[self.deref_table.c.ereignis_id])  
+            result.close()
         return ereignis_ids
 
 class DaoModule(Module):
@@ -1563,6 +4058,14 @@ class DaoModule(Module):
                     ClassProvider(EventFilterExpressionBuilder), scope=singleton)
         binder.bind(baseinjectorkeys.DOCUMENT_FILTER_EXPRESSION_BUILDER_KEY,
                     ClassProvider(DocumentFilterExpressionBuilder), scope=singleton)
+        binder.bind(baseinjectorkeys.ENTITY_CACHE_FACTORY_KEY,
+                    ClassProvider(EntityCacheFactory), scope=singleton)
+        binder.bind(baseinjectorkeys.ID_ALLOCATORS_KEY,
+                    ClassProvider(IdAllocators), scope=singleton)
+        binder.bind(baseinjectorkeys.ARCHIVE_STATISTICS_KEY,
+                    ClassProvider(ArchiveStatistics), scope=singleton)
+        binder.bind(baseinjectorkeys.DAO_SERVICES_KEY,
+                    ClassProvider(DaoServices), scope=singleton)
         binder.bind(baseinjectorkeys.CREATOR_DAO_KEY,
                     ClassProvider(CreatorDao), scope=singleton)
         binder.bind(baseinjectorkeys.REGISTRY_DAO_KEY,
@@ -1591,10 +4094,79 @@ class DaoModule(Module):
         '''
         Creates the database engine from configuration information
         '''
-        # pylint: disable=no-self-use
         arguments = {'echo': False}
         if config_service.dbname == ':memory:':
             # we want to be threadsafe when we are in the test environment
             arguments['connect_args'] = {'check_same_thread':False}
             arguments['poolclass'] = StaticPool
+        else:
+            arguments.update(self.get_pool_arguments(config_service))
+        try:
+            if config_service.dbquerycachesize:
+                arguments['query_cache_size'] = int(config_service.dbquerycachesize)
+        except NoSuchConfigValue:
+            pass
         return create_engine(config_service.connection_string, **arguments)
+
+    @provider
+    @singleton
+    @inject
+    def create_relation_index(self,
+                              config_service: baseinjectorkeys.CONFIG_KEY,
+                              cache_factory: baseinjectorkeys.ENTITY_CACHE_FACTORY_KEY) -> \
+                              baseinjectorkeys.RELATION_INDEX_KEY:
+        '''
+        Creates the relation index, if it is enabled by the
+        "relationindex" configuration entry, else returns None.
+        '''
+        # pylint: disable=no-self-use
+        try:
+            if config_service.relationindex.lower() in ('true', 'yes', '1'):
+                return RelationIndex(cache_factory.create_version_stamp('relations'))
+        except NoSuchConfigValue:
+            pass
+        return None
+
+    @provider
+    @singleton
+    @inject
+    def create_search_backend(self,
+                              config_service: baseinjectorkeys.CONFIG_KEY) -> \
+                              baseinjectorkeys.SEARCH_BACKEND_KEY:
+        '''
+        Creates the search backend for filter search terms chosen by
+        the "searchbackend" configuration entry: "like" (the default),
+        "postgres" or "sqlitefts".
+        '''
+        # pylint: disable=no-self-use
+        try:
+            backend_name = config_service.searchbackend or 'like'
+        except NoSuchConfigValue:
+            backend_name = 'like'
+        if backend_name not in SEARCH_BACKENDS:
+            raise DataError(_("Unknown search backend: %s") % backend_name)
+        return SEARCH_BACKENDS[backend_name]()
+
+    def get_pool_arguments(self, config_service):
+        '''
+        Reads the optional connection pool settings from the
+        configuration and converts them into engine arguments.
+        Pool sizing is only possible for database servers, sqlite
+        does not use a sized pool.
+        '''
+        # pylint: disable=no-self-use
+        settings = [('pool_pre_ping', lambda: config_service.dbpoolpreping,
+                     lambda value: value.lower() in ('true', 'yes', '1')),
+                    ('pool_recycle', lambda: config_service.dbpoolrecycle, int)]
+        if not config_service.dbengine.startswith('sqlite'):
+            settings.append(('pool_size', lambda: config_service.dbpoolsize, int))
+            settings.append(('max_overflow', lambda: config_service.dbmaxoverflow, int))
+        arguments = {}
+        for argument, getter, converter in settings:
+            try:
+                value = getter()
+            except NoSuchConfigValue:
+                continue
+            if value:
+                arguments[argument] = converter(value)
+        return arguments
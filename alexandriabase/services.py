@@ -11,8 +11,10 @@ import shutil
 import struct
 import sys
 import tempfile
+import time
 
 from _io import BytesIO
+from itertools import islice
 from math import ceil
 from subprocess import call
 
@@ -33,10 +35,13 @@ from reportlab.lib.units import cm, inch
 from reportlab.platypus.flowables import Image as PdfImage
 
 from sqlalchemy.sql.expression import text, update, select
+from sqlalchemy.exc import OperationalError
 
 from alexandriabase import _, baseinjectorkeys, fontdir
-from alexandriabase.base_exceptions import NoSuchEntityException
-from alexandriabase.daos import CURRENT_VERSION, REGISTRY_TABLE
+from alexandriabase.base_exceptions import NoSuchEntityException, DataError
+from alexandriabase.config import NoSuchConfigValue
+from alexandriabase.daos import CURRENT_VERSION, REGISTRY_TABLE, split_into_chunks,\
+    DEFAULT_CROSS_REFERENCE_DEPTH
 from alexandriabase.domain import PaginatedResult, Document, Tree, EventType,\
     EventTypeIdentifier, Event
 
@@ -218,6 +223,21 @@ class BaseRecordService():
         '''
         return self.dao.get_nearest(entity_id, filter_expression)
     
+    def create_cursor(self, filter_expression, background=False):
+        '''
+        Returns a record cursor of the dao that serves the navigation
+        methods for the filter expression from prefetched windows.
+        The windows are refilled synchronously unless background is set.
+        '''
+        return self.dao.create_cursor(filter_expression, background=background)
+    
+    def create_filter_snapshot(self, filter_expression):
+        '''
+        Returns a filter snapshot of the dao for navigating and
+        counting without evaluating the filter expression again.
+        '''
+        return self.dao.create_filter_snapshot(filter_expression)
+    
     def create_filter_expression(self, filter_object):
         '''
         Uses a dao specific filter object to build a filter expression
@@ -244,9 +264,9 @@ class BaseRecordService():
         result = PaginatedResult()
         result.page = page
         result.page_size = page_size
-        number_of_entities = self.dao.get_count(condition)
+        result.entities, number_of_entities = self.dao.find_with_count(
+            condition, page, page_size)
         result.number_of_pages = ceil((number_of_entities * 1.0) / page_size)
-        result.entities = self.dao.find(condition, page, page_size)
         return result
 
 class CreatorService(object):
@@ -338,6 +358,96 @@ class UpdateFrom0_4(BaseUpdate):
         self.connection.execute(text(self.dialect_specifics[self.dialect]))
         self.set_version('0.5')
 
+class UpdateFrom0_5(BaseUpdate):
+    # pylint: disable=invalid-name
+    '''
+    Updates from version 0.5 to 0.6 - creates indexes for the
+    columns the daos query by. On PostgreSQL the text searches get
+    trigram indexes on the upper case text, which is what the like
+    and the postgres search backends compare. SQLite can't use an
+    index for these infix searches, so it gets the plain indexes
+    and the FTS5 shadow tables of the sqlitefts search backend.
+    Duplicate document event links are removed, before a unique
+    index keeps them out.
+    '''
+
+    duplicate_link_cleanup = {
+        'sqlite': "delete from dverweis where rowid not in " +
+                  "(select min(rowid) from dverweis group by laufnr, ereignis_id)",
+        'postgresql': "delete from dverweis duplicate using dverweis original " +
+                      "where duplicate.laufnr = original.laufnr " +
+                      "and duplicate.ereignis_id = original.ereignis_id " +
+                      "and duplicate.ctid > original.ctid"}
+
+    common_indexes = [
+        "create index if not exists dokument_hauptnr_idx on dokument (hauptnr, seite)",
+        "create index if not exists dokument_standort_idx on dokument (standort)",
+        "create index if not exists dokument_doktyp_idx on dokument (doktyp)",
+        "create unique index if not exists dverweis_laufnr_ereignis_id_idx " +
+        "on dverweis (laufnr, ereignis_id)",
+        "create index if not exists everweis_ereignis_id_idx on everweis (ereignis_id)",
+        "create index if not exists qverweis_id1_idx on qverweis (id1, id2)"]
+
+    dialect_specifics = {
+        'sqlite': [],
+        'postgresql': [
+            "create index if not exists dokument_standort_pattern_idx " +
+            "on dokument (standort varchar_pattern_ops)",
+            "create extension if not exists pg_trgm",
+            "create index if not exists dokument_upper_beschreibung_trgm " +
+            "on dokument using gin (upper(beschreibung) gin_trgm_ops)",
+            "create index if not exists chrono_upper_ereignis_trgm " +
+            "on chrono using gin (upper(ereignis) gin_trgm_ops)"]
+    }
+
+    # Text columns with the primary key of their table
+    sqlite_search_columns = (('dokument', 'beschreibung', 'laufnr'),
+                             ('chrono', 'ereignis', 'ereignis_id'))
+
+    sqlite_search_index = [
+        "create virtual table if not exists %(table)s_fts using fts5(%(column)s, " +
+        "content='%(table)s', content_rowid='%(key)s', tokenize='trigram')",
+        "create trigger if not exists %(table)s_fts_insert after insert on %(table)s " +
+        "begin insert into %(table)s_fts(rowid, %(column)s) " +
+        "values (new.%(key)s, new.%(column)s); end",
+        "create trigger if not exists %(table)s_fts_delete after delete on %(table)s " +
+        "begin insert into %(table)s_fts(%(table)s_fts, rowid, %(column)s) " +
+        "values ('delete', old.%(key)s, old.%(column)s); end",
+        "create trigger if not exists %(table)s_fts_update after update on %(table)s " +
+        "begin insert into %(table)s_fts(%(table)s_fts, rowid, %(column)s) " +
+        "values ('delete', old.%(key)s, old.%(column)s); " +
+        "insert into %(table)s_fts(rowid, %(column)s) " +
+        "values (new.%(key)s, new.%(column)s); end",
+        "insert into %(table)s_fts(%(table)s_fts) values ('rebuild')"]
+
+    def run(self):
+        '''
+        Runs the upgrade
+        '''
+        self.connection.execute(text(self.duplicate_link_cleanup[self.dialect]))
+        for statement in self.common_indexes + self.dialect_specifics[self.dialect]:
+            self.connection.execute(text(statement))
+        if self.dialect == 'sqlite':
+            self.create_sqlite_search_index()
+        self.set_version('0.6')
+
+    def create_sqlite_search_index(self):
+        '''
+        Creates the shadow tables of the sqlitefts search backend
+        and the triggers that keep them in sync. SQLite libraries
+        without FTS5 or the trigram tokenizer (before 3.34) get no
+        shadow tables, the sqlitefts backend can't be used with them.
+        '''
+        for table_name, column_name, key_name in self.sqlite_search_columns:
+            values = {'table': table_name, 'column': column_name, 'key': key_name}
+            statements = [statement % values for statement in self.sqlite_search_index]
+            try:
+                self.connection.execute(text(statements[0]))
+            except OperationalError:
+                return
+            for statement in statements[1:]:
+                self.connection.execute(text(statement))
+
 class DatabaseUpgradeService():
     '''
     Handles updating the database
@@ -1232,6 +1342,35 @@ class DocumentFileManager(object):
         file_path = self.get_file_path(document_file_info)
         shutil.move(file_path, "%s.deleted" % file_path)
 
+    def delete_files(self, document_file_infos):
+        '''
+        Deletes a batch of files like delete_file. All files are
+        looked up before the first one is renamed, and if a rename
+        fails, the files already renamed are restored, so either
+        all files are deleted or none. Returns the original paths
+        of the renamed files.
+        '''
+        # pylint: disable=bare-except
+        file_paths = [self.get_file_path(file_info) for file_info in document_file_infos]
+        renamed_paths = []
+        try:
+            for file_path in file_paths:
+                shutil.move(file_path, "%s.deleted" % file_path)
+                renamed_paths.append(file_path)
+        except:
+            self.restore_files(renamed_paths)
+            raise
+        return file_paths
+
+    @staticmethod
+    def restore_files(file_paths):
+        '''
+        Reverts delete_files by removing the .deleted suffix from
+        the given paths again.
+        '''
+        for file_path in file_paths:
+            shutil.move("%s.deleted" % file_path, file_path)
+
     def add_file(self, file_path, document_file_info):
         '''
         Adds a file to the DOCUMENTBASEDIR, renaming it according
@@ -1469,6 +1608,23 @@ class DocumentService(BaseRecordService):
             self.document_file_manager.delete_file(file_info)
         self.dao.delete(document.id)
 
+    def delete_many(self, documents):
+        '''
+        Deletes a batch of documents with all their files. The file
+        infos are read with one query, the files are renamed as a
+        batch and the database rows are removed in one transaction.
+        If removing the rows fails, the files get their names back.
+        '''
+        # pylint: disable=bare-except
+        document_ids = [document.id for document in documents]
+        file_infos = self.document_file_info_dao.get_file_infos_for_documents(document_ids)
+        file_paths = self.document_file_manager.delete_files(file_infos)
+        try:
+            return self.dao.delete_many(document_ids)
+        except:
+            self.document_file_manager.restore_files(file_paths)
+            raise
+
     def get_file_infos_for_document(self, document):
         '''
         Returns all the file infos for the given document (what else?).
@@ -1629,10 +1785,18 @@ class EventService(BaseRecordService):
         if event is None:
             return []
         crossreference_ids = self.event_crossreferences_dao.get_cross_references(event.id)
-        events = []
-        for crossreference_id in crossreference_ids:
-            events.append(self.dao.get_by_id(crossreference_id))
-        return events
+        return self.dao.get_by_ids(crossreference_ids)
+
+    def get_cross_reference_graph(self, event, max_depth=DEFAULT_CROSS_REFERENCE_DEPTH):
+        '''
+        Returns the cross reference graph around the given event
+        together with a dictionary of all the events in the graph,
+        keyed by their ids. Needs two queries regardless of the size
+        of the graph.
+        '''
+        graph = self.event_crossreferences_dao.get_cross_reference_graph(event.id, max_depth)
+        events = self.dao.get_by_ids(graph.event_ids)
+        return graph, {entity.id: entity for entity in events}
 
     def remove_cross_reference(self, event1, event2):
         '''
@@ -1772,26 +1936,34 @@ class ReferenceService:
         Returns the events that are related to a document.
         '''
         event_ids = self.references_dao.fetch_ereignis_ids_for_dokument_id(document.id)
-        events = []
-        for event_id in event_ids:
-            events.append(self.event_dao.get_by_id(event_id))
-        return events
+        return self.event_dao.get_by_ids(event_ids)
 
     def get_documents_referenced_by_event(self, event):
         '''
         Returns the documents that are related to an event.
         '''
         document_ids = self.references_dao.fetch_document_ids_for_event_id(event.id)
-        documents = []
-        for document_id in document_ids:
-            documents.append(self.document_dao.get_by_id(document_id))
-        return documents
+        return self.document_dao.get_by_ids(document_ids)
 
     def link_document_to_event(self, document, event):
         '''
         Creates a reference between a document and an event.
         '''
         self.references_dao.join_document_id_with_event_id(document.id, event.id)
+
+    def link_documents_to_event(self, documents, event):
+        '''
+        Creates references between the documents and an event.
+        '''
+        self.references_dao.link_documents_to_event(
+            event.id, [document.id for document in documents])
+
+    def link_events_to_document(self, events, document):
+        '''
+        Creates references between the events and a document.
+        '''
+        self.references_dao.link_events_to_document(
+            document.id, [event.id for event in events])
     
     def delete_document_event_relation(self, document, event):
         '''
@@ -1799,6 +1971,154 @@ class ReferenceService:
         '''
         self.references_dao.delete_document_event_relation(document.id, event.id)
 
+DEFAULT_IMPORT_TRANSACTION_SIZE = 5000
+DEFAULT_IMPORT_BATCH_SIZE = 500
+
+class BulkImportService:
+    '''
+    Service for migrating large amounts of records into the database.
+
+    The records are validated and then written in executemany batches
+    of batch_size records, committing after transaction_size records.
+    Throughput is logged after each transaction. Both sizes may be
+    configured with the "importbatchsize" and "importtransactionsize"
+    entries.
+    '''
+
+    @inject
+    def __init__(self,
+                 config: baseinjectorkeys.CONFIG_KEY,
+                 document_dao: baseinjectorkeys.DOCUMENT_DAO_KEY,
+                 document_file_info_dao: baseinjectorkeys.DOCUMENT_FILE_INFO_DAO_KEY,
+                 event_dao: baseinjectorkeys.EVENT_DAO_KEY):
+        self.document_dao = document_dao
+        self.document_file_info_dao = document_file_info_dao
+        self.event_dao = event_dao
+        self.supported_formats = config.filetypes
+        self.transaction_size = self._get_size(
+            config, 'importtransactionsize', DEFAULT_IMPORT_TRANSACTION_SIZE)
+        self.batch_size = self._get_size(
+            config, 'importbatchsize', DEFAULT_IMPORT_BATCH_SIZE)
+        self.logger = logging.getLogger(
+            "alexandriabase.services.bulkimportservice.BulkImportService")
+
+    @staticmethod
+    def _get_size(config, key, default):
+        '''
+        Reads a positive size from the configuration.
+        '''
+        try:
+            size = int(getattr(config, key) or default)
+        except NoSuchConfigValue:
+            size = default
+        if size < 1:
+            raise DataError(_("Import sizes must be positive."))
+        return size
+
+    def import_documents(self, documents):
+        '''
+        Imports new documents. Returns the number of imported documents.
+        '''
+        return self._import(documents, self.document_dao,
+                            self._validate_document, "documents")
+
+    def import_file_infos(self, file_infos):
+        '''
+        Imports file infos for documents in the database. File infos
+        without page are appended to the pages of their document.
+        Returns the number of imported file infos.
+        '''
+        return self._import(file_infos, self.document_file_info_dao,
+                            self._validate_file_info, "file infos",
+                            self._validate_documents_exist)
+
+    def import_events(self, events):
+        '''
+        Imports new events. Returns the number of imported events.
+        '''
+        return self._import(events, self.event_dao,
+                            self._validate_event, "events")
+
+    def _import(self, records, dao, validate, record_name, validate_transaction=None):
+        '''
+        Splits the records into transactions and writes them. Each
+        record is validated and then, if given, validate_transaction
+        checks the records of the transaction together, before the
+        transaction is started.
+        '''
+        start_time = time.perf_counter()
+        count = 0
+        records = iter(records)
+        while True:
+            transaction_records = list(islice(records, self.transaction_size))
+            if not transaction_records:
+                break
+            for record in transaction_records:
+                validate(record)
+            if validate_transaction is not None:
+                validate_transaction(transaction_records)
+            dao.transactional(self._insert_batches, dao, transaction_records)
+            count += len(transaction_records)
+            elapsed = time.perf_counter() - start_time
+            self.logger.info("Imported %d %s in %.1f seconds (%.0f per second).",
+                             count, record_name, elapsed, count / max(elapsed, 1e-6))
+        return count
+
+    def _insert_batches(self, dao, records):
+        '''
+        Writes the records of one transaction in batches.
+        '''
+        for batch in split_into_chunks(records, self.batch_size):
+            dao.insert_all(batch)
+
+    @staticmethod
+    def _validate_new_record(record):
+        '''
+        Imported records get new ids.
+        '''
+        if record.id:
+            raise DataError(_("Record %s has already been saved.") % record.id)
+
+    def _validate_document(self, document):
+        '''
+        Checks that a document can be inserted.
+        '''
+        self._validate_new_record(document)
+        if document.document_type is None:
+            raise DataError(_("Document without document type."))
+
+    def _validate_file_info(self, file_info):
+        '''
+        Checks that a file info can be inserted.
+        '''
+        self._validate_new_record(file_info)
+        if not file_info.document_id:
+            raise DataError(_("File info without document."))
+        if file_info.filetype not in self.supported_formats:
+            raise UnsupportedFileFormat(file_info.filetype)
+        if file_info.page is not None and file_info.page < 2:
+            # Page 1 lives in the document row and is only assigned automatically
+            raise DataError(_("Invalid page %s.") % file_info.page)
+
+    def _validate_documents_exist(self, file_infos):
+        '''
+        Checks with one query per chunk that the documents of the
+        file infos exist.
+        '''
+        try:
+            self.document_dao.get_by_ids(
+                {file_info.document_id for file_info in file_infos})
+        except NoSuchEntityException as error:
+            raise DataError(_("File info for unknown document: %s") % error)
+
+    def _validate_event(self, event):
+        '''
+        Checks that an event can be inserted.
+        '''
+        self._validate_new_record(event)
+        if event.daterange is None or event.daterange.start_date is None:
+            raise DataError(_("Event without date."))
+
 class ServiceModule(Module):
     '''
     Injector module for the services.
@@ -1843,6 +2163,8 @@ class ServiceModule(Module):
                     ClassProvider(PdfImageExtractor), scope=singleton)
         binder.bind(baseinjectorkeys.DOCUMENT_FILE_PROVIDER,
                     ClassProvider(FileProvider), scope=singleton)
+        binder.bind(baseinjectorkeys.BULK_IMPORT_SERVICE_KEY,
+                    ClassProvider(BulkImportService), scope=singleton)
 
     @provider
     @inject
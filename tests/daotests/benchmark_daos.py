@@ -0,0 +1,102 @@
+'''
+Measures the python side overhead per call of the hot dao queries.
+
+Each query is timed twice: "before" rebuilds the statement (and the
+key of the filter expression) on every call like the daos did before
+the statements were memoized, "after" uses the memoized statements.
+Run from the tests directory:
+
+    PYTHONPATH=.. python -m daotests.benchmark_daos
+'''
+from contextlib import contextmanager
+import timeit
+
+from injector import Injector
+
+from alexandriabase import AlexBaseModule, baseinjectorkeys
+from alexandriabase.daos import DaoModule, GenericDao, EntityDao,\
+    DocumentFilterExpressionBuilder
+from alexandriabase.domain import DocumentFilter
+from alex_test_utils import setup_database_schema, load_table_data, TestEnvironment
+from daotests.test_base import tables
+
+CALLS = 3000
+REPEATS = 5
+
+
+@contextmanager
+def without_memoization():
+    '''
+    Builds every statement and every expression key anew.
+    '''
+    get_statement = GenericDao._get_statement
+    get_expression_key = EntityDao._get_expression_key
+
+    def build_statement(self, key, factory):
+        return factory()
+
+    def compile_expression_key(self, expression):
+        if expression is not None:
+            expression.__dict__.pop('_alexandria_expression_key', None)
+        return get_expression_key(self, expression)
+
+    GenericDao._get_statement = build_statement
+    EntityDao._get_expression_key = compile_expression_key
+    try:
+        yield
+    finally:
+        GenericDao._get_statement = get_statement
+        EntityDao._get_expression_key = get_expression_key
+
+
+def measure(function):
+    '''
+    Returns the best time per call in microseconds.
+    '''
+    function()
+    return min(timeit.repeat(function, number=CALLS, repeat=REPEATS)) / CALLS * 1e6
+
+
+def main():
+    '''
+    Prints the before and after timings.
+    '''
+    test_environment = TestEnvironment()
+    injector = Injector([AlexBaseModule(), DaoModule()])
+    engine = injector.get(baseinjectorkeys.DB_ENGINE_KEY)
+    setup_database_schema(engine)
+    load_table_data(tables, engine)
+
+    document_dao = injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY)
+    file_info_dao = injector.get(baseinjectorkeys.DOCUMENT_FILE_INFO_DAO_KEY)
+    relations_dao = injector.get(baseinjectorkeys.RELATIONS_DAO_KEY)
+    registry_dao = injector.get(baseinjectorkeys.REGISTRY_DAO_KEY)
+    # The count is served from the count cache, so find_with_count
+    # costs the page query and the key of the filter expression
+    document_dao.count_cache_ttl = 3600
+    document_filter = DocumentFilter()
+    document_filter.searchterms = ["Dokument", "Zweites", "Drittes"]
+    document_filter.missing_event_link = True
+    where = DocumentFilterExpressionBuilder().create_filter_expression(document_filter)
+
+    benchmarks = [
+        ("DocumentFileInfoDao.get_by_id", lambda: file_info_dao.get_by_id(1)),
+        ("get_file_infos_for_document",
+         lambda: file_info_dao.get_file_infos_for_document(1)),
+        ("fetch_document_ids_for_event_id",
+         lambda: relations_dao.fetch_document_ids_for_event_id(1940000001)),
+        ("DocumentDao.get_by_id", lambda: document_dao.get_by_id(1)),
+        ("RegistryDao.get", lambda: registry_dao.get('version')),
+        ("DocumentDao.find_with_count", lambda: document_dao.find_with_count(where, 1, 3)),
+    ]
+    print("%-35s %8s %8s" % ("per call", "before", "after"))
+    for name, function in benchmarks:
+        with without_memoization():
+            before = measure(function)
+        after = measure(function)
+        print("%-35s %5.0f us %5.0f us" % (name, before, after))
+    test_environment.cleanup()
+
+
+if __name__ == '__main__':
+    main()
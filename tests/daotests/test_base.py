@@ -3,7 +3,13 @@ Created on 11.10.2015
 
 @author: michael
 '''
+from collections import namedtuple
+from contextlib import contextmanager
+import os
+from threading import Barrier, Thread
+
 from injector import Injector
+from sqlalchemy import event
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql.expression import text, or_
 import unittest
@@ -15,13 +21,55 @@ from alexandriabase.base_exceptions import NoSuchEntityException, DataError
 from alexandriabase.daos import DaoModule, EntityDao,\
     EVENT_CROSS_REFERENCES_TABLE, EVENT_TABLE, CreatorDao, DOCUMENT_TABLE,\
     DOCUMENT_EVENT_REFERENCE_TABLE, get_join_tables_from_expression,\
-    get_joins_for_expression
+    get_joins_for_expression, connection_scope, get_scoped_connection,\
+    RollbackOnlyTransactionException
 from alexandriabase.domain import Entity
 
 
 tables = ("erfasser", "ereignistyp", "doktyp", "chrono", "dokument", "dverweis",  
           "everweis", "qverweis", "registry")
 
+RecordedStatement = namedtuple('RecordedStatement',
+                               'connection statement parameters executemany')
+
+@contextmanager
+def recorded_statements(engine):
+    '''
+    Collects the sql statements executed on the engine within
+    the block as list of RecordedStatement.
+    '''
+    statements = []
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument,too-many-arguments
+        statements.append(RecordedStatement(conn, statement, parameters, executemany))
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+def count_statements(engine, function, ignore_registry=False):
+    '''
+    Calls the function and returns the number of sql statements it
+    executed. The cache version checks on the registry table may
+    be left out.
+    '''
+    with recorded_statements(engine) as statements:
+        function()
+    return len([recorded for recorded in statements
+                if not (ignore_registry and 'registry' in recorded.statement)])
+
+class FakeClock:
+    '''
+    Clock for cache tests that only moves when now is set.
+    '''
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
 
 class TestFetchingJoinTables(unittest.TestCase):
     
@@ -104,6 +152,33 @@ class TestDaoModuleConfiguration(unittest.TestCase):
         # Try to get the database engine, which is the crucial part
         injector.get(baseinjectorkeys.DB_ENGINE_KEY)    
         
+    def test_pool_arguments(self):
+        
+        config = self.env.config
+        config.dbengine = 'postgresql'
+        config.dbpoolsize = '10'
+        config.dbmaxoverflow = '5'
+        config.dbpoolpreping = 'true'
+        arguments = DaoModule().get_pool_arguments(config)
+        self.assertEqual({'pool_size': 10, 'max_overflow': 5, 'pool_pre_ping': True},
+                         arguments)
+
+    def test_query_cache_size(self):
+        
+        self.env.config.dbquerycachesize = '1000'
+        self.env.config.write_config()
+        injector = Injector([AlexBaseModule(), DaoModule()])
+        engine = injector.get(baseinjectorkeys.DB_ENGINE_KEY)
+        self.assertEqual(1000, engine._compiled_cache.capacity)
+
+    def test_pool_arguments_sqlite(self):
+        
+        config = self.env.config
+        config.dbpoolsize = '10'
+        config.dbpoolrecycle = '3600'
+        arguments = DaoModule().get_pool_arguments(config)
+        self.assertEqual({'pool_recycle': 3600}, arguments)
+
 class DatabaseBaseTest(unittest.TestCase):
 
     def setUp(self):
@@ -116,7 +191,66 @@ class DatabaseBaseTest(unittest.TestCase):
     def tearDown(self):
         clear_table_data(tables, self.engine)
         self.test_environment.cleanup()
+
+class FileDatabaseBaseTest(DatabaseBaseTest):
+    '''
+    Runs the tests against an sqlite database file instead of the
+    shared in memory connection, so every thread gets its own
+    connection like with a real database.
+    '''
+
+    def setUp(self):
+        self.test_environment = TestEnvironment()
+        config = self.test_environment.config
+        config.dbname = os.path.join(self.test_environment.tmpdir.name, "alexandria.db")
+        config.write_config(self.test_environment.config_file_name)
+        self.injector = Injector([AlexBaseModule(), DaoModule()])
+        self.engine = self.injector.get(baseinjectorkeys.DB_ENGINE_KEY)
+        setup_database_schema(self.engine)
+        load_table_data(tables, self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.test_environment.cleanup()
+
+class ConnectionScopeTest(DatabaseBaseTest):
+    
+    def setUp(self):
+        DatabaseBaseTest.setUp(self)
+        self.dao = CreatorDao(self.engine)
+
+    def test_connection_scope(self):
+        
+        self.assertIsNone(get_scoped_connection(self.engine))
+        with self.dao.connection_scope() as connection:
+            self.assertIs(connection, self.dao.connection)
+            self.assertIs(connection, get_scoped_connection(self.engine))
+            with connection_scope(self.engine) as inner_connection:
+                self.assertIs(connection, inner_connection)
+            self.assertEqual("Max Mustermann", self.dao.get_by_id(1).name)
+            self.assertFalse(connection.closed)
+        self.assertTrue(connection.closed)
+        self.assertIsNone(get_scoped_connection(self.engine))
+
+    def test_no_connection_outside_of_scope(self):
+        
+        self.assertRaises(DataError, lambda: self.dao.connection)
+        self.assertEqual("Max Mustermann", self.dao.get_by_id(1).name)
+        self.assertIsNone(get_scoped_connection(self.engine))
+
+    def test_transaction_in_scope(self):
         
+        with self.dao.connection_scope() as connection:
+            self.dao.transactional(self.function)
+            self.assertFalse(connection.in_transaction())
+            result = self.dao.connection.execute(text("SELECT count(*) FROM erfasser"))
+            self.assertEqual(0, result.fetchone()[0])
+            result.close()
+
+    def function(self):
+        
+        self.dao.connection.execute(text("DELETE FROM erfasser"))        
+
 class RollbackTest(DatabaseBaseTest):
     
     def setUp(self):
@@ -143,7 +277,8 @@ class RollbackTest(DatabaseBaseTest):
 
         exception_thrown = False
         try:
-            self._evil_function()
+            with self.dao.connection_scope():
+                self._evil_function()
         except OperationalError:
             exception_thrown = True
         self.assertTrue(exception_thrown)
@@ -180,6 +315,76 @@ class RollbackTest(DatabaseBaseTest):
         self.transactional_function()
         self.dao.connection.execute(text("INSERT INTO erfasser (id, name, anzeige) VALUES (1, 'MAX MUSTERMANN', 1)"))        
 
+    def test_nested_rollback(self):
+        
+        exception_thrown = False
+        try:
+            self.dao.transactional(self.transactional_evil_function)
+        except OperationalError:
+            exception_thrown = True
+        self.assertTrue(exception_thrown)
+        self.assertIsNone(self.dao.transactional_connection)
+        self.assertEqual(0, self.dao.transaction_level)
+        self.dao.clear_cache()
+        self.assertTrue(self.dao.get_by_id(1))
+
+    def test_caught_nested_failure_rolls_back(self):
+        
+        exception_thrown = False
+        try:
+            self.dao.transactional(self.catching_transactional_function)
+        except RollbackOnlyTransactionException:
+            exception_thrown = True
+        self.assertTrue(exception_thrown)
+        self.assertIsNone(self.dao.transactional_connection)
+        self.dao.clear_cache()
+        self.assertTrue(self.dao.get_by_id(1))
+
+    def catching_transactional_function(self):
+        
+        self.dao.connection.execute(text("DELETE FROM erfasser"))
+        try:
+            self.dao.transactional(self._evil_function)
+        except OperationalError:
+            pass
+
+    def test_transactions_are_separated_by_dao(self):
+        
+        other_dao = CreatorDao(self.engine)
+        connections = {}
+        def run_in_transaction():
+            connections['dao'] = self.dao.transactional_connection
+            connections['other'] = other_dao.transactional_connection
+        self.dao.transactional(run_in_transaction)
+        self.assertIsNotNone(connections['dao'])
+        self.assertIsNone(connections['other'])
+
+    def test_transactions_are_separated_by_thread(self):
+        
+        barrier = Barrier(2)
+        connections = {}
+        levels = {}
+        def run_in_transaction(name):
+            connections[name] = self.dao.transactional_connection
+            barrier.wait(timeout=5)
+            levels[name] = self.dao.transaction_level
+        threads = [Thread(target=self.dao.transactional, args=(run_in_transaction, name))
+                   for name in ("first", "second")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsNotNone(connections["first"])
+        self.assertIsNotNone(connections["second"])
+        self.assertIsNot(connections["first"], connections["second"])
+        self.assertEqual({"first": 1, "second": 1}, levels)
+        self.assertIsNone(self.dao.transactional_connection)
+
+    def transactional_evil_function(self):
+        
+        self.dao.transactional(self._evil_function)
+
     def _evil_function(self):
         
         self.dao.connection.execute(text("DELETE FROM erfasser"))
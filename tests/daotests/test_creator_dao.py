@@ -6,7 +6,7 @@ Created on 11.10.2015
 import unittest
 
 from alexandriabase.base_exceptions import NoSuchEntityException
-from alexandriabase.daos import CreatorDao
+from alexandriabase.daos import CreatorDao, CacheVersionStamp, BasicCreatorProvider
 from alexandriabase.domain import Creator
 from daotests.test_base import DatabaseBaseTest
 
@@ -45,6 +45,30 @@ class TestCreatorDao(DatabaseBaseTest):
         erfasser = self.dao.get_by_id(7)
         self.assertEqual(erfasser.name, "Ingrid Schulz")
         
+    def test_cache_invalidation_by_other_process(self):
+        
+        self.dao.version_stamp = CacheVersionStamp('creator', 0)
+        other_dao = CreatorDao(self.engine)
+        other_dao.version_stamp = CacheVersionStamp('creator', 0)
+        self.assertEqual("Max Mustermann", self.dao.get_by_id(1).name)
+        creator = other_dao.get_by_id(1)
+        creator.name = "Moritz Mustermann"
+        other_dao.save(creator)
+        self.assertEqual("Moritz Mustermann", self.dao.get_by_id(1).name)
+        
+    def test_cache_version_check_interval(self):
+        
+        self.dao.version_stamp = CacheVersionStamp('creator', 3600)
+        other_dao = CreatorDao(self.engine)
+        other_dao.version_stamp = CacheVersionStamp('creator', 3600)
+        self.assertEqual("Max Mustermann", self.dao.get_by_id(1).name)
+        creator = other_dao.get_by_id(1)
+        creator.name = "Moritz Mustermann"
+        other_dao.save(creator)
+        self.assertEqual("Max Mustermann", self.dao.get_by_id(1).name)
+        self.dao.version_stamp.next_check = None
+        self.assertEqual("Moritz Mustermann", self.dao.get_by_id(1).name)
+        
     def test_find_by_nameI(self):
         creator = self.dao.find_by_name("Erna Musterfrau")
         self.assertTrue(creator != None, "Creator not found")
@@ -67,6 +91,23 @@ class TestCreatorDao(DatabaseBaseTest):
         creator = self.dao.find_by_name("Nicht existierender Name")
         self.assertTrue(creator == None)
 
+    def test_find_by_name_after_rename(self):
+        creator = self.dao.get_by_id(1)
+        creator.name = "Moritz Mustermann"
+        self.dao.save(creator)
+        self.assertIsNone(self.dao.find_by_name("Max Mustermann"))
+        self.assertEqual(1, self.dao.find_by_name("Moritz Mustermann").id)
+
+    def test_creator_provider(self):
+        provider = BasicCreatorProvider(self.dao)
+        admin = provider.creator
+        self.assertEqual("Admin", admin.name)
+        self.dao.clear_cache()
+        self.assertIs(admin, provider.creator)
+        provider.refresh()
+        self.assertIsNot(admin, provider.creator)
+        self.assertEqual(admin.id, provider.creator.id)
+
     def test_save_new(self):
         number_of_creators = len(self.dao.find())
 
@@ -5,11 +5,14 @@ Created on 11.10.2015
 '''
 from datetime import date
 import unittest
+from unittest.mock import MagicMock
 
 from alexandriabase.domain import Document, DocumentFilter
-from daotests.test_base import DatabaseBaseTest
+from daotests.test_base import DatabaseBaseTest, FileDatabaseBaseTest, FakeClock,\
+    count_statements, recorded_statements
 from sqlalchemy.sql.expression import or_
 from alexandriabase import baseinjectorkeys
+from alexandriabase.base_exceptions import NoSuchEntityException
 from alexandriabase.daos import DocumentFilterExpressionBuilder, DOCUMENT_TABLE
 
 
@@ -50,6 +53,19 @@ class TestDocumentDao(DatabaseBaseTest):
         dokument = self.dao.get_by_id(4)
         self.assertEqual(dokument.id, 4)
 
+    def test_get_by_ids(self):
+        dokumente = self.dao.get_by_ids([8, 1, 4])
+        self.assertEqual([8, 1, 4], [dokument.id for dokument in dokumente])
+        self.assertEqual(dokumente[1].description, "Erstes Dokument")
+
+    def test_get_by_ids_one_query(self):
+        self.assertEqual(1, count_statements(
+            self.engine, lambda: self.dao.get_by_ids([1, 4, 8, 11, 12, 13, 14]),
+            ignore_registry=True))
+
+    def test_get_by_ids_missing_entity(self):
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_ids, [1, 4711])
+
     def test_get_last(self):
         dokument = self.dao.get_last()
         self.assertEqual(dokument.id, 14)
@@ -313,6 +329,21 @@ class TestDocumentDao(DatabaseBaseTest):
         self.assertTrue(document.change_date)
         self.assertTrue(document.creation_date)
         
+    def test_insert_all(self):
+        document_type = self.injector.get(baseinjectorkeys.DOCUMENT_TYPE_DAO_KEY).get_by_id(5)
+        documents = []
+        for number in range(3):
+            document = Document()
+            document.description = "Imported %d" % number
+            document.document_type = document_type
+            documents.append(document)
+        self.assertEqual(documents, self.dao.insert_all(document for document in documents))
+        self.assertEqual([15, 16, 17], [document.id for document in documents])
+        document = self.dao.get_by_id(16)
+        self.assertEqual("Imported 1", document.description)
+        self.assertEqual("Flugblatt", document.document_type.description)
+        self.assertEqual("Admin", document.erfasser.name)
+
     def test_get_statistics(self):
         
         statistics = self.dao.get_statistics()
@@ -321,6 +352,72 @@ class TestDocumentDao(DatabaseBaseTest):
         self.assertEqual(6, len(statistics.number_of_files_by_type))
         self.assertEqual(1, statistics.number_of_files_by_type['pdf'])
 
+    def test_statistics_in_one_query(self):
+        with recorded_statements(self.engine) as statements:
+            self.dao.get_statistics()
+            self.dao.get_statistics()
+            self.injector.get(baseinjectorkeys.EVENT_DAO_KEY).get_statistics()
+        self.assertEqual(1, len(statements))
+
+    def test_statistics_of_other_processes(self):
+        clock = FakeClock()
+        statistics = self.dao.dao_services.archive_statistics
+        statistics.clock = clock
+        statistics.max_age = 10
+        self.assertEqual(7, self.dao.get_statistics().number_of_documents)
+        # Simulates a document inserted by another process
+        with self.engine.connect() as connection:
+            connection.execute(DOCUMENT_TABLE.insert().values(
+                hauptnr=15, laufnr=15, seite=1, dateityp='pdf'))
+        self.assertEqual(7, self.dao.get_statistics().number_of_documents)
+        clock.now = 10
+        statistics = self.dao.get_statistics()
+        self.assertEqual(8, statistics.number_of_documents)
+        self.assertEqual(2, statistics.number_of_files_by_type['pdf'])
+
+    def test_statistics_are_updated(self):
+        file_info_dao = self.injector.get(baseinjectorkeys.DOCUMENT_FILE_INFO_DAO_KEY)
+        self.dao.get_statistics()
+        document = Document()
+        document.document_type = self.injector.get(
+            baseinjectorkeys.DOCUMENT_TYPE_DAO_KEY).get_by_id(5)
+        document = self.dao.save(document)
+        file_info_dao.create_new_file_info(document.id, 'pdf')
+        file_info_dao.create_new_file_info(document.id, 'jpg')
+        file_info_dao.create_new_file_info(1, 'pdf')
+        statistics = self.dao.get_statistics()
+        self.assertEqual(8, statistics.number_of_documents)
+        self.assertEqual(17, statistics.number_of_files)
+        self.assertEqual(3, statistics.number_of_files_by_type['pdf'])
+        self.dao.delete(document.id)
+        self.dao.delete(4)
+        statistics = self.dao.get_statistics()
+        self.dao.refresh_statistics()
+        refreshed_statistics = self.dao.get_statistics()
+        self.assertEqual(6, statistics.number_of_documents)
+        self.assertEqual(refreshed_statistics.number_of_documents,
+                         statistics.number_of_documents)
+        self.assertEqual(refreshed_statistics.number_of_files, statistics.number_of_files)
+        self.assertEqual(refreshed_statistics.number_of_files_by_type,
+                         statistics.number_of_files_by_type)
+
+    def test_delete_many(self):
+        references_dao = self.injector.get(baseinjectorkeys.RELATIONS_DAO_KEY)
+        file_info_dao = self.injector.get(baseinjectorkeys.DOCUMENT_FILE_INFO_DAO_KEY)
+        self.assertTrue(references_dao.fetch_ereignis_ids_for_dokument_id(1))
+        self.dao.get_statistics()
+        with recorded_statements(self.engine) as statements:
+            self.assertEqual(2, self.dao.delete_many([1, 4, 4711]))
+        self.assertEqual(3, len(statements))
+        self.assertEqual([], references_dao.fetch_ereignis_ids_for_dokument_id(1))
+        self.assertEqual([], file_info_dao.get_file_infos_for_document(1))
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 4)
+        statistics = self.dao.get_statistics()
+        self.assertEqual(5, statistics.number_of_documents)
+        self.dao.refresh_statistics()
+        self.assertEqual(statistics.number_of_files,
+                         self.dao.get_statistics().number_of_files)
+
     def test_find_all_entities(self):
         
         entities = self.dao.find(None, 1, 10)
@@ -354,6 +451,244 @@ class TestDocumentDao(DatabaseBaseTest):
         self.assertEqual(11, entities[0].id)
         self.assertEqual(12, entities[1].id)
 
+    def test_find_with_count(self):
+        
+        entities, count = self.dao.find_with_count(None, 2, 3)
+        self.assertEqual(7, count)
+        self.assertEqual([11, 12, 13], [entity.id for entity in entities])
+        entities, count = self.dao.find_with_count(None, 4, 3)
+        self.assertEqual(7, count)
+        self.assertEqual([], entities)
+
+    def test_find_with_count_with_filter(self):
+        columns = DOCUMENT_TABLE.c
+        where = or_(columns.beschreibung.contains("Zweites"),
+                    columns.beschreibung.contains("Drittes"),
+                    columns.beschreibung.contains("Viertes"))
+        entities, count = self.dao.find_with_count(where, 1, 2)
+        self.assertEqual(3, count)
+        self.assertEqual([4, 8], [entity.id for entity in entities])
+        entities, count = self.dao.find_with_count(where, 2, 2)
+        self.assertEqual(3, count)
+        self.assertEqual([11], [entity.id for entity in entities])
+
+    def test_count_cache_invalidation(self):
+        
+        entities, count = self.dao.find_with_count(None, 1, 10)
+        self.assertEqual(1, len(self.dao.count_cache))
+        self.dao.delete(entities[0].id)
+        self.assertEqual(0, len(self.dao.count_cache))
+        entities, count = self.dao.find_with_count(None, 1, 10)
+        self.assertEqual(6, count)
+
+    def test_count_cache_invalidation_by_other_daos(self):
+        document_filter = DocumentFilter()
+        document_filter.missing_event_link = True
+        where = self.document_filter_handler.create_filter_expression(document_filter)
+        entities, count = self.dao.find_with_count(where, 1, 10)
+        self.assertIn(8, [entity.id for entity in entities])
+        self.injector.get(baseinjectorkeys.RELATIONS_DAO_KEY).\
+            join_document_id_with_event_id(8, 1940000001)
+        entities, new_count = self.dao.find_with_count(where, 1, 10)
+        self.assertEqual(count - 1, new_count)
+        self.assertNotIn(8, [entity.id for entity in entities])
+
+    def test_expression_key_is_compiled_once(self):
+        document_filter = DocumentFilter()
+        document_filter.missing_event_link = True
+        where = self.document_filter_handler.create_filter_expression(document_filter)
+        count = self.dao.find_with_count(where, 1, 10)[1]
+        self.assertIs(where, self.document_filter_handler.create_filter_expression(
+            document_filter))
+        restricted = self.dao._restrict_to_documents(where)
+        restricted.compile = MagicMock()
+        self.assertEqual(count, self.dao.find_with_count(where, 2, 10)[1])
+        restricted.compile.assert_not_called()
+
+    def test_count_cache_expiry(self):
+        clock = FakeClock()
+        self.dao.clock = clock
+        self.dao.count_cache_ttl = 10
+        self.dao.find_with_count(None, 1, 10)
+        # Simulates a change by another process
+        key, = self.dao.count_cache
+        self.dao.count_cache[key] = (100, self.dao.dao_services.data_generation, 10)
+        self.assertEqual(100, self.dao.find_with_count(None, 1, 10)[1])
+        clock.now = 10
+        self.assertEqual(7, self.dao.find_with_count(None, 1, 10)[1])
+
+    def test_eager_loading(self):
+        
+        self.dao.creator_dao.clear_cache()
+        self.dao.document_type_dao.clear_cache()
+        with recorded_statements(self.engine) as statements:
+            documents = self.dao.find()
+        
+        # the cache version checks of the related daos do not count
+        self.assertEqual(1, len([recorded for recorded in statements
+                                 if 'registry' not in recorded.statement]))
+        self.assertEqual(7, len(documents))
+        self.assertEqual("Max Mustermann", documents[0].erfasser.name)
+        self.assertEqual("Flugblatt", documents[0].document_type.description)
+        self.assertEqual("Brief", documents[1].document_type.description)
+        self.assertIs(documents[0].erfasser, self.dao.creator_dao.get_by_id(1))
+
+    def test_lazy_loading(self):
+        
+        self.dao.eager_loading = False
+        self.dao.document_type_dao.clear_cache()
+        document = self.dao.get_by_id(4)
+        self.assertEqual("Brief", document.document_type.description)
+        self.assertEqual("Max Mustermann", document.erfasser.name)
+
+    def test_cursor_navigation(self):
+        
+        cursor = self.dao.create_cursor(window_size=4)
+        document = cursor.get_first()
+        ids = [document.id]
+        for _ in range(7):
+            document = cursor.get_next(document)
+            ids.append(document.id)
+        self.assertEqual([1, 4, 8, 11, 12, 13, 14, 1], ids)
+        document = cursor.get_last()
+        ids = [document.id]
+        for _ in range(7):
+            document = cursor.get_previous(document)
+            ids.append(document.id)
+        self.assertEqual([14, 13, 12, 11, 8, 4, 1, 14], ids)
+        self.assertEqual(8, cursor.get_nearest(5).id)
+        self.assertEqual(14, cursor.get_nearest(100).id)
+
+    def test_cursor_with_small_window(self):
+        
+        for window_size in (1, 2, 3):
+            cursor = self.dao.create_cursor(window_size=window_size)
+            for document_id in [1, 4, 8, 11, 12, 13, 14]:
+                document = self.dao.get_by_id(document_id)
+                self.assertEqual(self.dao.get_next(document).id,
+                                 cursor.get_next(document).id)
+                self.assertEqual(self.dao.get_previous(document).id,
+                                 cursor.get_previous(document).id)
+            document = cursor.get_first()
+            ids = [document.id]
+            for _ in range(7):
+                document = cursor.get_next(document)
+                ids.append(document.id)
+            self.assertEqual([1, 4, 8, 11, 12, 13, 14, 1], ids)
+            document = cursor.get_last()
+            ids = [document.id]
+            for _ in range(7):
+                document = cursor.get_previous(document)
+                ids.append(document.id)
+            self.assertEqual([14, 13, 12, 11, 8, 4, 1, 14], ids)
+
+    def test_cursor_with_filter(self):
+        
+        cursor = self.dao.create_cursor(
+            DOCUMENT_TABLE.c.beschreibung.contains("Dokument"), window_size=2)
+        document = cursor.get_first()
+        self.assertEqual(1, document.id)
+        self.assertEqual(4, cursor.get_next(document).id)
+        self.assertEqual(14, cursor.get_previous(document).id)
+        empty_cursor = self.dao.create_cursor(DOCUMENT_TABLE.c.laufnr == 4711)
+        self.assertIsNone(empty_cursor.get_first())
+        self.assertIsNone(empty_cursor.get_last())
+        
+    def test_cursor_serves_from_window(self):
+        
+        cursor = self.dao.create_cursor()
+        document = cursor.get_first()
+        with recorded_statements(self.engine) as statements:
+            for _ in range(10):
+                document = cursor.get_next(document)
+        self.assertEqual(0, len(statements))
+
+    def test_cursor_invalidation(self):
+        
+        cursor = self.dao.create_cursor()
+        self.assertEqual(14, cursor.get_last().id)
+        self.dao.delete(14)
+        self.assertEqual(13, cursor.get_last().id)
+
+    def test_cursor_background_refill_failure(self):
+        
+        cursor = self.dao.create_cursor(window_size=5, background=True)
+        document = cursor.get_nearest(8)
+        window = cursor.window
+        def fail(*args):
+            raise Exception("Database gone")
+        self.dao._get_window = fail
+        with self.assertLogs("alexandriabase.daos.recordcursor.RecordCursor"):
+            cursor.get_next(cursor.get_next(document))
+            self.assertRaises(Exception, cursor.wait)
+        self.assertIs(window, cursor.window)
+
+    def test_iter_find(self):
+        
+        documents = list(self.dao.iter_find(batch_size=2))
+        self.assertEqual([1, 4, 8, 11, 12, 13, 14],
+                         [document.id for document in documents])
+        self.assertEqual("Erstes Dokument", documents[0].description)
+
+    def test_iter_find_with_filter(self):
+        columns = DOCUMENT_TABLE.c
+        where = or_(columns.beschreibung.contains("Zweites"),
+                    columns.beschreibung.contains("Viertes"),
+                    columns.beschreibung.contains("Fünftes"))
+        documents = self.dao.iter_find(where, batch_size=2)
+        self.assertEqual([4, 11, 12], [document.id for document in documents])
+
+    def test_iter_find_with_join_filter(self):
+        document_filter = DocumentFilter()
+        document_filter.missing_event_link = True
+        filter_expression = self.document_filter_handler.create_filter_expression(document_filter)
+        documents = self.dao.iter_find(filter_expression, batch_size=3)
+        self.assertEqual([8, 11, 12, 13, 14], [document.id for document in documents])
+
+    def test_filter_snapshot_with_join_filter(self):
+        document_filter = DocumentFilter()
+        document_filter.missing_event_link = True
+        filter_expression = self.document_filter_handler.create_filter_expression(document_filter)
+        snapshot = self.dao.create_filter_snapshot(filter_expression)
+        self.assertEqual(5, snapshot.get_count())
+        self.assertEqual(8, snapshot.get_first().id)
+        self.assertEqual(14, snapshot.get_last().id)
+        self.assertEqual(8, snapshot.get_nearest(1).id)
+
+    def test_filter_snapshot_invalidation_by_other_daos(self):
+        document_filter = DocumentFilter()
+        document_filter.missing_event_link = True
+        filter_expression = self.document_filter_handler.create_filter_expression(document_filter)
+        snapshot = self.dao.create_filter_snapshot(filter_expression)
+        self.assertEqual(5, snapshot.get_count())
+        self.injector.get(baseinjectorkeys.RELATIONS_DAO_KEY).\
+            join_document_id_with_event_id(8, 1940000001)
+        self.assertEqual(4, snapshot.get_count())
+        self.assertEqual(11, snapshot.get_first().id)
+
+class TestDocumentDaoWithDatabaseFile(FileDatabaseBaseTest):
+    '''
+    The background refill reads in its own thread, so it needs a
+    database where every thread gets its own connection.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.dao = self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY)
+
+    def test_cursor_background_refill(self):
+        
+        cursor = self.dao.create_cursor(window_size=5, background=True)
+        document = cursor.get_nearest(8)
+        self.assertEqual([1, 4, 8, 11, 12], cursor.window.ids)
+        document = cursor.get_next(cursor.get_next(document))
+        self.assertEqual(12, document.id)
+        # Close to the edge of the window, so the window is refilled
+        cursor.wait()
+        self.assertEqual([8, 11, 12, 13, 14], cursor.window.ids)
+        self.assertEqual(13, cursor.get_next(document).id)
+        cursor.wait()
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -6,6 +6,7 @@ Created on 02.11.2015
 import unittest
 
 from alexandriabase.base_exceptions import NoSuchEntityException
+from alexandriabase.domain import Document, DocumentFileInfo
 from daotests.test_base import DatabaseBaseTest
 from alexandriabase.daos import CreatorDao, BasicCreatorProvider,\
     DocumentFileInfoDao, DocumentTypeDao, DocumentDao
@@ -42,10 +43,27 @@ class DocumentFileInfoDaoTest(DatabaseBaseTest):
             exception_thrown = True
         self.assertTrue(exception_thrown)
 
+    def testGetByIds(self):
+        infos = self.dao.get_by_ids([3, 2])
+        self.assertEqual([3, 2], [info.id for info in infos])
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_ids, [2, 1234])
+
+    def testStatementsAreReused(self):
+        self.dao.get_by_id(2)
+        statement = self.dao.statements['get_file_info']
+        info = self.dao.get_by_id(3)
+        self.assertEqual(3, info.id)
+        self.assertIs(statement, self.dao.statements['get_file_info'])
+
     def testGetFileInfosForDocument(self):
         infos = self.dao.get_file_infos_for_document(1)
         self.assertEqual(len(infos),3)
         
+    def testGetFileInfosForDocuments(self):
+        infos = self.dao.get_file_infos_for_documents([4, 1, 4711])
+        self.assertEqual([1, 1, 1, 4, 4, 4, 4], [info.document_id for info in infos])
+        self.assertEqual([1, 2, 3], [info.page for info in infos][:3])
+        
     def testCreateNewFileInfoForDocument(self):
         info = self.dao.create_new_file_info(1)
         self.assertEqual(info.page, 4)
@@ -67,6 +85,28 @@ class DocumentFileInfoDaoTest(DatabaseBaseTest):
         self.assertEqual(info.document_id, 1)
 
 
+    def testInsertAll(self):
+        document = Document()
+        document.document_type = self.document_type_dao.get_by_id(1)
+        document = self.document_dao.save(document)
+        infos = []
+        for document_id, page in ((1, None), (document.id, None), (1, None), (document.id, 5)):
+            info = DocumentFileInfo()
+            info.document_id = document_id
+            info.page = page
+            info.filetype = 'jpg'
+            info.resolution = 300
+            infos.append(info)
+        self.dao.insert_all(infos)
+        self.assertEqual([4, 1, 5, 5], [info.page for info in infos])
+        self.assertEqual([16, document.id, 17, 18], [info.id for info in infos])
+        self.assertEqual([1, 5], [info.page for info in
+                                  self.dao.get_file_infos_for_document(document.id)])
+        info = self.dao.get_by_id(document.id)
+        self.assertEqual('jpg', info.filetype)
+        self.assertEqual(300, info.resolution)
+        self.assertEqual(5, len(self.dao.get_file_infos_for_document(1)))
+
     def testDeleteI(self):
         # Default: separate document info record 
         self.dao.delete(2)
@@ -95,6 +135,16 @@ class DocumentFileInfoDaoTest(DatabaseBaseTest):
             exception_thrown = True
         self.assertFalse(exception_thrown, "Document itself has been deleted!")
 
+    def testDeleteMany(self):
+        tif_files = self.dao._get_archive_statistics().rows_by_file_type['tif']
+        self.assertEqual(2, self.dao.delete_many([1, 2]))
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 1)
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 2)
+        self.assertEqual(1, self.document_dao.get_by_id(1).id)
+        self.assertEqual([3], [info.id for info in self.dao.get_file_infos_for_document(1)])
+        self.assertEqual(tif_files - 1,
+                         self.dao._get_archive_statistics().rows_by_file_type['tif'])
+
     def testDeleteIII(self):
         # Edge case: Non existing id 
         self.dao.delete(12345)
@@ -50,7 +50,21 @@ class TestDocumentTypeDao(DatabaseBaseTest):
         self.assertTrue(3 in self.dao.cache)
         self.dao.delete(3)
         self.assertFalse(3 in self.dao.cache)
+
+    def test_deletion_of_uncached_entity(self):
+        
+        self.assertFalse(4 in self.dao.cache)
+        self.dao.delete(4)
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 4)
+        
+    def test_delete_many(self):
         
+        self.dao.get_by_id(3)
+        self.assertEqual(2, self.dao.delete_many([3, 4]))
+        self.assertFalse(3 in self.dao.cache)
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 3)
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 4)
+
     def test_get_all(self):
         
         document_types = self.dao.get_all()
@@ -0,0 +1,90 @@
+'''
+Tests for the entity caches of the caching daos.
+'''
+import unittest
+
+from alexandriabase.base_exceptions import DataError
+from alexandriabase.daos import EntityCache, LruEntityCache, TtlEntityCache,\
+    EntityCacheFactory, create_entity_cache
+from alex_test_utils import TestEnvironment
+from daotests.test_base import FakeClock
+
+
+
+class TestEntityCache(unittest.TestCase):
+
+    def test_statistics(self):
+        cache = EntityCache()
+        cache[1] = "eins"
+        self.assertEqual("eins", cache.get(1))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0},
+                         cache.statistics())
+
+    def test_pop_missing_key(self):
+        cache = EntityCache()
+        self.assertIsNone(cache.pop(1))
+        
+    def test_lru_eviction(self):
+        cache = LruEntityCache(2)
+        cache[1] = "eins"
+        cache[2] = "zwei"
+        cache.get(1)
+        cache[3] = "drei"
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertIn(3, cache)
+        self.assertEqual(1, cache.evictions)
+        
+    def test_lru_update_does_not_evict(self):
+        cache = LruEntityCache(2)
+        cache[1] = "eins"
+        cache[2] = "zwei"
+        cache[2] = "two"
+        self.assertEqual(2, len(cache))
+        self.assertEqual(0, cache.evictions)
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = TtlEntityCache(10, 60, clock)
+        cache[1] = "eins"
+        clock.now = 59
+        self.assertEqual("eins", cache.get(1))
+        clock.now = 60
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(1, cache.evictions)
+        
+    def test_create_entity_cache(self):
+        self.assertEqual(EntityCache, type(create_entity_cache('')))
+        self.assertEqual(EntityCache, type(create_entity_cache('unbounded')))
+        cache = create_entity_cache('LRU:100')
+        self.assertEqual(LruEntityCache, type(cache))
+        self.assertEqual(100, cache.max_size)
+        cache = create_entity_cache('ttl:100:300')
+        self.assertEqual(TtlEntityCache, type(cache))
+        self.assertEqual(300, cache.time_to_live)
+        self.assertRaises(DataError, create_entity_cache, 'lru:many')
+        self.assertRaises(DataError, create_entity_cache, 'lru:0')
+        self.assertRaises(DataError, create_entity_cache, 'fifo:10')
+
+class TestEntityCacheFactory(unittest.TestCase):
+    
+    def setUp(self):
+        self.env = TestEnvironment()
+
+    def tearDown(self):
+        self.env.cleanup()
+
+    def test_create_configured_cache(self):
+        self.env.config.entitycaches = {'creator': 'lru:50'}
+        factory = EntityCacheFactory(self.env.config)
+        self.assertEqual(LruEntityCache, type(factory.create_cache('creator')))
+        self.assertEqual(EntityCache, type(factory.create_cache('documenttype')))
+
+    def test_create_unconfigured_cache(self):
+        factory = EntityCacheFactory(self.env.config)
+        self.assertEqual(EntityCache, type(factory.create_cache('creator')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ Created on 11.10.2015
 '''
 import unittest
 
+from alexandriabase.base_exceptions import DataError
 from alexandriabase.daos import EventCrossreferencesDao
 from daotests.test_base import DatabaseBaseTest
 
@@ -58,6 +59,41 @@ class TestEventCrossreferencesDao(DatabaseBaseTest):
         liste2 = self.dao.get_cross_references(event_id2)
         self.assertNotIn(event_id1, liste2)
 
+    def test_get_cross_references_for_ids(self):
+        cross_references = self.dao.get_cross_references_for_ids(
+            [1940000001, 1950000001, 1961050101])
+        self.assertEqual({1940000001: [1950000001, 1960013001],
+                          1950000001: [1940000001],
+                          1961050101: []}, cross_references)
+
+    def test_cross_reference_graph(self):
+        self.dao.add_cross_reference(1950000001, 1961050101)
+        
+        graph = self.dao.get_cross_reference_graph(1960013001, 1)
+        self.assertEqual([1960013001, 1940000001], graph.event_ids)
+        self.assertEqual({1960013001: [1940000001]}, graph.cross_references)
+        
+        graph = self.dao.get_cross_reference_graph(1960013001, 2)
+        self.assertEqual({1960013001: 0, 1940000001: 1, 1950000001: 2}, graph.depths)
+        self.assertEqual({1960013001: [1940000001],
+                          1940000001: [1950000001, 1960013001]}, graph.cross_references)
+
+    def test_cross_reference_graph_with_cycle(self):
+        self.dao.add_cross_reference(1950000001, 1960013001)
+        
+        graph = self.dao.get_cross_reference_graph(1940000001, 10)
+        self.assertEqual({1940000001: 0, 1950000001: 1, 1960013001: 1}, graph.depths)
+        self.assertEqual([1940000001, 1960013001],
+                         graph.cross_references[1950000001])
+
+    def test_cross_reference_graph_without_references(self):
+        graph = self.dao.get_cross_reference_graph(1961050101)
+        self.assertEqual([1961050101], graph.event_ids)
+        self.assertEqual({1961050101: []}, graph.cross_references)
+
+    def test_cross_reference_graph_invalid_depth(self):
+        self.assertRaises(DataError, self.dao.get_cross_reference_graph, 1940000001, 0)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
@@ -6,14 +6,14 @@ Created on 11.10.2015
 from datetime import date
 import unittest
 
-from alexandriabase.base_exceptions import NoSuchEntityException
+from alexandriabase.base_exceptions import NoSuchEntityException, DataError
 from alexandriabase.domain import EventFilter, Event, AlexDateRange, \
     AlexDate
-from daotests.test_base import DatabaseBaseTest
+from daotests.test_base import DatabaseBaseTest, recorded_statements
 from alexandriabase.daos import CreatorDao, DocumentTypeDao,\
     DocumentEventRelationsDao, DocumentFilterExpressionBuilder,\
     EventFilterExpressionBuilder, EventTypeDao, BasicCreatorProvider, EventDao,\
-    DocumentDao
+    DocumentDao, EVENT_TABLE
 
 
 class TestEreignisDao(DatabaseBaseTest):
@@ -165,6 +165,25 @@ class TestEreignisDao(DatabaseBaseTest):
         event = self.dao.get_last(filter_expression)
         self.assertEqual(event.id, 1961050101)
 
+    def test_filter_expression_memo(self):
+        filter_expression_builder = EventFilterExpressionBuilder()
+        event_filter = EventFilter()
+        event_filter.earliest_date = AlexDate(1960)
+        event_filter.searchterms = ['weit']
+        filter_expression = filter_expression_builder.create_filter_expression(event_filter)
+        same_filter = EventFilter()
+        same_filter.earliest_date = AlexDate(1960)
+        same_filter.searchterms = ['weit']
+        self.assertIs(filter_expression,
+                      filter_expression_builder.create_filter_expression(same_filter))
+        event_filter.earliest_date = AlexDate(1961)
+        self.assertIsNot(filter_expression,
+                         filter_expression_builder.create_filter_expression(event_filter))
+        event_filter.earliest_date = AlexDate(1960)
+        event_filter.searchterms.append('ritt')
+        self.assertIsNot(filter_expression,
+                         filter_expression_builder.create_filter_expression(event_filter))
+
     def test_save_new(self):
         exception_raised = False
         try:
@@ -186,6 +205,32 @@ class TestEreignisDao(DatabaseBaseTest):
         self.assertEqual(event.description, "New description")
         self.assertEqual(event.status_id, 1)
         
+    def test_insert_all(self):
+        events = []
+        for date_range in (1951010100, 1960013000, 1951010100, 1952000000):
+            new_event = Event()
+            new_event.daterange = AlexDateRange(date_range, None)
+            new_event.description = "Event %d" % len(events)
+            new_event.status_id = 1
+            events.append(new_event)
+        with recorded_statements(self.engine) as statements:
+            self.assertEqual(events, self.dao.insert_all(events))
+        self.assertEqual([1951010101, 1960013002, 1951010102, 1952000001],
+                         [new_event.id for new_event in events])
+        inserts = [recorded for recorded in statements
+                   if 'INSERT INTO chrono' in recorded.statement]
+        self.assertEqual(1, len(inserts))
+        self.assertTrue(inserts[0].executemany)
+        self.assertEqual(3, len([recorded for recorded in statements
+                                 if 'max(chrono' in recorded.statement]))
+        loaded = self.dao.get_by_id(1951010102)
+        self.assertEqual("Event 2", loaded.description)
+        self.assertEqual("Admin", loaded.erfasser.name)
+
+    def test_insert_all_rejects_saved_events(self):
+        with self.assertRaises(DataError):
+            self.dao.insert_all([self.dao.get_by_id(1940000001)])
+
     def test_simple_update_event(self):
         event = self.dao.get_by_id(1940000001)
         self.assertEqual(event.description, "Erstes Ereignis")
@@ -232,9 +277,65 @@ class TestEreignisDao(DatabaseBaseTest):
         number_of_references = len(referenced_ids)
         self.assertEqual(number_of_references, 0)
         
+    def test_delete_many(self):
+        self.assertTrue(self.references_dao.fetch_document_ids_for_event_id(1940000001))
+        self.assertEqual(2, self.dao.delete_many([1940000001, 1950000001, 1234]))
+        self.assertEqual([], self.references_dao.fetch_document_ids_for_event_id(1940000001))
+        self.assertRaises(NoSuchEntityException, self.dao.get_by_id, 1950000001)
+        self.assertEqual(2, self.dao.get_count())
+
     def test_get_statistics(self):
         statistics = self.dao.get_statistics()
         self.assertEqual(statistics.number_of_events, 4)
+        self.dao.save(self._create_event(1970010100))
+        self.dao.insert_all([self._create_event(1970010100),
+                             self._create_event(1980000000)])
+        self.dao.delete(1940000001)
+        self.assertEqual(6, self.dao.get_statistics().number_of_events)
+        self.dao.refresh_statistics()
+        self.assertEqual(6, self.dao.get_statistics().number_of_events)
+
+    @staticmethod
+    def _create_event(date_key):
+        new_event = Event()
+        new_event.daterange = AlexDateRange(date_key, None)
+        return new_event
+
+    def test_get_by_ids(self):
+        events = self.dao.get_by_ids([1961050101, 1940000001])
+        self.assertEqual([1961050101, 1940000001], [event.id for event in events])
+
+    def test_filter_snapshot(self):
+        snapshot = self.dao.create_filter_snapshot(EVENT_TABLE.c.ereignis_id > 1940000001)
+        self.assertEqual(3, snapshot.get_count())
+        event = snapshot.get_first()
+        self.assertEqual(1950000001, event.id)
+        self.assertEqual(1961050101, snapshot.get_previous(event).id)
+        self.assertEqual(1960013001, snapshot.get_next(event).id)
+        self.assertEqual(1950000001, snapshot.get_next(snapshot.get_last()).id)
+        self.assertEqual(1960013001, snapshot.get_nearest(1955000000).id)
+        self.assertEqual(1961050101, snapshot.get_nearest(1990000000).id)
+
+    def test_filter_snapshot_after_changes(self):
+        snapshot = self.dao.create_filter_snapshot()
+        self.assertEqual(4, snapshot.get_count())
+        self.dao.delete(1950000001)
+        self.assertEqual(3, snapshot.get_count())
+        self.assertEqual([1940000001, 1960013001, 1961050101], list(snapshot.ids))
+        event = self.dao.get_by_id(1960013001)
+        self.dao.save(event)
+        self.assertEqual(3, snapshot.get_count())
+
+    def test_iter_find(self):
+        events = self.dao.iter_find(batch_size=3)
+        self.assertEqual([1940000001, 1950000001, 1960013001, 1961050101],
+                         [event.id for event in events])
+
+    def test_iter_find_stops_early(self):
+        events = self.dao.iter_find(batch_size=1)
+        self.assertEqual(1940000001, next(events).id)
+        self.assertEqual(1950000001, next(events).id)
+        events.close()
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
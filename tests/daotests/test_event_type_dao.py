@@ -5,8 +5,11 @@ Created on 11.10.2015
 '''
 import unittest
 
-from alexandriabase.daos import EventTypeDao
-from daotests.test_base import DatabaseBaseTest
+from sqlalchemy.sql.expression import update, insert
+from alexandriabase.base_exceptions import NoSuchEntityException
+from alexandriabase.daos import EventTypeDao, EVENTTYPE_TABLE,\
+    EVENT_EVENTTYPE_REFERENCE_TABLE
+from daotests.test_base import DatabaseBaseTest, count_statements
 from alexandriabase.domain import EventTypeIdentifier
 
 
@@ -41,6 +44,74 @@ class TestEverweisDao(DatabaseBaseTest):
         liste = self.dao.get_event_types_for_event_id(1940000001)
         self.assertEqual(1, len(liste))
         
+    def test_get_by_id_uses_catalogue(self):
+        self.dao.find_all()
+        self.assertEqual(0, count_statements(
+            self.engine, lambda: self.dao.get_by_id(EventTypeIdentifier(7, 1))))
+        self.assertEqual(1, count_statements(
+            self.engine, lambda: self.dao.get_event_types_for_event_id(1940000001)))
+
+    def test_get_by_id_unknown(self):
+        self.assertRaises(NoSuchEntityException,
+                          self.dao.get_by_id, EventTypeIdentifier(99, 99))
+
+    def test_event_type_added_by_other_process(self):
+        self.dao.find_all()
+        self.engine.connect().execute(insert(EVENTTYPE_TABLE).values(
+            haupt=7, unter=99, beschreibung='Neu'))
+        self.engine.connect().execute(insert(EVENT_EVENTTYPE_REFERENCE_TABLE).values(
+            ereignis_id=1950000001, hauptid=7, unterid=99))
+        self.assertEqual('Neu', self.dao.get_by_id(EventTypeIdentifier(7, 99)).description)
+        self.dao.clear_cache()
+        self.dao.find_all()
+        self.engine.connect().execute(insert(EVENTTYPE_TABLE).values(
+            haupt=7, unter=98, beschreibung='Neuer'))
+        self.engine.connect().execute(insert(EVENT_EVENTTYPE_REFERENCE_TABLE).values(
+            ereignis_id=1950000001, hauptid=7, unterid=98))
+        self.assertEqual(['Neuer', 'Neu'], [event_type.description for event_type in
+                                            self.dao.get_event_types_for_event_id(1950000001)
+                                            if event_type.id.hauptid == 7])
+        self.assertEqual(self.dao.get_event_types_for_event_id(1950000001),
+                         self.dao.get_event_types_for_event_ids([1950000001])[1950000001])
+
+    def test_dangling_reference(self):
+        self.engine.connect().execute(insert(EVENT_EVENTTYPE_REFERENCE_TABLE).values(
+            ereignis_id=1950000001, hauptid=99, unterid=99))
+        self.assertRaises(NoSuchEntityException,
+                          self.dao.get_event_types_for_event_id, 1950000001)
+        self.assertRaises(NoSuchEntityException,
+                          self.dao.get_event_types_for_event_ids, [1950000001])
+
+    def test_get_event_types_for_event_ids(self):
+        event_types = self.dao.get_event_types_for_event_ids([1940000001, 1950000001])
+        self.assertEqual(self.dao.get_event_types_for_event_id(1940000001),
+                         event_types[1940000001])
+        self.assertEqual(self.dao.get_event_types_for_event_id(1950000001),
+                         event_types[1950000001])
+        self.assertEqual({}, self.dao.get_event_types_for_event_ids([]))
+
+    def test_clear_cache(self):
+        self.dao.find_all()
+        self.engine.connect().execute(update(EVENTTYPE_TABLE).values(beschreibung='Demo').where(
+            EVENTTYPE_TABLE.c.haupt == 7).where(EVENTTYPE_TABLE.c.unter == 1))
+        self.assertNotEqual('Demo', self.dao.get_by_id(EventTypeIdentifier(7, 1)).description)
+        self.dao.clear_cache()
+        self.assertEqual('Demo', self.dao.get_by_id(EventTypeIdentifier(7, 1)).description)
+
+    def test_unknown_id_reloads_only_once(self):
+        self.dao.find_all()
+        unknown = EventTypeIdentifier(99, 99)
+        self.assertEqual(1, count_statements(
+            self.engine,
+            lambda: self.assertRaises(NoSuchEntityException, self.dao.get_by_id, unknown)))
+        self.assertEqual(0, count_statements(
+            self.engine,
+            lambda: self.assertRaises(NoSuchEntityException, self.dao.get_by_id, unknown)))
+        self.engine.connect().execute(insert(EVENTTYPE_TABLE).values(
+            haupt=99, unter=99, beschreibung='Neu'))
+        self.dao.clear_cache()
+        self.assertEqual('Neu', self.dao.get_by_id(unknown).description)
+
     def test_fetching_tree(self):
         tree = self.dao.get_event_type_tree()
         self.assertEqual(tree.root_node.id, EventTypeIdentifier(0,0))
@@ -0,0 +1,75 @@
+'''
+Tests for the id allocation of the entity daos.
+'''
+import unittest
+
+from daotests.test_base import DatabaseBaseTest
+from sqlalchemy.sql.expression import select
+from alexandriabase import baseinjectorkeys
+from alexandriabase.daos import IdAllocator, IdAllocators, REGISTRY_TABLE,\
+    DOCUMENT_TABLE, CREATOR_TABLE
+from alexandriabase.domain import Creator
+from alexandriabase.base_exceptions import NoSuchEntityException
+
+
+class TestIdAllocator(DatabaseBaseTest):
+
+    def get_registry_value(self, key):
+        connection = self.engine.connect()
+        row = connection.execute(select([REGISTRY_TABLE.c.wert]).where(
+            REGISTRY_TABLE.c.schluessel == key)).fetchone()
+        connection.close()
+        return None if row is None else row[0]
+
+    def test_block_reservation(self):
+        allocator = IdAllocator(DOCUMENT_TABLE.c.hauptnr, 10)
+        connection = self.engine.connect()
+        ids = [allocator.allocate(connection) for _ in range(12)]
+        connection.close()
+        self.assertEqual(list(range(15, 27)), ids)
+        self.assertEqual('35', self.get_registry_value('idblock.dokument'))
+        
+        other_allocator = IdAllocator(DOCUMENT_TABLE.c.hauptnr, 10)
+        connection = self.engine.connect()
+        self.assertEqual(35, other_allocator.allocate(connection))
+        connection.close()
+        self.assertEqual('45', self.get_registry_value('idblock.dokument'))
+
+    def test_shared_allocator(self):
+        allocators = self.injector.get(baseinjectorkeys.ID_ALLOCATORS_KEY)
+        self.assertIs(allocators.get(DOCUMENT_TABLE.c.hauptnr),
+                      allocators.get(DOCUMENT_TABLE.c.laufnr))
+        self.assertIsNot(allocators.get(DOCUMENT_TABLE.c.hauptnr),
+                         allocators.get(CREATOR_TABLE.c.id))
+        self.assertIs(allocators,
+                      self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY).\
+                      dao_services.id_allocators)
+
+    def test_block_size_from_config(self):
+        config = self.injector.get(baseinjectorkeys.CONFIG_KEY)
+        config.idblocksize = '7'
+        allocators = IdAllocators(self.engine, config)
+        self.assertEqual(7, allocators.get(CREATOR_TABLE.c.id).block_size)
+        
+    def test_ids_after_rollback(self):
+        dao = self.injector.get(baseinjectorkeys.CREATOR_DAO_KEY)
+        creator = Creator()
+        creator.name = 'Rollback'
+        def save_and_fail():
+            dao.save(creator)
+            self.assertEqual(3, creator.id)
+            raise ValueError("Roll back")
+        with self.assertRaises(ValueError):
+            dao.transactional(save_and_fail)
+        dao.clear_cache()
+        with self.assertRaises(NoSuchEntityException):
+            dao.get_by_id(3)
+        creator = Creator()
+        creator.name = 'Commit'
+        creator = dao.save(creator)
+        self.assertEqual(3, creator.id)
+        self.assertEqual('Commit', dao.get_by_id(3).name)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
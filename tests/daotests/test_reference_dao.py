@@ -5,8 +5,9 @@ Created on 11.10.2015
 '''
 import unittest
 
+
 from alexandriabase.domain import AlexDate, DocumentEventReferenceFilter
-from daotests.test_base import DatabaseBaseTest
+from daotests.test_base import DatabaseBaseTest, count_statements
 from alexandriabase.daos import DocumentEventRelationsDao,\
     EventFilterExpressionBuilder, DocumentFilterExpressionBuilder
 
@@ -47,6 +48,32 @@ class TestRelationsDao(DatabaseBaseTest):
         # Should not be added again!
         self.assertEqual(len(join_list), 3)
         
+    def test_join_document_linked_by_other_file(self):
+        self.dao.join_document_id_with_event_id(2, 1950000001)
+        self.dao.join_document_id_with_event_id(1, 1950000001)
+        self.assertEqual([2], self.dao.fetch_doc_file_ids_for_event_id(1950000001))
+        self.dao.link_documents_to_event(1950000001, [1, 4])
+        self.assertEqual([2, 4], sorted(self.dao.fetch_doc_file_ids_for_event_id(1950000001)))
+
+    def test_join_is_single_statement(self):
+        self.assertEqual(1, count_statements(
+            self.engine, lambda: self.dao.join_document_id_with_event_id(1, 1940000001)))
+        self.assertEqual([1, 4], self.dao.fetch_doc_file_ids_for_event_id(1940000001))
+
+    def test_link_documents_to_event(self):
+        self.dao.link_documents_to_event(1940000001, [1, 8, 11, 8])
+        self.assertEqual([1, 4, 8, 11], self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.dao.link_documents_to_event(1940000001, [])
+        self.assertEqual([1, 4, 8, 11], self.dao.fetch_document_ids_for_event_id(1940000001))
+
+    def test_link_events_to_document(self):
+        self.dao.link_events_to_document(8, [1940000001, 1950000001])
+        self.assertEqual([1940000001, 1950000001],
+                         self.dao.fetch_ereignis_ids_for_dokument_id(8))
+        self.dao.link_events_to_document(8, [1940000001, 1960013001])
+        self.assertEqual([1940000001, 1950000001, 1960013001],
+                         self.dao.fetch_ereignis_ids_for_dokument_id(8))
+
     def test_remove_join_document_to_event(self):
         join_list = self.dao.fetch_doc_file_ids_for_event_id(1940000001)
         self.assertEqual(len(join_list), 2)
@@ -133,6 +160,28 @@ class TestRelationsDao(DatabaseBaseTest):
         self.assertIn(1940000001, references[1])
         self.assertIn(1, references)
 
+    def test_iter_doc_event_references(self):
+        
+        references = list(self.dao.iter_doc_event_references(DocumentEventReferenceFilter()))
+        self.assertEqual([1, 4, 8, 11, 12, 13, 14],
+                         [document_id for document_id, _event_ids in references])
+        self.assertEqual((4, [1940000001, 1960013001]), references[1])
+
+    def test_fetch_doc_event_references_compact(self):
+        
+        der_filter = DocumentEventReferenceFilter()
+        der_filter.latest_date = AlexDate(1950)
+        references = self.dao.fetch_doc_event_references_compact(der_filter)
+        self.assertEqual(2, len(references))
+        self.assertEqual([1, 4], list(references.document_ids))
+        self.assertEqual([0, 1, 2], list(references.offsets))
+        self.assertEqual([1940000001], list(references.get_event_ids(4)))
+        self.assertIn(1, references)
+        self.assertNotIn(8, references)
+        self.assertRaises(KeyError, references.get_event_ids, 8)
+        self.assertEqual(self.dao.fetch_doc_event_references(der_filter),
+                         {document_id: list(event_ids) for document_id, event_ids in references})
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
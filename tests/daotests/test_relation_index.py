@@ -0,0 +1,103 @@
+'''
+Tests for the in-memory document event relation index.
+'''
+import unittest
+
+from sqlalchemy.sql.expression import insert
+from alexandriabase import baseinjectorkeys
+from alexandriabase.daos import RelationIndex, CacheVersionStamp,\
+    DOCUMENT_EVENT_REFERENCE_TABLE
+from alexandriabase.domain import AlexDateRange
+from daotests.test_base import DatabaseBaseTest, FakeClock, count_statements,\
+    recorded_statements
+
+
+class TestRelationIndex(DatabaseBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.dao = self.injector.get(baseinjectorkeys.RELATIONS_DAO_KEY)
+        self.clock = FakeClock()
+        self.event_ids = {document_id: self.dao.fetch_ereignis_ids_for_dokument_id(document_id)
+                          for document_id in (1, 4, 8, 11)}
+        self.document_ids = {event_id: self.dao.fetch_document_ids_for_event_id(event_id)
+                             for event_id in (1940000001, 1950000001, 1960013001)}
+        self.dao_services = self.injector.get(baseinjectorkeys.DAO_SERVICES_KEY)
+        self.dao_services.relation_index = RelationIndex(
+            CacheVersionStamp('relations', 10, self.clock))
+
+    def test_lookups(self):
+        self.assertIs(self.dao_services, self.dao.dao_services)
+        for document_id, event_ids in self.event_ids.items():
+            self.assertEqual(event_ids, self.dao.fetch_ereignis_ids_for_dokument_id(document_id))
+        for event_id, document_ids in self.document_ids.items():
+            self.assertEqual(document_ids, self.dao.fetch_document_ids_for_event_id(event_id))
+        self.assertEqual(0, count_statements(
+            self.engine, lambda: self.dao.fetch_document_ids_for_event_id(1940000001)))
+
+    def test_join_and_delete(self):
+        self.dao.join_document_id_with_event_id(8, 1940000001)
+        self.assertIn(1940000001, self.dao.fetch_ereignis_ids_for_dokument_id(8))
+        self.assertIn(8, self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.dao.delete_document_event_relation(8, 1940000001)
+        self.assertNotIn(8, self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.assertNotIn(1940000001, self.dao.fetch_ereignis_ids_for_dokument_id(8))
+
+    def test_bulk_link(self):
+        self.dao.link_documents_to_event(1950000001, [8, 11])
+        self.assertEqual([8, 11], self.dao.fetch_document_ids_for_event_id(1950000001))
+        self.assertIn(1950000001, self.dao.fetch_ereignis_ids_for_dokument_id(11))
+
+    def test_delete_unlinks_all_files(self):
+        self.dao.join_document_id_with_event_id(2, 1950000001)
+        self.assertIn(1, self.dao.fetch_document_ids_for_event_id(1950000001))
+        self.dao.delete_document_event_relation(1, 1950000001)
+        self.assertNotIn(1, self.dao.fetch_document_ids_for_event_id(1950000001))
+        self.assertEqual([], self.dao.fetch_doc_file_ids_for_event_id(1950000001))
+
+    def test_one_version_bump_per_transaction(self):
+        self.dao.fetch_document_ids_for_event_id(1940000001)
+        link_connections = []
+        def link_twice():
+            link_connections.append(self.dao.transactional_connection)
+            self.dao.join_document_id_with_event_id(8, 1950000001)
+            self.dao.join_document_id_with_event_id(11, 1950000001)
+        with recorded_statements(self.engine) as statements:
+            self.dao.transactional(link_twice)
+        bumps = [recorded.connection for recorded in statements
+                 if recorded.statement.startswith('UPDATE registry')]
+        self.assertEqual(1, len(bumps))
+        self.assertIsNot(link_connections[0], bumps[0])
+        self.assertEqual([8, 11], self.dao.fetch_document_ids_for_event_id(1950000001))
+
+    def test_entity_deletion(self):
+        self.dao.fetch_document_ids_for_event_id(1940000001)
+        self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY).delete(1)
+        self.assertNotIn(1, self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.injector.get(baseinjectorkeys.EVENT_DAO_KEY).delete_many([1940000001])
+        self.assertEqual([], self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.assertNotIn(1940000001, self.dao.fetch_ereignis_ids_for_dokument_id(4))
+
+    def test_event_date_change(self):
+        document_ids = self.dao.fetch_document_ids_for_event_id(1940000001)
+        event_dao = self.injector.get(baseinjectorkeys.EVENT_DAO_KEY)
+        changed_event = event_dao.get_by_id(1940000001)
+        changed_event.daterange = AlexDateRange(1950000000, None)
+        event_dao.save(changed_event)
+        self.assertEqual([], self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.assertEqual(document_ids, self.dao.fetch_document_ids_for_event_id(1950000002))
+
+    def test_changes_of_other_processes(self):
+        self.assertNotIn(8, self.dao.fetch_document_ids_for_event_id(1940000001))
+        connection = self.engine.connect()
+        connection.execute(insert(DOCUMENT_EVENT_REFERENCE_TABLE).values(
+            ereignis_id=1940000001, laufnr=8))
+        CacheVersionStamp('relations').bump(connection)
+        connection.close()
+        self.assertNotIn(8, self.dao.fetch_document_ids_for_event_id(1940000001))
+        self.clock.now = 11
+        self.assertIn(8, self.dao.fetch_document_ids_for_event_id(1940000001))
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
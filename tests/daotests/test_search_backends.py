@@ -0,0 +1,141 @@
+'''
+Tests for the search backends of the filter expression builders.
+'''
+import unittest
+
+from injector import Injector
+from sqlalchemy.dialects import postgresql
+
+from alexandriabase import AlexBaseModule, baseinjectorkeys
+from alexandriabase.base_exceptions import DataError
+from alexandriabase.daos import DaoModule, DocumentFilterExpressionBuilder,\
+    EventFilterExpressionBuilder, SqliteFtsSearchBackend, PostgresSearchBackend,\
+    LikeSearchBackend, DOCUMENT_TABLE
+from alexandriabase.domain import DocumentFilter, EventFilter, Document
+from alexandriabase.services import UpdateFrom0_5
+from daotests.test_base import DatabaseBaseTest
+from alex_test_utils import TestEnvironment
+
+
+class TestSqliteFtsSearchBackend(DatabaseBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.dao = self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY)
+        self.event_dao = self.injector.get(baseinjectorkeys.EVENT_DAO_KEY)
+        with self.engine.begin() as connection:
+            UpdateFrom0_5(connection, 'sqlite').create_sqlite_search_index()
+        search_backend = SqliteFtsSearchBackend()
+        self.document_filter_handler = DocumentFilterExpressionBuilder(search_backend)
+        self.event_filter_handler = EventFilterExpressionBuilder(search_backend)
+
+    def _find_document_ids(self, searchterms, case_sensitive=True, combine_by_or=True):
+        document_filter = DocumentFilter()
+        document_filter.searchterms = searchterms
+        document_filter.case_sensitive = case_sensitive
+        document_filter.combine_searchterms_by_or = combine_by_or
+        filter_expression = self.document_filter_handler.create_filter_expression(
+            document_filter)
+        return [document.id for document in self.dao.find(filter_expression)]
+
+    def test_search(self):
+        self.assertEqual([4], self._find_document_ids(["weit"]))
+        self.assertEqual([4, 8], self._find_document_ids(["ritt", "weit"]))
+        self.assertEqual([4, 8], self._find_document_ids(["RITT", "WEIT"], False))
+        self.assertEqual([], self._find_document_ids(["unsinn"]))
+
+    def test_short_searchterms(self):
+        self.assertEqual(2, len(self._find_document_ids(["r", "i"], combine_by_or=False)))
+
+    def test_index_follows_changes(self):
+        document = Document()
+        document.description = "Ein neues Flugblatt"
+        document.document_type = self.injector.get(
+            baseinjectorkeys.DOCUMENT_TYPE_DAO_KEY).get_by_id(5)
+        self.dao.save(document)
+        self.assertEqual([15], self._find_document_ids(["neues"]))
+        document = self.dao.get_by_id(15)
+        document.description = "Ein altes Flugblatt"
+        self.dao.save(document)
+        self.assertEqual([], self._find_document_ids(["neues"]))
+        self.dao.delete(15)
+        self.assertEqual([], self._find_document_ids(["altes"]))
+
+    def test_event_search(self):
+        event_filter = EventFilter()
+        event_filter.searchterms = ['weit', 'ritt', 'Zwei']
+        filter_expression = self.event_filter_handler.create_filter_expression(event_filter)
+        like_expression = EventFilterExpressionBuilder().create_filter_expression(event_filter)
+        self.assertEqual([event.id for event in self.event_dao.find(like_expression)],
+                         [event.id for event in self.event_dao.find(filter_expression)])
+
+class TestPostgresSearchBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.search_backend = PostgresSearchBackend()
+
+    def _compile(self, case_sensitive):
+        expression = self.search_backend.build_searchterm_expression(
+            DOCUMENT_TABLE.c.beschreibung, "100%_sicher", case_sensitive)
+        return expression.compile(dialect=postgresql.dialect())
+
+    def test_case_insensitive_search(self):
+        compiled = self._compile(False)
+        self.assertEqual("upper(dokument.beschreibung) LIKE upper(%(upper_1)s) " +
+                         "ESCAPE '\\\\'", str(compiled))
+        self.assertEqual(['%100\\%\\_sicher%'], list(compiled.params.values()))
+
+    def test_case_sensitive_search(self):
+        compiled = self._compile(True)
+        self.assertIn("upper(dokument.beschreibung) LIKE upper(", str(compiled))
+        self.assertIn("dokument.beschreibung LIKE %(beschreibung_1)s", str(compiled))
+        self.assertEqual(['%100\\%\\_sicher%'] * 2, list(compiled.params.values()))
+
+class TestLikeSearchBackend(DatabaseBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.dao = self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY)
+        self.document_filter_handler = DocumentFilterExpressionBuilder(LikeSearchBackend())
+
+    def _find_document_ids(self, searchterms, case_sensitive=True):
+        document_filter = DocumentFilter()
+        document_filter.searchterms = searchterms
+        document_filter.case_sensitive = case_sensitive
+        filter_expression = self.document_filter_handler.create_filter_expression(
+            document_filter)
+        return [document.id for document in self.dao.find(filter_expression)]
+
+    def test_wildcards_are_escaped(self):
+        self.assertEqual([], self._find_document_ids(["%"]))
+        self.assertEqual([], self._find_document_ids(["_"], False))
+        self.assertEqual([], self._find_document_ids(["we_t"]))
+        self.assertEqual([4], self._find_document_ids(["weit"]))
+
+class TestSearchBackendConfiguration(unittest.TestCase):
+
+    def setUp(self):
+        self.env = TestEnvironment()
+
+    def tearDown(self):
+        self.env.cleanup()
+
+    def _get_search_backend(self):
+        injector = Injector([AlexBaseModule(), DaoModule()])
+        return injector.get(baseinjectorkeys.SEARCH_BACKEND_KEY)
+
+    def test_default_backend(self):
+        self.assertEqual(LikeSearchBackend, type(self._get_search_backend()))
+
+    def test_configured_backend(self):
+        self.env.config.searchbackend = 'sqlitefts'
+        self.env.config.write_config()
+        self.assertEqual(SqliteFtsSearchBackend, type(self._get_search_backend()))
+
+    def test_unknown_backend(self):
+        self.env.config.searchbackend = 'lucene'
+        self.env.config.write_config()
+        self.assertRaises(DataError, self._get_search_backend)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -75,6 +75,18 @@ class Test(unittest.TestCase):
         self.base_service.get_previous(entity, filter_expression)
         self.dao.get_previous.assert_called_with(entity, filter_expression)
         
+    def testCreateCursor(self):
+        filter_expression = MagicMock()
+        self.base_service.create_cursor(filter_expression)
+        self.dao.create_cursor.assert_called_with(filter_expression, background=False)
+        self.base_service.create_cursor(filter_expression, background=True)
+        self.dao.create_cursor.assert_called_with(filter_expression, background=True)
+        
+    def testCreateFilterSnapshot(self):
+        filter_expression = MagicMock()
+        self.base_service.create_filter_snapshot(filter_expression)
+        self.dao.create_filter_snapshot.assert_called_with(filter_expression)
+        
     def testGetFilterExpression(self):
         filter_object = MagicMock()
         self.base_service.create_filter_expression(filter_object)
@@ -85,6 +97,16 @@ class Test(unittest.TestCase):
         self.base_service.save(entity)
         self.dao.save.assert_called_once_with(entity)
 
+    def test_find(self):
+        condition = MagicMock()
+        entities = [Entity(1), Entity(2)]
+        self.dao.find_with_count.return_value = (entities, 5)
+        result = self.base_service.find(condition, 1, 2)
+        self.dao.find_with_count.assert_called_once_with(condition, 1, 2)
+        self.assertEqual(entities, result.entities)
+        self.assertEqual(3, result.number_of_pages)
+        self.dao.get_count.assert_not_called()
+
     def test_delete(self):
         entity = Entity(4711)
         self.base_service.delete(entity)
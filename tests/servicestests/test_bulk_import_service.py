@@ -0,0 +1,94 @@
+'''
+Tests for the bulk import service.
+'''
+import unittest
+
+from alexandriabase import baseinjectorkeys
+from alexandriabase.base_exceptions import DataError
+from alexandriabase.domain import Document, DocumentFileInfo, Event, AlexDateRange
+from alexandriabase.services import BulkImportService, UnsupportedFileFormat
+from daotests.test_base import DatabaseBaseTest
+
+
+class BulkImportServiceTest(DatabaseBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        config = self.injector.get(baseinjectorkeys.CONFIG_KEY)
+        config.importtransactionsize = '3'
+        config.importbatchsize = '2'
+        self.document_dao = self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY)
+        self.file_info_dao = self.injector.get(baseinjectorkeys.DOCUMENT_FILE_INFO_DAO_KEY)
+        self.event_dao = self.injector.get(baseinjectorkeys.EVENT_DAO_KEY)
+        self.service = BulkImportService(config, self.document_dao,
+                                         self.file_info_dao, self.event_dao)
+        self.document_type = self.injector.get(
+            baseinjectorkeys.DOCUMENT_TYPE_DAO_KEY).get_by_id(1)
+
+    def create_documents(self, count):
+        for number in range(count):
+            document = Document()
+            document.description = "Imported %d" % number
+            document.document_type = self.document_type
+            yield document
+
+    def test_sizes(self):
+        self.assertEqual(3, self.service.transaction_size)
+        self.assertEqual(2, self.service.batch_size)
+
+    def test_import_documents(self):
+        with self.assertLogs("alexandriabase.services.bulkimportservice", "INFO") as logs:
+            self.assertEqual(7, self.service.import_documents(self.create_documents(7)))
+        self.assertEqual(3, len(logs.output))
+        self.assertEqual("Imported 6", self.document_dao.get_by_id(21).description)
+
+    def test_import_file_infos(self):
+        infos = []
+        for filetype in ('jpg', 'tif', 'gif'):
+            info = DocumentFileInfo()
+            info.document_id = 1
+            info.filetype = filetype
+            infos.append(info)
+        self.assertEqual(3, self.service.import_file_infos(infos))
+        self.assertEqual(['tif', 'jpg', 'tif', 'gif'],
+                         [info.filetype for info in
+                          self.file_info_dao.get_file_infos_for_document(1)][2:])
+
+    def test_import_events(self):
+        events = []
+        for number in range(4):
+            event = Event()
+            event.daterange = AlexDateRange(1970010100, None)
+            event.description = "Imported %d" % number
+            event.status_id = 0
+            events.append(event)
+        self.assertEqual(4, self.service.import_events(events))
+        self.assertEqual(4, len(self.event_dao.get_events_for_date(
+            events[0].daterange.start_date)))
+        self.assertEqual(1970010104, events[3].id)
+
+    def test_validation(self):
+        file_info_count = self.file_info_dao.get_count()
+        documents = list(self.create_documents(2))
+        documents[1].document_type = None
+        self.assertRaises(DataError, self.service.import_documents, documents)
+        info = DocumentFileInfo()
+        info.document_id = 1
+        info.filetype = 'exe'
+        self.assertRaises(UnsupportedFileFormat, self.service.import_file_infos, [info])
+        info.filetype = 'jpg'
+        info.page = 1
+        self.assertRaises(DataError, self.service.import_file_infos, [info])
+        unknown_document_info = DocumentFileInfo()
+        unknown_document_info.document_id = 4711
+        unknown_document_info.filetype = 'jpg'
+        self.assertRaises(DataError, self.service.import_file_infos,
+                          [unknown_document_info])
+        self.assertEqual(file_info_count, self.file_info_dao.get_count())
+        self.assertRaises(DataError, self.service.import_events, [Event()])
+        self.assertRaises(DataError, self.service.import_events,
+                          [self.event_dao.get_by_id(1940000001)])
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -4,10 +4,15 @@ Created on 28.06.2016
 @author: michael
 '''
 import unittest
-from alexandriabase.services import DatabaseUpgradeService
-from daotests.test_base import DatabaseBaseTest
+from unittest.mock import MagicMock
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import text
+from alexandriabase import baseinjectorkeys
+from alexandriabase.services import DatabaseUpgradeService, UpdateFrom0_5
+from alexandriabase.domain import DocumentFilter
+from daotests.test_base import DatabaseBaseTest, recorded_statements
 
-from alexandriabase.daos import RegistryDao
+from alexandriabase.daos import RegistryDao, DocumentFilterExpressionBuilder
 
 
 class DatabaseUpgradeServiceTest(DatabaseBaseTest):
@@ -27,6 +32,67 @@ class DatabaseUpgradeServiceTest(DatabaseBaseTest):
         self.upgrade_service.run_update()
         self.assertFalse(self.upgrade_service.is_update_necessary())
 
+    def testDuplicateLinksAreRemoved(self):
+        # Legacy databases may lack the primary key of dverweis
+        with self.engine.connect() as connection:
+            for statement in (
+                    "drop table dverweis",
+                    "create table dverweis (ereignis_id integer, laufnr integer)",
+                    "insert into dverweis (ereignis_id, laufnr) values (1940000001, 1)",
+                    "insert into dverweis (ereignis_id, laufnr) values (1940000001, 1)",
+                    "insert into dverweis (ereignis_id, laufnr) values (1940000001, 4)"):
+                connection.execute(text(statement))
+        self.upgrade_service.run_update()
+        references_dao = self.injector.get(baseinjectorkeys.RELATIONS_DAO_KEY)
+        self.assertEqual([1, 4], references_dao.fetch_doc_file_ids_for_event_id(1940000001))
+        with self.engine.connect() as connection:
+            self.assertRaises(IntegrityError, connection.execute, text(
+                "insert into dverweis (ereignis_id, laufnr) values (1940000001, 1)"))
+
+    def get_query_plan(self, dao_call):
+        '''
+        Runs the dao call and returns the query plans of the
+        select statements it executes.
+        '''
+        with recorded_statements(self.engine) as statements:
+            dao_call()
+        connection = self.engine.raw_connection()
+        plan = []
+        for recorded in statements:
+            if not recorded.statement.startswith('SELECT') or 'registry' in recorded.statement:
+                continue
+            cursor = connection.cursor()
+            cursor.execute("EXPLAIN QUERY PLAN " + recorded.statement, recorded.parameters)
+            plan += [row[-1] for row in cursor.fetchall()]
+            cursor.close()
+        connection.close()
+        return "\n".join(plan)
+
+    def testIndexesAreUsed(self):
+        self.upgrade_service.run_update()
+        file_info_dao = self.injector.get(baseinjectorkeys.DOCUMENT_FILE_INFO_DAO_KEY)
+        references_dao = self.injector.get(baseinjectorkeys.RELATIONS_DAO_KEY)
+        event_type_dao = self.injector.get(baseinjectorkeys.EVENT_TYPE_DAO_KEY)
+        cross_references_dao = self.injector.get(
+            baseinjectorkeys.EVENT_CROSS_REFERENCES_DAO_KEY)
+        document_dao = self.injector.get(baseinjectorkeys.DOCUMENT_DAO_KEY)
+        document_filter = DocumentFilter()
+        document_filter.document_type = 5
+        document_filter.signature = 'III'
+        filter_expression = DocumentFilterExpressionBuilder().\
+            create_filter_expression(document_filter)
+        expected_indexes = (
+            (lambda: file_info_dao.get_file_infos_for_document(1), 'dokument_hauptnr_idx'),
+            (lambda: references_dao.fetch_ereignis_ids_for_dokument_id(1),
+             'dverweis_laufnr_ereignis_id_idx'),
+            (lambda: event_type_dao.get_event_types_for_event_id(1940000001),
+             'everweis_ereignis_id_idx'),
+            (lambda: cross_references_dao.get_cross_references(1940000001),
+             'qverweis_id1_idx'),
+            (lambda: document_dao.find(filter_expression), 'dokument_doktyp_idx'))
+        for dao_call, index in expected_indexes:
+            self.assertIn(index, self.get_query_plan(dao_call))
+
     def testFailingUpgrade(self):
         registry_dao = RegistryDao(self.engine)
         registry_dao.set('version', 'not_existing')
@@ -38,6 +104,21 @@ class DatabaseUpgradeServiceTest(DatabaseBaseTest):
             expected_exception = True
         self.assertTrue(expected_exception)
         
+class UpdateFrom0_5Test(unittest.TestCase):
+
+    def testPostgresIndexes(self):
+        connection = MagicMock()
+        UpdateFrom0_5(connection, 'postgresql').run()
+        statements = [str(call[0][0]) for call in connection.execute.call_args_list]
+        self.assertIn("create index if not exists dokument_hauptnr_idx " +
+                      "on dokument (hauptnr, seite)", statements)
+        trigram_indexes = [statement for statement in statements if 'gin_trgm_ops' in statement]
+        self.assertEqual(["create index if not exists dokument_upper_beschreibung_trgm " +
+                          "on dokument using gin (upper(beschreibung) gin_trgm_ops)",
+                          "create index if not exists chrono_upper_ereignis_trgm " +
+                          "on chrono using gin (upper(ereignis) gin_trgm_ops)"],
+                         trigram_indexes)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
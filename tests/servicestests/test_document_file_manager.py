@@ -310,6 +310,27 @@ class DocumentFileManagerTests(unittest.TestCase):
             self.assertTrue(os.path.isfile(path_after))
 
 
+    def test_delete_files(self):
+
+        file_infos = [self.env.document_file_infos[i] for i in (5, 6, 1)]
+        file_paths = self.document_file_manager.delete_files(file_infos)
+        for i in (5, 6, 1):
+            self.assertFalse(os.path.isfile(self.env.file_paths[i]))
+            self.assertTrue(os.path.isfile("%s.deleted" % self.env.file_paths[i]))
+        self.document_file_manager.restore_files(file_paths)
+        for i in (5, 6, 1):
+            self.assertTrue(os.path.isfile(self.env.file_paths[i]))
+            self.assertFalse(os.path.isfile("%s.deleted" % self.env.file_paths[i]))
+
+    def test_delete_files_with_missing_file(self):
+
+        missing_file_info = DocumentFileInfo(4711)
+        missing_file_info.filetype = 'jpg'
+        file_infos = [self.env.document_file_infos[5], missing_file_info]
+        self.assertRaises(DocumentFileNotFound,
+                          self.document_file_manager.delete_files, file_infos)
+        self.assertTrue(os.path.isfile(self.env.file_paths[5]))
+
     def test_delete_generated_file(self):
         
         document_file_info = self.env.document_file_infos[1]
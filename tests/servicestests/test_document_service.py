@@ -66,6 +66,32 @@ class DocumentServiceTest(unittest.TestCase):
         self.document_file_manager.delete_file.call_args_list = [call(file_infos[0]), call(file_infos[1])]
         self.document_dao.delete.assert_called_once_with(1)
         
+    def test_delete_many(self):
+        
+        file_infos = [DocumentFileInfo(1), DocumentFileInfo(2), DocumentFileInfo(3)]
+        self.document_file_info_dao.get_file_infos_for_documents = \
+            MagicMock(return_value=file_infos)
+        self.document_dao.delete_many = MagicMock(return_value=2)
+        
+        self.assertEqual(2, self.service.delete_many([Document(1), Document(3)]))
+        
+        self.document_file_info_dao.get_file_infos_for_documents.assert_called_once_with([1, 3])
+        self.document_file_manager.delete_files.assert_called_once_with(file_infos)
+        self.document_dao.delete_many.assert_called_once_with([1, 3])
+        self.document_file_manager.restore_files.assert_not_called()
+
+    def test_delete_many_restores_files_on_failure(self):
+
+        file_infos = [DocumentFileInfo(1), DocumentFileInfo(2)]
+        self.document_file_info_dao.get_file_infos_for_documents = \
+            MagicMock(return_value=file_infos)
+        self.document_file_manager.delete_files = MagicMock(return_value=['a', 'b'])
+        self.document_dao.delete_many = MagicMock(side_effect=Exception("Database failure"))
+
+        self.assertRaises(Exception, self.service.delete_many, [Document(1)])
+
+        self.document_file_manager.restore_files.assert_called_once_with(['a', 'b'])
+        
     def test_get_file_infos_for_document(self):
 
         document = Document(1)
@@ -138,16 +164,16 @@ class DocumentServiceTest(unittest.TestCase):
 
     def test_find_all_entities(self):
 
-        self.document_dao.get_count.return_value = 5
-        self.document_dao.find.return_value = [Document(1), Document(2), Document(3), Document(4), Document(5)]
+        self.document_dao.find_with_count.return_value = (
+            [Document(1), Document(2), Document(3), Document(4), Document(5)], 5)
         result = self.service.find(None, 1, 10)
         self.assertEqual(5, len(result.entities))
         self.assertEqual(1, result.number_of_pages)
         
     def test_find_paginated_entities(self):
-        self.document_dao.get_count.return_value = 5
-        self.document_dao.find.side_effect = ([Document(1), Document(4), Document(8)],
-                                              [Document(11), Document(12)])
+        self.document_dao.find_with_count.side_effect = (
+            ([Document(1), Document(4), Document(8)], 5),
+            ([Document(11), Document(12)], 5))
         result = self.service.find(None, 1, 3)
         self.assertEqual(3, len(result.entities))
         self.assertEqual(1, result.entities[0].id)
@@ -161,9 +187,9 @@ class DocumentServiceTest(unittest.TestCase):
         self.assertEqual(2, result.number_of_pages)
         
     def test_find_paginated_entities_with_filter(self):
-        self.document_dao.get_count.return_value = 4
-        self.document_dao.find.side_effect = ([Document(4), Document(8)],
-                                              [Document(11), Document(12)])
+        self.document_dao.find_with_count.side_effect = (
+            ([Document(4), Document(8)], 4),
+            ([Document(11), Document(12)], 4))
         where = "egal" 
         result = self.service.find(where, 1, 2)
         self.assertEqual(2, len(result.entities))
@@ -57,18 +57,34 @@ class Test(unittest.TestCase):
         event2_stub.id = 2
         event3_stub = MagicMock()
         event3_stub.id = 3
-        values = {2: event2_stub, 3: event3_stub}
-        def side_effect(arg):
-            return values[arg]
-        self.event_dao.get_by_id = MagicMock(side_effect=side_effect)
+        self.event_dao.get_by_ids = MagicMock(return_value=[event2_stub, event3_stub])
         # Execution
         result = self.event_service.get_cross_references(event1_stub)
         # Assertion
         self.event_crossreferences_dao.get_cross_references.assert_called_once_with(1)
+        self.event_dao.get_by_ids.assert_called_once_with([2, 3])
         self.assertEqual(len(result), 2)
         self.assertIn(event2_stub, result)
         self.assertIn(event3_stub, result)
         
+    def testGetCrossReferenceGraph(self):
+        event1_stub = MagicMock()
+        event1_stub.id = 1
+        graph_stub = MagicMock()
+        graph_stub.event_ids = [1, 2]
+        self.event_crossreferences_dao.get_cross_reference_graph = MagicMock(
+            return_value=graph_stub)
+        event2_stub = MagicMock()
+        event2_stub.id = 2
+        self.event_dao.get_by_ids = MagicMock(return_value=[event1_stub, event2_stub])
+        # Execution
+        graph, events = self.event_service.get_cross_reference_graph(event1_stub, 3)
+        # Assertion
+        self.event_crossreferences_dao.get_cross_reference_graph.assert_called_once_with(1, 3)
+        self.event_dao.get_by_ids.assert_called_once_with([1, 2])
+        self.assertIs(graph, graph_stub)
+        self.assertEqual({1: event1_stub, 2: event2_stub}, events)
+
     def testGetCrossReferencesWithNone(self):
         result = self.event_service.get_cross_references(None)
         # Assertion
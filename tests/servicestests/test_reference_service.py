@@ -30,14 +30,12 @@ class Test(unittest.TestCase):
         event1_stub.id = 2
         event2_stub = MagicMock()
         event2_stub.id = 3
-        values = {2: event1_stub, 3: event2_stub}
-        def side_effect(arg):
-            return values[arg]
-        self.event_dao.get_by_id = MagicMock(side_effect=side_effect)
+        self.event_dao.get_by_ids = MagicMock(return_value=[event1_stub, event2_stub])
         # Execution
         result = self.service.get_events_referenced_by_document(document_stub)
         # Assertion
         self.references_dao.fetch_ereignis_ids_for_dokument_id.assert_called_once_with(1)
+        self.event_dao.get_by_ids.assert_called_once_with([2, 3])
         self.assertEqual(len(result), 2)
         self.assertIn(event1_stub, result)
         self.assertIn(event2_stub, result)
@@ -52,14 +50,12 @@ class Test(unittest.TestCase):
         document1_stub.id = 2
         document2_stub = MagicMock()
         document2_stub.id = 3
-        values = {2: document1_stub, 3: document2_stub}
-        def side_effect(arg):
-            return values[arg]
-        self.document_dao.get_by_id = MagicMock(side_effect=side_effect)
+        self.document_dao.get_by_ids = MagicMock(return_value=[document1_stub, document2_stub])
         # Execution
         result = self.service.get_documents_referenced_by_event(event_stub)
         # Assertion
         self.references_dao.fetch_document_ids_for_event_id.assert_called_once_with(1)
+        self.document_dao.get_by_ids.assert_called_once_with([2, 3])
         self.assertEqual(len(result), 2)
         self.assertIn(document1_stub, result)
         self.assertIn(document2_stub, result)
@@ -75,6 +71,30 @@ class Test(unittest.TestCase):
 
         self.references_dao.join_document_id_with_event_id.assert_called_once_with(2, 1)
 
+    def testLinkDocumentsToEvent(self):
+        event_stub = MagicMock(spec=Event)
+        event_stub.id = 1
+
+        document_stubs = [MagicMock(spec=Document), MagicMock(spec=Document)]
+        document_stubs[0].id = 2
+        document_stubs[1].id = 3
+        
+        self.service.link_documents_to_event(document_stubs, event_stub)
+
+        self.references_dao.link_documents_to_event.assert_called_once_with(1, [2, 3])
+
+    def testLinkEventsToDocument(self):
+        event_stubs = [MagicMock(spec=Event), MagicMock(spec=Event)]
+        event_stubs[0].id = 1
+        event_stubs[1].id = 4
+
+        document_stub = MagicMock(spec=Document)
+        document_stub.id = 2
+        
+        self.service.link_events_to_document(event_stubs, document_stub)
+
+        self.references_dao.link_events_to_document.assert_called_once_with(2, [1, 4])
+
     def testDeleteDocumentEventRelation(self):
         event_stub = MagicMock(spec=Event)
         event_stub.id = 1